@@ -1,3 +1,116 @@
+import os
+
 APP_VERSION = 1
 TCP_TIMEOUT = 10
-TCP_ENABLED = True
\ No newline at end of file
+TCP_ENABLED = True
+
+# Tiempo de espera tras el primer chunk cuando el servidor no usa framing
+TCP_TAIL_TIMEOUT = 1.5
+TCP_CHUNK_SIZE = 64 * 1024  # Bytes por recv_into
+# Tamaño máximo de una respuesta. Las respuestas con arrays grandes (controlPendientes)
+# se desencriptan y parsean por bloques, así que la memoria no crece varias veces este valor
+TCP_MAX_RESPUESTA = 4 * 1024 * 1024
+# En las vistas async, las respuestas más grandes que esto se desencriptan y parsean
+# en un thread para no frenar el event loop (y con él a los demás requests del worker)
+TCP_DECODIFICAR_EN_THREAD = 64 * 1024
+
+# Framing de respuestas por defecto: None (lectura por timeout), "longitud" o "terminador".
+# Cada servidor puede sobreescribirlo en la cookie connection_config.
+TCP_FRAMING = None
+TCP_TERMINADOR = 0  # Byte terminador usado en framing "terminador" (fuera de 65-201, ver tcp_client)
+
+# El servidor VFP acepta el comando RegistrarStockControladoLote
+# (cada servidor puede declararlo con "lote" en connection_config)
+TCP_COMANDO_LOTE = False
+REGISTRO_LOTE_MAX = 200            # Items máximos por request a /registrar-lote/
+REGISTRO_LOTE_TAMANIO = 10         # El frontend envía la cola al llegar a este tamaño...
+REGISTRO_LOTE_DEMORA_MS = 3000     # ...o después de esta demora desde el primer item
+
+# Registros con clave de idempotencia (la genera el navegador por cada control):
+# un reintento con la misma clave se responde sin volver a enviarlo a VFP
+REGISTRO_IDEMPOTENCIA_TTL = 24 * 3600
+REGISTRO_EN_CURSO_TTL = 60       # Vencimiento de la reserva si el worker muere enviando
+# Registro diferido: /registrar/ y /registrar-lote/ guardan el control en la
+# base (modelo RegistroDiferido), responden 202 enseguida y un thread de cada
+# worker lo envía a VFP en lotes. El navegador consulta el resultado en /registrar/estado/
+REGISTRO_DIFERIDO = False
+REGISTRO_DIFERIDO_LOTE = 50             # Registros por vaciado (agrupados por usuario y servidor)
+REGISTRO_DIFERIDO_INTERVALO = 1.0       # Segundos entre vaciados sin novedades
+REGISTRO_DIFERIDO_REINTENTO_MIN = 2     # Espera creciente entre intentos sin respuesta de VFP...
+REGISTRO_DIFERIDO_REINTENTO_MAX = 300   # ...hasta este máximo (segundos)
+REGISTRO_DIFERIDO_INTENTOS_MAX = 50     # Después se da por rechazado
+REGISTRO_DIFERIDO_ENVIANDO_TTL = 120    # Un "enviando" más viejo (worker caído) se vuelve a tomar
+REGISTRO_DIFERIDO_CONSULTA_MS = 2000    # Cada cuánto consulta el navegador los registros aceptados
+REGISTRO_DIFERIDO_RETENCION = 24 * 3600  # Los registrados/rechazados se borran después de este tiempo...
+REGISTRO_DIFERIDO_PURGA_INTERVALO = 300  # ...revisando como mucho una vez por este intervalo en cada worker
+# El navegador registra en segundo plano (cola en IndexedDB) y recarga la lista
+# completa solo a pedido o cada este intervalo (0 = nunca)
+PENDIENTES_REFRESCO_MS = 60000
+
+# El servidor VFP responde controlPendientes con deltas (altas/bajas desde la
+# VersionPendientes enviada) en vez de la lista completa ("delta" en connection_config)
+TCP_PENDIENTES_DELTA = False
+
+# controlStock_view trae los pendientes junto con verificarToken y los renderiza
+# en la página (un solo intercambio con VFP). También con ?inline=1
+PENDIENTES_INLINE = False
+
+# Tabla de pendientes en el navegador: con más filas que este umbral solo se
+# renderizan las visibles (scroll virtual)
+PENDIENTES_VIRTUAL_UMBRAL = 200
+# /pendientes/ con ?offset=&limit=&q= devuelve una página de la lista filtrada
+# (limit como máximo PENDIENTES_PAGINA_MAX). Con PENDIENTES_PAGINA > 0 el
+# navegador pide la lista de a páginas de ese tamaño y busca en el servidor
+PENDIENTES_PAGINA = 0
+PENDIENTES_PAGINA_MAX = 1000
+# Índices de búsqueda/paginación (uno por snapshot de pendientes) que guarda cada worker
+INDICES_PENDIENTES_MAX = 64
+
+# Pool de conexiones persistentes (solo para servidores con capacidad "keepalive")
+TCP_KEEPALIVE = False
+TCP_POOL_MAX_POR_HOST = 4        # Conexiones máximas por (host, puerto) en cada worker
+TCP_POOL_IDLE_TIMEOUT = 30       # Segundos sin uso antes de descartar una conexión
+TCP_POOL_ESPERA_CHECKOUT = 2.0   # Segundos máximos esperando una conexión libre
+
+# Cortacircuitos por servidor VFP (ver circuito.py): después de CIRCUITO_FALLAS
+# fallas de transporte seguidas las consultas a ese servidor fallan al instante.
+# El estado se comparte entre workers en CIRCUITO_DIR (ver gunicorn_config.py);
+# sin directorio cada worker lleva el suyo. CIRCUITO_FALLAS = 0 lo desactiva
+CIRCUITO_FALLAS = 3
+CIRCUITO_ABIERTO_MIN = 5         # Segundos abierto tras la primera apertura; se duplica con cada prueba fallida
+CIRCUITO_ABIERTO_MAX = 120
+CIRCUITO_SONDA_TIMEOUT = 2 * TCP_TIMEOUT  # Segundos que se espera a la consulta de prueba antes de permitir otra
+CIRCUITO_DIR = os.environ.get("CONTROLSTOCK_CIRCUITO_DIR")
+
+# Caches del lado Django. Backend: "memoria" (dict por worker) o "django"
+# (framework de cache de Django, compartido entre workers si CACHES lo está)
+CACHE_BACKEND = "memoria"
+CACHE_DJANGO_ALIAS = "default"
+CACHE_TOKENS_TTL = 60            # Segundos que se confía en un verificarToken exitoso
+CACHE_TOKENS_MAX = 1000          # Entradas máximas (LRU) en el backend "memoria"
+CACHE_PENDIENTES_TTL_FRESCO = 10  # Hasta acá se sirve desde cache sin consultar VFP
+CACHE_PENDIENTES_TTL_MAX = 120    # Hasta acá se sirve desde cache y se refresca en background
+CACHE_PENDIENTES_MAX = 500
+CACHE_FECHAS_MAX = 4096          # Fechas formateadas recordadas (LRU de formatear_fecha)
+
+# Métricas (/metrics, formato de texto de Prometheus): latencia por comando VFP
+# y por vista, y contadores de los caches. Cada worker escribe las suyas en
+# METRICAS_DIR (ver gunicorn_config.py) y /metrics suma las de todos; sin
+# directorio, /metrics muestra solo las del worker que responde
+METRICAS = True
+METRICAS_DIR = os.environ.get("CONTROLSTOCK_METRICAS_DIR")
+METRICAS_INTERVALO = 5.0         # Segundos entre escrituras de cada worker
+METRICAS_TOKEN = os.environ.get("CONTROLSTOCK_METRICAS_TOKEN")  # /metrics pide "Authorization: Bearer <token>" (sin token: 404)
+
+# Logging (ver logs.py y LOGGING en settings.py): JSON por línea, escrito desde un
+# thread aparte. LOG_MUESTREO: {comando VFP: registrar INFO/DEBUG de uno de cada N intercambios}
+LOG_NIVEL = os.environ.get("CONTROLSTOCK_LOG_NIVEL", "INFO")
+LOG_MUESTREO = {"controlPendientes": 10, "verificarToken": 10}
+LOG_COLA_MAX = 10000             # Registros esperando ser escritos; con la cola llena se descartan
+
+# Base SQLite (DATABASES en settings.py); por defecto db.sqlite3 en la raíz del proyecto.
+# benchmarks/suite.py la apunta a una base temporal para no tocar la real
+DB_PATH = os.environ.get("CONTROLSTOCK_DB_PATH")
+
+# Vistas async (asyncio) para VFP: se activan al servir con ASGI (ver asgi.py)
+VISTAS_ASYNC = os.environ.get("CONTROLSTOCK_VISTAS_ASYNC") == "1"
@@ -34,3 +34,71 @@ def desencriptar(texto_enc):
 
     return "".join(resultado)
 
+
+# -------------------------
+# VARIANTES SOBRE BYTES (bytes.translate)
+# -------------------------
+# Mismo algoritmo que encriptar/desencriptar, pero con tablas de 256 entradas
+# precalculadas para las diez claves (A-J) y aplicadas en C con bytes.translate.
+
+CLAVES = range(65, 75)  # A-J
+
+
+def _tabla(desplazamiento):
+    return bytes((i + desplazamiento) % 256 for i in range(256))
+
+
+TABLAS_ENCRIPTAR = {clave: _tabla(clave) for clave in CLAVES}
+TABLAS_DESENCRIPTAR = {clave: _tabla(-clave) for clave in CLAVES}
+
+
+def texto_a_bytes(texto):
+    """
+    Convierte str a bytes con un byte por caracter (ord % 256), igual que hace
+    el algoritmo original con caracteres fuera de latin-1.
+    """
+    try:
+        return texto.encode('latin-1')
+    except UnicodeEncodeError:
+        return bytes(ord(c) % 256 for c in texto)
+
+
+def encriptar_bytes(datos, clave=None):
+    """Encripta bytes; resultado idéntico a encriptar(texto).encode('latin-1')."""
+    if clave is None:
+        clave = random.randint(65, 74)  # A-J
+    tabla = TABLAS_ENCRIPTAR.get(clave) or _tabla(clave)
+    return bytes(datos).translate(tabla) + bytes([clave])
+
+
+def desencriptar_bytes(datos_enc):
+    """
+    Desencripta bytes tomando la clave del último byte.
+    Acepta bytes, bytearray o memoryview (devuelve bytearray si recibe bytearray);
+    resultado idéntico a desencriptar(datos_enc).encode('latin-1').
+    """
+    clave = datos_enc[-1]
+    tabla = TABLAS_DESENCRIPTAR.get(clave) or _tabla(-clave)
+    if isinstance(datos_enc, bytearray):
+        # Una sola copia: traducir todo y descartar la clave en el lugar
+        resultado = datos_enc.translate(tabla)
+        del resultado[-1]
+        return resultado
+    cuerpo = datos_enc[:-1]
+    if isinstance(cuerpo, memoryview):
+        cuerpo = cuerpo.tobytes()
+    return cuerpo.translate(tabla)
+
+
+def desencriptar_bytes_por_bloques(datos_enc, tamanio):
+    """
+    Igual que desencriptar_bytes pero entregando el resultado en bloques de
+    'tamanio' bytes (generador), para no tener el payload desencriptado completo
+    en memoria al mismo tiempo que el encriptado.
+    """
+    clave = datos_enc[-1]
+    tabla = TABLAS_DESENCRIPTAR.get(clave) or _tabla(-clave)
+    fin = len(datos_enc) - 1
+    with memoryview(datos_enc) as vista:
+        for inicio in range(0, fin, tamanio):
+            yield vista[inicio:min(inicio + tamanio, fin)].tobytes().translate(tabla)
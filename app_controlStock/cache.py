@@ -0,0 +1,318 @@
+"""
+Caches de respuestas VFP del lado Django
+Backends intercambiables: dict en memoria (por worker) o framework de cache de Django
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .__init__ import (
+    CACHE_BACKEND, CACHE_DJANGO_ALIAS, CACHE_TOKENS_TTL, CACHE_TOKENS_MAX,
+    CACHE_PENDIENTES_TTL_FRESCO, CACHE_PENDIENTES_TTL_MAX, CACHE_PENDIENTES_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BackendMemoria:
+    """Dict LRU con expiración por entrada, local al worker"""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return entrada[1]
+
+    def set(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def add(self, clave, valor, ttl):
+        """Guarda solo si la clave no existe (o venció). Devuelve True si la guardó"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[0] >= time.monotonic():
+                return False
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+            return True
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class BackendDjango:
+    """Framework de cache de Django: compartido entre workers si CACHES apunta a un backend compartido"""
+
+    def __init__(self, alias=CACHE_DJANGO_ALIAS, prefijo="controlstock"):
+        self.alias = alias
+        self.prefijo = prefijo
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, clave):
+        return self._cache.get(f"{self.prefijo}:{clave}")
+
+    def set(self, clave, valor, ttl):
+        self._cache.set(f"{self.prefijo}:{clave}", valor, ttl)
+
+    def add(self, clave, valor, ttl):
+        return self._cache.add(f"{self.prefijo}:{clave}", valor, ttl)
+
+    def delete(self, clave):
+        self._cache.delete(f"{self.prefijo}:{clave}")
+
+    def clear(self):
+        # El cache de Django puede ser compartido con otras apps: no se vacía completo
+        logger.warning("clear() no soportado en BackendDjango")
+
+
+def crear_backend(max_entradas, nombre=CACHE_BACKEND, prefijo="controlstock"):
+    if nombre == "django":
+        return BackendDjango(prefijo=prefijo)
+    return BackendMemoria(max_entradas)
+
+
+def hash_token(token):
+    """Nunca se guarda el token en claro como clave de cache"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class CacheTokens:
+    """
+    Resultados exitosos de verificarToken por (hash(token), host:puerto).
+    Solo se guarda usuario/nombre/mensaje/token; los rechazos no se cachean.
+    """
+
+    def __init__(self, backend=None, ttl=CACHE_TOKENS_TTL):
+        self.backend = backend or crear_backend(CACHE_TOKENS_MAX, prefijo="controlstock:token")
+        self.ttl = ttl
+        self.estadisticas = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clave(token, host, port):
+        return f"{hash_token(token)}:{host}:{port}"
+
+    def obtener(self, token, host, port):
+        if not token or not host:
+            return None
+        resultado = self.backend.get(self._clave(token, host, port))
+        with self._lock:
+            self.estadisticas["misses" if resultado is None else "hits"] += 1
+        return resultado
+
+    def guardar(self, token, host, port, resultado):
+        if not token or not host or self.ttl <= 0:
+            return
+        self.backend.set(self._clave(token, host, port), resultado, self.ttl)
+
+    def invalidar(self, token, host, port):
+        if not token or not host:
+            return
+        self.backend.delete(self._clave(token, host, port))
+
+
+cache_tokens = CacheTokens()
+
+
+class CachePendientes:
+    """
+    Respuesta normalizada de controlPendientes por (host:puerto, usrActivo, token)
+    con stale-while-revalidate: hasta ttl_fresco se sirve directo; hasta ttl_maximo
+    se sirve el dato viejo y se refresca en un thread de background.
+
+    Cada entrada recuerda su depósito para poder invalidar todas las entradas
+    del mismo depósito cuando se registra un control. Invalidar no borra la
+    entrada: la deja marcada para que la próxima consulta vaya a VFP, pero
+    conservando la lista como base para pedir solo el delta.
+
+    cargar(base) recibe la última respuesta conocida (o None) y consulta VFP.
+    """
+
+    def __init__(self, backend=None, ttl_fresco=CACHE_PENDIENTES_TTL_FRESCO, ttl_maximo=CACHE_PENDIENTES_TTL_MAX):
+        self.backend = backend or crear_backend(CACHE_PENDIENTES_MAX, prefijo="controlstock:pendientes")
+        self.ttl_fresco = ttl_fresco
+        self.ttl_maximo = ttl_maximo
+        self.estadisticas = {"hits": 0, "stale": 0, "misses": 0, "refrescos": 0, "invalidaciones": 0}
+        self._refrescando = set()
+        self._tareas = set()  # Referencias a las tareas asyncio de refresco
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clave(token, host, port, usr):
+        return f"{host}:{port}:{usr}:{hash_token(token)}"
+
+    @staticmethod
+    def _clave_deposito(host, port, deposito):
+        return f"deposito:{host}:{port}:{deposito}"
+
+    def _contar(self, evento):
+        with self._lock:
+            self.estadisticas[evento] += 1
+
+    def obtener(self, token, host, port, usr, cargar):
+        """
+        Devuelve la respuesta cacheada o la obtiene con cargar(base).
+        Solo se cachean respuestas con estado True.
+        """
+        if not host or self.ttl_maximo <= 0:
+            return cargar(None)
+
+        clave = self._clave(token, host, port, usr)
+        entrada = self.backend.get(clave)
+        if entrada is None or entrada.get("invalidada"):
+            self._contar("misses")
+            respuesta = cargar(entrada["respuesta"] if entrada else None)
+            self.guardar(clave, host, port, respuesta)
+            return respuesta
+
+        if time.time() - entrada["guardado"] < self.ttl_fresco:
+            self._contar("hits")
+        else:
+            self._contar("stale")
+            self._refrescar_en_background(clave, host, port, entrada, lambda: cargar(entrada["respuesta"]))
+        return dict(entrada["respuesta"])
+
+    async def obtener_async(self, token, host, port, usr, cargar):
+        """Igual que obtener(), con cargar(base) devolviendo una corutina"""
+        if not host or self.ttl_maximo <= 0:
+            return await cargar(None)
+
+        clave = self._clave(token, host, port, usr)
+        entrada = self.backend.get(clave)
+        if entrada is None or entrada.get("invalidada"):
+            self._contar("misses")
+            respuesta = await cargar(entrada["respuesta"] if entrada else None)
+            self.guardar(clave, host, port, respuesta)
+            return respuesta
+
+        if time.time() - entrada["guardado"] < self.ttl_fresco:
+            self._contar("hits")
+        else:
+            self._contar("stale")
+            self._refrescar_en_tarea(clave, host, port, entrada, lambda: cargar(entrada["respuesta"]))
+        return dict(entrada["respuesta"])
+
+    def base(self, token, host, port, usr):
+        """Última respuesta conocida (aunque esté vencida o invalidada), para pedir el delta"""
+        if not host or self.ttl_maximo <= 0:
+            return None
+        entrada = self.backend.get(self._clave(token, host, port, usr))
+        return entrada["respuesta"] if entrada else None
+
+    def precargar(self, token, host, port, usr, respuesta):
+        """Guarda una respuesta obtenida por otro camino (p.ej. junto con verificarToken)"""
+        if host and self.ttl_maximo > 0:
+            self.guardar(self._clave(token, host, port, usr), host, port, respuesta)
+
+    def guardar(self, clave, host, port, respuesta):
+        if not respuesta or respuesta.get("estado") is not True:
+            return
+        deposito = respuesta.get("deposito", "")
+        self.backend.set(clave, {"respuesta": respuesta, "guardado": time.time(), "deposito": deposito},
+                         self.ttl_maximo)
+
+        clave_deposito = self._clave_deposito(host, port, deposito)
+        claves = self.backend.get(clave_deposito) or set()
+        claves.add(clave)
+        self.backend.set(clave_deposito, claves, self.ttl_maximo)
+
+    def _guardar_refresco(self, clave, host, port, entrada, respuesta):
+        """
+        Guarda el resultado de un refresco solo si la entrada de la que partió sigue
+        vigente: si mientras tanto se invalidó (se registró un control) o se guardó
+        otra más nueva, la lista pedida antes ya no vale y se descarta
+        """
+        actual = self.backend.get(clave)
+        if actual is None or actual.get("invalidada") or actual["guardado"] != entrada["guardado"]:
+            logger.debug("Refresco de pendientes descartado: la entrada cambió mientras se pedía")
+            return
+        self.guardar(clave, host, port, respuesta)
+        self._contar("refrescos")
+
+    def _refrescar_en_background(self, clave, host, port, entrada, cargar):
+        with self._lock:
+            if clave in self._refrescando:
+                return
+            self._refrescando.add(clave)
+
+        def refrescar():
+            try:
+                self._guardar_refresco(clave, host, port, entrada, cargar())
+            except Exception as e:
+                logger.error("Error refrescando pendientes en background: %s", e)
+            finally:
+                with self._lock:
+                    self._refrescando.discard(clave)
+
+        threading.Thread(target=refrescar, daemon=True).start()
+
+    def _refrescar_en_tarea(self, clave, host, port, entrada, cargar):
+        import asyncio
+
+        with self._lock:
+            if clave in self._refrescando:
+                return
+            self._refrescando.add(clave)
+
+        async def refrescar():
+            try:
+                self._guardar_refresco(clave, host, port, entrada, await cargar())
+            except Exception as e:
+                logger.error("Error refrescando pendientes en background: %s", e)
+            finally:
+                with self._lock:
+                    self._refrescando.discard(clave)
+
+        tarea = asyncio.get_running_loop().create_task(refrescar())
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    def _marcar_invalidada(self, clave):
+        entrada = self.backend.get(clave)
+        if entrada is not None and not entrada.get("invalidada"):
+            entrada = dict(entrada, invalidada=True)
+            self.backend.set(clave, entrada, self.ttl_maximo)
+        return entrada
+
+    def invalidar(self, token, host, port, usr):
+        """Invalida la entrada del usuario y todas las del mismo depósito"""
+        if not host:
+            return
+        entrada = self._marcar_invalidada(self._clave(token, host, port, usr))
+        self._contar("invalidaciones")
+        if entrada is None:
+            return
+
+        clave_deposito = self._clave_deposito(host, port, entrada["deposito"])
+        for otra in self.backend.get(clave_deposito) or ():
+            self._marcar_invalidada(otra)
+
+
+cache_pendientes = CachePendientes()
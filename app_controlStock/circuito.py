@@ -0,0 +1,217 @@
+"""
+Cortacircuitos por servidor VFP (host, puerto)
+Cada empresa tiene su propio servidor VFP y se puede caer sola. Sin esto, cada
+consulta a un servidor caído ocupa un worker hasta TCP_TIMEOUT y unos pocos
+usuarios de esa empresa dejan sin workers a todas las demás.
+
+- cerrado: las consultas pasan; se cuentan las fallas de transporte seguidas.
+- abierto: después de CIRCUITO_FALLAS fallas seguidas las consultas a ese
+  servidor fallan al instante durante CIRCUITO_ABIERTO_MIN segundos.
+- semiabierto: vencida la espera pasa una única consulta de prueba (entre todos
+  los workers). Si responde el circuito se cierra; si falla se vuelve a abrir
+  con el doble de espera (hasta CIRCUITO_ABIERTO_MAX).
+
+Con CIRCUITO_DIR el estado de cada servidor es un archivo compartido por los
+workers (ver gunicorn_config.py); sin directorio cada worker lleva el suyo.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .__init__ import (
+    CIRCUITO_FALLAS, CIRCUITO_ABIERTO_MIN, CIRCUITO_ABIERTO_MAX, CIRCUITO_SONDA_TIMEOUT, CIRCUITO_DIR
+)
+
+logger = logging.getLogger(__name__)
+
+# Medicion.error que indican que el servidor no está respondiendo
+FALLAS = ("timeout", "conexion", "vacia")
+# Medicion.error que no dicen nada del servidor (no se llegó a hablar con él)
+SIN_CONTACTO = ("pool_agotado",)
+
+_INICIAL = {"fallas": 0, "aperturas": 0, "abierto_hasta": 0, "sonda_hasta": 0}
+
+
+class EstadoMemoria:
+    """Estado de cada servidor en un dict del proceso"""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def leer(self, clave):
+        return self._datos.get(clave)
+
+    def actualizar(self, clave, funcion):
+        """Reemplaza el estado por funcion(estado actual o None) de forma atómica; devuelve el nuevo"""
+        with self._lock:
+            nuevo = self._datos[clave] = funcion(self._datos.get(clave))
+            return nuevo
+
+
+class EstadoArchivo:
+    """
+    Un archivo JSON por servidor en 'directorio'. Las actualizaciones toman un
+    flock sobre <archivo>.lock y reemplazan el archivo entero (os.replace); las
+    lecturas solo vuelven a abrirlo si cambió (inodo y mtime).
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._leidos = {}  # clave -> ((inodo, mtime_ns), estado)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, re.sub(r"[^\w.-]", "_", clave) + ".json")
+
+    @staticmethod
+    def _cargar(ruta):
+        try:
+            with open(ruta) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Estado de circuito ilegible en %s: %s", ruta, e)
+            return None
+
+    def leer(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            st = os.stat(ruta)
+        except FileNotFoundError:
+            return None
+        version = (st.st_ino, st.st_mtime_ns)
+        leido = self._leidos.get(clave)
+        if leido is not None and leido[0] == version:
+            return leido[1]
+        estado = self._cargar(ruta)
+        self._leidos[clave] = (version, estado)
+        return estado
+
+    def actualizar(self, clave, funcion):
+        ruta = self._ruta(clave)
+        with open(ruta + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # Se libera al cerrar el archivo
+            anterior = self._cargar(ruta)
+            nuevo = funcion(anterior)
+            if nuevo != anterior:
+                temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporal, "w") as f:
+                    json.dump(nuevo, f)
+                os.replace(temporal, ruta)
+            return nuevo
+
+
+class Cortacircuitos:
+
+    def __init__(self, almacen=None, fallas=CIRCUITO_FALLAS, abierto_min=CIRCUITO_ABIERTO_MIN,
+                 abierto_max=CIRCUITO_ABIERTO_MAX, sonda_timeout=CIRCUITO_SONDA_TIMEOUT):
+        self.almacen = almacen or (EstadoArchivo(CIRCUITO_DIR) if CIRCUITO_DIR else EstadoMemoria())
+        self.fallas = fallas
+        self.abierto_min = abierto_min
+        self.abierto_max = abierto_max
+        self.sonda_timeout = sonda_timeout
+        self.estadisticas = {"rechazadas": 0, "sondas": 0, "aperturas": 0, "cierres": 0}
+        self._lock = threading.Lock()
+
+    def _contar(self, evento):
+        with self._lock:
+            self.estadisticas[evento] += 1
+
+    def _leer(self, clave):
+        try:
+            return self.almacen.leer(clave)
+        except OSError as e:
+            logger.warning("No se pudo leer el estado del circuito %s: %s", clave, e)
+            return None
+
+    def _actualizar(self, clave, funcion):
+        # Un problema con el estado compartido nunca debe cortar las consultas
+        try:
+            return self.almacen.actualizar(clave, funcion)
+        except OSError as e:
+            logger.warning("No se pudo guardar el estado del circuito %s: %s", clave, e)
+            return None
+
+    def estado(self, host, port):
+        """Devuelve "cerrado", "abierto" o "semiabierto" (para logs y tests)"""
+        estado = self._leer(f"{host}:{port}")
+        if not estado or not estado["abierto_hasta"]:
+            return "cerrado"
+        return "abierto" if time.time() < estado["abierto_hasta"] else "semiabierto"
+
+    def permitir(self, host, port):
+        """
+        True si la consulta puede ir al servidor. Con el circuito abierto devuelve
+        False; en semiabierto solo la primera consulta (la prueba) obtiene True.
+        """
+        if self.fallas <= 0:
+            return True
+        clave = f"{host}:{port}"
+        estado = self._leer(clave)
+        if not estado or not estado["abierto_hasta"]:
+            return True
+
+        ahora = time.time()
+        if ahora >= estado["abierto_hasta"] and ahora >= estado["sonda_hasta"]:
+            tomada = []
+
+            def tomar_sonda(actual):
+                actual = actual or _INICIAL
+                if actual["abierto_hasta"] and (ahora < actual["abierto_hasta"] or ahora < actual["sonda_hasta"]):
+                    return actual  # Otro worker ya está probando (o el circuito se volvió a abrir)
+                tomada.append(True)
+                return dict(actual, sonda_hasta=ahora + self.sonda_timeout) if actual["abierto_hasta"] else actual
+
+            nuevo = self._actualizar(clave, tomar_sonda)
+            if nuevo is None or tomada:
+                if nuevo is not None and nuevo["abierto_hasta"]:
+                    self._contar("sondas")
+                    logger.info("Circuito semiabierto para %s: se envía una consulta de prueba", clave)
+                return True
+
+        self._contar("rechazadas")
+        return False
+
+    def registrar(self, host, port, error):
+        """Resultado de un intercambio con el servidor: error es Medicion.error (None si respondió)"""
+        if self.fallas <= 0 or error in SIN_CONTACTO:
+            return
+        clave = f"{host}:{port}"
+        if error in FALLAS:
+            self._actualizar(clave, lambda actual: self._con_falla(clave, actual))
+            return
+
+        estado = self._leer(clave)
+        if not estado or (not estado["fallas"] and not estado["abierto_hasta"]):
+            return  # Camino habitual: el servidor responde y no había fallas que olvidar
+        cerrado = self._actualizar(clave, lambda actual: dict(_INICIAL))
+        if cerrado is not None and estado["abierto_hasta"]:
+            self._contar("cierres")
+            logger.info("Circuito cerrado para %s: el servidor volvió a responder", clave)
+
+    def _con_falla(self, clave, actual):
+        actual = actual or _INICIAL
+        ahora = time.time()
+        if actual["abierto_hasta"]:
+            if ahora < actual["abierto_hasta"]:
+                return actual  # Consultas que ya estaban en curso cuando se abrió
+            # Falló la prueba: de nuevo abierto, con el doble de espera
+            aperturas, fallas = actual["aperturas"] + 1, actual["fallas"] + 1
+        else:
+            fallas = actual["fallas"] + 1
+            if fallas < self.fallas:
+                return dict(actual, fallas=fallas)
+            aperturas = 1
+
+        espera = min(self.abierto_max, self.abierto_min * 2 ** (aperturas - 1))
+        self._contar("aperturas")
+        logger.warning("Circuito abierto para %s durante %.0f s (%d fallas seguidas)", clave, espera, fallas)
+        return {"fallas": fallas, "aperturas": aperturas, "abierto_hasta": ahora + espera, "sonda_hasta": 0}
+
+
+circuito = Cortacircuitos()
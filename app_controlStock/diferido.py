@@ -0,0 +1,201 @@
+"""
+Registro diferido de controles (REGISTRO_DIFERIDO)
+La vista guarda el control en la base (RegistroDiferido) y responde enseguida;
+un thread de cada worker toma los registros vencidos, los envía a VFP con
+comando_stockControladoLote (agrupados por usuario y servidor) y guarda el
+resultado, que el navegador consulta en /registrar/estado/.
+Los registros sin respuesta de VFP se reintentan con espera creciente. Viajan
+con su clave de idempotencia, así que el reintento pasa por almacen_idempotencia:
+lo ya completado no se reenvía y lo incierto se verifica contra la lista de
+pendientes antes de reenviarlo (ver idempotencia.py).
+Los registros terminados (registrados o rechazados) se borran después de
+REGISTRO_DIFERIDO_RETENCION, para que la tabla que recorre _reclamar no crezca sin límite.
+Cada registro guarda el servidor ya resuelto (ip, puerto y protocolo), venga de
+la cookie connection_config o de empresa_ip/empresa_puerto.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RegistroDiferido
+from .services import comando_stockControladoLote
+from .utils import get_connection_config
+from .__init__ import (
+    REGISTRO_DIFERIDO_LOTE, REGISTRO_DIFERIDO_INTERVALO, REGISTRO_DIFERIDO_REINTENTO_MIN,
+    REGISTRO_DIFERIDO_REINTENTO_MAX, REGISTRO_DIFERIDO_INTENTOS_MAX, REGISTRO_DIFERIDO_ENVIANDO_TTL,
+    REGISTRO_DIFERIDO_RETENCION, REGISTRO_DIFERIDO_PURGA_INTERVALO
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _RequestDiferido:
+    """Lo único que los servicios leen del request: la cookie connection_config"""
+
+    def __init__(self, connection_config):
+        self.COOKIES = {"connection_config": connection_config} if connection_config else {}
+
+
+def _config_resuelta(request):
+    """
+    connection_config (como la cookie) con el servidor y el protocolo que resuelve
+    get_connection_config para este request; None si no hay cliente configurado
+    """
+    host, port, protocolo = get_connection_config(request, con_protocolo=True)
+    if not host or not port:
+        return None
+    return quote(json.dumps({"ip": host, "puerto": port, **protocolo}))
+
+
+def encolar(token, request, usuario, items):
+    """
+    Guarda los items ({"idSolicitud", "cantidad", "idempotencia"}) para enviarlos en
+    segundo plano. Una clave ya encolada por el mismo usuario no se duplica.
+
+    Returns:
+        list: resultado por item para el navegador ({"idSolicitud", "estado", "diferido", "idempotencia"}),
+            o None si el request no tiene servidor configurado (no se guarda nada)
+    """
+    connection_config = _config_resuelta(request)
+    if connection_config is None:
+        return None
+    RegistroDiferido.objects.bulk_create([
+        RegistroDiferido(usuario=usuario, idempotencia=item["idempotencia"], id_solicitud=str(item["idSolicitud"]),
+                         cantidad=int(item["cantidad"]), token=token, connection_config=connection_config)
+        for item in items
+    ], ignore_conflicts=True)
+    logger.info("[CONTROLSTOCK] %d registro(s) diferido(s) de %s", len(items), usuario)
+    despertar()
+    return [{"idSolicitud": item["idSolicitud"], "estado": True, "diferido": True, "idempotencia": item["idempotencia"]}
+            for item in items]
+
+
+def estado_de(usuario, claves):
+    """{clave: {"idSolicitud", "estado", "mensaje"}} de los registros diferidos del usuario"""
+    registros = RegistroDiferido.objects.filter(usuario=usuario, idempotencia__in=claves)
+    return {r.idempotencia: {"idSolicitud": r.id_solicitud, "estado": r.estado, "mensaje": r.mensaje}
+            for r in registros.only("idempotencia", "id_solicitud", "estado", "mensaje")}
+
+
+def _reclamar(max_items):
+    """
+    Marca como "enviando" hasta max_items registros vencidos y los devuelve.
+    El UPDATE repite la condición: si otro worker tomó alguno en el medio, no se toma dos veces.
+    """
+    ahora = timezone.now()
+    vencidos = (Q(estado=RegistroDiferido.PENDIENTE, proximo_intento__lte=ahora) |
+                Q(estado=RegistroDiferido.ENVIANDO,
+                  actualizado__lt=ahora - timedelta(seconds=REGISTRO_DIFERIDO_ENVIANDO_TTL)))
+    candidatos = list(RegistroDiferido.objects.filter(vencidos).order_by("creado")
+                      .values_list("pk", flat=True)[:max_items])
+    if not candidatos:
+        return []
+    vaciado = uuid.uuid4().hex
+    RegistroDiferido.objects.filter(vencidos, pk__in=candidatos).update(
+        estado=RegistroDiferido.ENVIANDO, reclamado=vaciado, actualizado=ahora)
+    return list(RegistroDiferido.objects.filter(reclamado=vaciado, estado=RegistroDiferido.ENVIANDO).order_by("creado"))
+
+
+def _espera(intentos):
+    return min(REGISTRO_DIFERIDO_REINTENTO_MAX, REGISTRO_DIFERIDO_REINTENTO_MIN * 2 ** (intentos - 1))
+
+
+def _guardar_resultado(registro, resultado):
+    ahora = timezone.now()
+    registro.mensaje = resultado.get("mensaje") or ""
+    if resultado.get("reintentar"):
+        registro.intentos += 1
+        if registro.intentos < REGISTRO_DIFERIDO_INTENTOS_MAX:
+            registro.estado = RegistroDiferido.PENDIENTE
+            registro.proximo_intento = ahora + timedelta(seconds=_espera(registro.intentos))
+        else:
+            registro.estado = RegistroDiferido.RECHAZADO
+            registro.mensaje = f"Sin respuesta de VFP después de {registro.intentos} intentos"
+    else:
+        registro.estado = RegistroDiferido.REGISTRADO if resultado["estado"] else RegistroDiferido.RECHAZADO
+    if registro.estado != RegistroDiferido.PENDIENTE:
+        registro.token = ""
+    registro.reclamado = ""
+    registro.actualizado = ahora
+    registro.save(update_fields=["estado", "mensaje", "intentos", "proximo_intento", "token", "reclamado", "actualizado"])
+
+
+_ultima_purga = 0.0
+
+
+def purgar(forzar=False):
+    """
+    Borra los registros terminados hace más de REGISTRO_DIFERIDO_RETENCION (como mucho
+    una vez por REGISTRO_DIFERIDO_PURGA_INTERVALO en cada worker). Devuelve cuántos borró
+    """
+    global _ultima_purga
+    if not forzar and time.monotonic() - _ultima_purga < REGISTRO_DIFERIDO_PURGA_INTERVALO:
+        return 0
+    _ultima_purga = time.monotonic()
+    borrados, _ = RegistroDiferido.objects.filter(
+        estado__in=(RegistroDiferido.REGISTRADO, RegistroDiferido.RECHAZADO),
+        actualizado__lt=timezone.now() - timedelta(seconds=REGISTRO_DIFERIDO_RETENCION)).delete()
+    if borrados:
+        logger.info("[CONTROLSTOCK] %d registro(s) diferido(s) terminado(s) borrado(s)", borrados)
+    return borrados
+
+
+def vaciar(max_items=REGISTRO_DIFERIDO_LOTE):
+    """Envía a VFP los registros vencidos (hasta max_items). Devuelve cuántos tomó"""
+    purgar()
+    registros = _reclamar(max_items)
+    grupos = {}
+    for registro in registros:
+        grupos.setdefault((registro.token, registro.connection_config, registro.usuario), []).append(registro)
+
+    for (token, connection_config, usuario), grupo in grupos.items():
+        items = [{"idSolicitud": r.id_solicitud, "cantidad": r.cantidad, "idempotencia": r.idempotencia} for r in grupo]
+        try:
+            resultados = comando_stockControladoLote(token, _RequestDiferido(connection_config), usuario, items)["resultados"]
+        except Exception:
+            logger.exception("[CONTROLSTOCK] Error enviando %d registro(s) diferido(s) de %s", len(items), usuario)
+            resultados = [{"estado": False, "mensaje": "Error al enviar", "reintentar": True}] * len(grupo)
+        for registro, resultado in zip(grupo, resultados):
+            _guardar_resultado(registro, resultado)
+    if registros:
+        logger.info("[CONTROLSTOCK] Vaciado de registros diferidos: %d en %d lote(s)", len(registros), len(grupos))
+    return len(registros)
+
+
+# Vaciador de este worker: un thread daemon que se arranca con el primer registro
+# diferido (o la primera consulta de estado) y despierta con cada uno nuevo
+_despertar = threading.Event()
+_hilo = None
+_lock_hilo = threading.Lock()
+
+
+def despertar():
+    """Arranca el vaciador de este worker si no está corriendo y le avisa que hay trabajo"""
+    global _hilo
+    with _lock_hilo:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_vaciador, name="controlstock-registros-diferidos", daemon=True)
+            _hilo.start()
+    _despertar.set()
+
+
+def _vaciador():
+    while True:
+        _despertar.wait(REGISTRO_DIFERIDO_INTERVALO)
+        _despertar.clear()
+        try:
+            # Lote lleno: seguir sin esperar el intervalo
+            while vaciar() >= REGISTRO_DIFERIDO_LOTE:
+                pass
+        except Exception:
+            logger.exception("[CONTROLSTOCK] Error en el vaciador de registros diferidos")
+        finally:
+            close_old_connections()
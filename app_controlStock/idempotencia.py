@@ -0,0 +1,98 @@
+"""
+Registro idempotente de controles (RegistrarStockControlado)
+Cada control que envía el navegador trae una clave de idempotencia. Por
+(usuario, idSolicitud, clave) se guarda:
+- mientras se envía a VFP, una reserva "en curso": otro request con la misma
+  clave no lo reenvía, se le pide reintentar más tarde
+- al terminar, el resultado: "completado" (VFP lo registró: los duplicados se
+  responden desde acá) o "incierto" (no hubo respuesta: VFP pudo haberlo
+  aplicado o no, y hay que verificarlo antes de reenviar)
+Los rechazos de VFP no se guardan: no registraron nada y se pueden reintentar.
+El almacén es la base (modelo RegistroIdempotente), compartida por todos los
+workers: la reserva es un INSERT con restricción única, así que si dos workers
+reservan la misma clave a la vez solo uno lo consigue.
+"""
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RegistroIdempotente
+from .__init__ import REGISTRO_IDEMPOTENCIA_TTL, REGISTRO_EN_CURSO_TTL
+
+COMPLETADO = RegistroIdempotente.COMPLETADO
+INCIERTO = RegistroIdempotente.INCIERTO
+
+
+class AlmacenIdempotencia:
+
+    def __init__(self, ttl=REGISTRO_IDEMPOTENCIA_TTL, ttl_en_curso=REGISTRO_EN_CURSO_TTL):
+        self.ttl = ttl
+        self.ttl_en_curso = ttl_en_curso
+        self._ultima_purga = 0.0
+
+    @staticmethod
+    def _filtro(usuario, idSolicitud, clave):
+        return RegistroIdempotente.objects.filter(usuario=usuario, id_solicitud=str(idSolicitud), clave=clave)
+
+    def consultar(self, usuario, idSolicitud, clave):
+        """{"estado": COMPLETADO, "respuesta": {...}}, {"estado": INCIERTO, "desde": ts} o None"""
+        registro = (self._filtro(usuario, idSolicitud, clave)
+                    .exclude(estado="")
+                    .filter(actualizado__gte=timezone.now() - timedelta(seconds=self.ttl))
+                    .only("estado", "respuesta", "actualizado")
+                    .first())
+        if registro is None:
+            return None
+        if registro.estado == COMPLETADO:
+            return {"estado": COMPLETADO, "respuesta": registro.respuesta}
+        return {"estado": INCIERTO, "desde": registro.actualizado.timestamp()}
+
+    def reservar(self, usuario, idSolicitud, clave):
+        """True si este request queda a cargo del envío (nadie más lo está enviando)"""
+        ahora = timezone.now()
+        try:
+            with transaction.atomic():
+                RegistroIdempotente.objects.create(usuario=usuario, id_solicitud=str(idSolicitud), clave=clave,
+                                                   en_curso_desde=ahora, actualizado=ahora)
+            return True
+        except IntegrityError:
+            pass
+        # Ya existe: se toma solo si no hay reserva o venció (el worker que la tenía murió enviando).
+        # El UPDATE repite la condición: si otro request la tomó en el medio, no se toma dos veces
+        libre = Q(en_curso_desde__isnull=True) | Q(en_curso_desde__lt=ahora - timedelta(seconds=self.ttl_en_curso))
+        return self._filtro(usuario, idSolicitud, clave).filter(libre).update(en_curso_desde=ahora) == 1
+
+    def liberar(self, usuario, idSolicitud, clave):
+        filtro = self._filtro(usuario, idSolicitud, clave)
+        filtro.filter(estado="").delete()
+        filtro.update(en_curso_desde=None)
+
+    def finalizar(self, usuario, idSolicitud, clave, respuesta):
+        """
+        Guarda el resultado del envío y libera la reserva.
+        respuesta None: VFP no respondió (incierto); estado True: completado; otra: se descarta.
+        """
+        if respuesta is None or respuesta.get("estado") is True:
+            estado = INCIERTO if respuesta is None else COMPLETADO
+            RegistroIdempotente.objects.update_or_create(
+                usuario=usuario, id_solicitud=str(idSolicitud), clave=clave,
+                defaults={"estado": estado, "respuesta": respuesta, "en_curso_desde": None,
+                          "actualizado": timezone.now()})
+        else:
+            self._filtro(usuario, idSolicitud, clave).delete()
+        self._purgar()
+
+    def _purgar(self):
+        """Borra los resultados vencidos (como mucho una vez por ttl_en_curso en cada worker)"""
+        if time.monotonic() - self._ultima_purga < self.ttl_en_curso:
+            return
+        self._ultima_purga = time.monotonic()
+        ahora = timezone.now()
+        sin_reserva = Q(en_curso_desde__isnull=True) | Q(en_curso_desde__lt=ahora - timedelta(seconds=self.ttl_en_curso))
+        RegistroIdempotente.objects.filter(sin_reserva, actualizado__lt=ahora - timedelta(seconds=self.ttl)).delete()
+
+
+almacen_idempotencia = AlmacenIdempotencia()
@@ -0,0 +1,238 @@
+"""
+Lectura incremental de la respuesta JSON de VFP
+Recorre el objeto de primer nivel a medida que llegan los fragmentos de texto y
+entrega los elementos de los arrays grandes (p.ej. "Pendientes") de a uno, sin
+construir nunca el array completo ni el string completo.
+"""
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_ESPACIOS = " \t\r\n"
+_SALTAR_ESPACIOS = re.compile(r'[ \t\r\n]*').match
+_CIERRES = {"[": "]", "{": "}", '"': '"'}
+
+
+class _FaltanDatos(Exception):
+    """El buffer se terminó en medio de un token: hay que esperar el próximo fragmento"""
+
+
+class LectorObjetoJSON:
+    """
+    Parser por estados del objeto de primer nivel.
+
+    Args:
+        claves_items: nombres (en minúsculas) de las claves cuyos arrays se
+            recorren elemento por elemento.
+
+    Uso: agregar(fragmento) devuelve los eventos que ya se pudieron leer;
+    terminar() procesa lo que quede. Cada evento es (clave, valor, es_item);
+    al empezar uno de los arrays recorridos se emite (clave, [], False).
+    """
+
+    def __init__(self, claves_items):
+        self.claves_items = set(claves_items)
+        self.buffer = ""
+        self.pos = 0
+        self.estado = "inicio"
+        self.clave = None
+        self.final = False
+        # Un valor grande que no se recorre (p.ej. "Eliminados") cortado por el fin
+        # del buffer: los fragmentos se juntan sin volver a parsearlo hasta que
+        # llegue un fragmento con el caracter que lo puede cerrar
+        self._cierre_esperado = None
+        self._en_espera = []
+
+    def agregar(self, fragmento):
+        if self._cierre_esperado is not None:
+            if self._cierre_esperado not in fragmento:
+                self._en_espera.append(fragmento)
+                return []
+            self._cierre_esperado = None
+            fragmento = self._unir_en_espera(fragmento)
+        # Recortar lo ya consumido una vez por fragmento (no por elemento)
+        self.buffer = self.buffer[self.pos:] + fragmento
+        self.pos = 0
+        return list(self._eventos())
+
+    def _unir_en_espera(self, fragmento=""):
+        if self._en_espera:
+            self._en_espera.append(fragmento)
+            fragmento = "".join(self._en_espera)
+            self._en_espera = []
+        return fragmento
+
+    def terminar(self):
+        self.final = True
+        self._cierre_esperado = None
+        self.buffer = self.buffer[self.pos:] + self._unir_en_espera()
+        self.pos = 0
+        eventos = list(self._eventos())
+        if self.estado != "fin":
+            raise json.JSONDecodeError("JSON incompleto", self.buffer, self.pos)
+        return eventos
+
+    def _saltar_espacios(self):
+        buffer, pos = self.buffer, self.pos
+        while pos < len(buffer) and buffer[pos] in _ESPACIOS:
+            pos += 1
+        self.pos = pos
+        if pos >= len(buffer):
+            raise _FaltanDatos()
+        return buffer[pos]
+
+    def _esperar(self, caracter):
+        if self._saltar_espacios() != caracter:
+            raise json.JSONDecodeError(f"Se esperaba {caracter!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def _valor(self):
+        """Decodifica un valor completo; si toca el final del buffer espera más datos"""
+        caracter = self._saltar_espacios()
+        try:
+            valor, fin = _decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if self.final:
+                raise
+            self._cierre_esperado = _CIERRES.get(caracter)
+            raise _FaltanDatos()
+        # Un número al final del buffer puede seguir en el próximo fragmento
+        if fin >= len(self.buffer) and not self.final:
+            raise _FaltanDatos()
+        self.pos = fin
+        return valor
+
+    def _items(self):
+        """
+        Camino rápido para los elementos de un array recorrido: un solo bucle
+        con el scanner de json (sin un _paso por token). Devuelve los eventos
+        leídos; deja self.pos/self.estado listos para seguir.
+        """
+        buffer, pos, final = self.buffer, self.pos, self.final
+        largo = len(buffer)
+        escanear = _decoder.scan_once
+        clave = self.clave
+        siguiente = self.estado == "siguiente_item"
+        eventos = []
+        while True:
+            inicio = pos
+            pos = _SALTAR_ESPACIOS(buffer, pos).end()
+            if pos >= largo:
+                break
+            caracter = buffer[pos]
+            if caracter == "]":
+                pos += 1
+                self.estado = "siguiente_clave"
+                break
+            if siguiente:
+                if caracter != ",":
+                    raise json.JSONDecodeError("Se esperaba ','", buffer, pos)
+                pos = _SALTAR_ESPACIOS(buffer, pos + 1).end()
+            try:
+                item, fin = escanear(buffer, pos)
+            except (StopIteration, json.JSONDecodeError):
+                # Elemento cortado por el fin del fragmento (o inválido, si ya no hay más datos)
+                if final:
+                    raise json.JSONDecodeError("Valor inválido", buffer, pos)
+                pos = inicio
+                break
+            # Un número al final del buffer puede seguir en el próximo fragmento
+            if fin >= largo and not final:
+                pos = inicio
+                break
+            pos = fin
+            siguiente = True
+            eventos.append((clave, item, True))
+        if self.estado != "siguiente_clave":
+            self.estado = "siguiente_item" if siguiente else "item"
+        self.pos = pos
+        return eventos
+
+    def _eventos(self):
+        while self.estado != "fin":
+            if self.estado in ("item", "siguiente_item"):
+                eventos = self._items()
+                yield from eventos
+                if self.estado != "siguiente_clave":
+                    return
+                continue
+            inicio = self.pos
+            try:
+                evento = self._paso()
+            except _FaltanDatos:
+                self.pos = inicio
+                return
+            if evento is not None:
+                yield evento
+
+    def _paso(self):
+        """Avanza un token; devuelve un evento o None"""
+        if self.estado == "inicio":
+            self._esperar("{")
+            self.estado = "clave"
+            return None
+
+        if self.estado in ("clave", "siguiente_clave"):
+            caracter = self._saltar_espacios()
+            if caracter == "}":
+                self.pos += 1
+                self.estado = "fin"
+                return None
+            if self.estado == "siguiente_clave":
+                self._esperar(",")
+            self.clave = self._valor()
+            self._esperar(":")
+            self.estado = "valor"
+            return None
+
+        if self.estado == "valor":
+            caracter = self._saltar_espacios()
+            if caracter == "[" and isinstance(self.clave, str) and self.clave.lower() in self.claves_items:
+                self.pos += 1
+                self.estado = "item"
+                return self.clave, [], False
+            valor = self._valor()
+            self.estado = "siguiente_clave"
+            return self.clave, valor, False
+
+        # Elementos de un array recorrido de a uno
+        caracter = self._saltar_espacios()
+        if caracter == "]":
+            self.pos += 1
+            self.estado = "siguiente_clave"
+            return None
+        if self.estado == "siguiente_item":
+            self._esperar(",")
+        item = self._valor()
+        self.estado = "siguiente_item"
+        return self.clave, item, True
+
+
+def leer_objeto(fragmentos, procesar_items):
+    """
+    Arma el dict de la respuesta leyendo los fragmentos de texto de a uno.
+
+    Args:
+        fragmentos: iterable de str (p.ej. el payload desencriptado por bloques)
+        procesar_items: {clave en minúsculas: función(item) → item normalizado o None}.
+            Los arrays de esas claves se guardan ya procesados (los None se descartan).
+
+    Raises:
+        json.JSONDecodeError: si el JSON es inválido o está incompleto
+    """
+    lector = LectorObjetoJSON(procesar_items)
+    resultado = {}
+
+    def aplicar(eventos):
+        for clave, valor, es_item in eventos:
+            if not es_item:
+                resultado[clave] = valor
+                continue
+            procesado = procesar_items[clave.lower()](valor)
+            if procesado is not None:
+                resultado[clave].append(procesado)
+
+    for fragmento in fragmentos:
+        aplicar(lector.agregar(fragmento))
+    aplicar(lector.terminar())
+    return resultado
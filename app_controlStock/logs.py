@@ -0,0 +1,165 @@
+"""
+Logging estructurado del lado Django
+- Los requests solo encolan el registro (HandlerCola, sin bloquear nunca: si la
+  cola está llena se descarta y se cuenta); un QueueListener por proceso lo
+  formatea como una línea JSON y lo escribe.
+- Antes de escribir se tachan los tokens (FiltroRedaccion).
+- Muestreo por comando VFP: iniciar_comando() decide si el intercambio entra en
+  la muestra (uno de cada LOG_MUESTREO[comando]); los INFO/DEBUG de un
+  intercambio fuera de la muestra se descartan (FiltroMuestreo). WARNING y
+  ERROR se escriben siempre.
+Configuración: LOGGING en settings.py, nivel con CONTROLSTOCK_LOG_NIVEL.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+
+from .__init__ import LOG_MUESTREO, LOG_COLA_MAX
+
+# (comando, en la muestra) del intercambio con VFP en curso en este thread/tarea
+_comando = contextvars.ContextVar("controlstock_comando", default=None)
+_contadores = {}
+
+_TOKENS = re.compile(
+    r"""(?ix)
+    (\b\w*token["']?\s*[:=]\s*["']?)[^"'\s,;&}]+   # "Token": "abc", authToken=abc, token: abc
+    | (\bbearer\s+)\S+                             # Authorization: Bearer abc
+    """
+)
+
+
+def _en_muestra(comando):
+    cada = LOG_MUESTREO.get(comando, 1)
+    if cada <= 1:
+        return True
+    contador = _contadores.get(comando)
+    if contador is None:
+        contador = _contadores.setdefault(comando, itertools.count())
+    return next(contador) % cada == 0
+
+
+def iniciar_comando(comando):
+    """Marca el comando VFP en curso y sortea si entra en la muestra. Devuelve el valor para terminar_comando()"""
+    return _comando.set((comando, _en_muestra(comando)))
+
+
+def terminar_comando(marca):
+    _comando.reset(marca)
+
+
+def tachar_tokens(texto):
+    return _TOKENS.sub(lambda m: (m.group(1) or m.group(2)) + "***", texto)
+
+
+class FiltroMuestreo(logging.Filter):
+    """
+    Agrega 'comando' al registro y descarta INFO/DEBUG de los intercambios fuera
+    de la muestra. Fuera de un intercambio, un registro con extra={"comando": ...}
+    se sortea por sí solo.
+    """
+
+    def filter(self, record):
+        actual = _comando.get()
+        if actual is None:
+            comando = getattr(record, "comando", None)
+            return comando is None or record.levelno >= logging.WARNING or _en_muestra(comando)
+        record.comando = actual[0]
+        return actual[1] or record.levelno >= logging.WARNING
+
+
+class FiltroRedaccion(logging.Filter):
+    """Tacha los tokens del mensaje ya armado (y de la traza de la excepción)"""
+
+    def filter(self, record):
+        record.msg = tachar_tokens(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = tachar_tokens(record.exc_text)
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro"""
+
+    def format(self, record):
+        datos = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        comando = getattr(record, "comando", None)
+        if comando:
+            datos["comando"] = comando
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False)
+
+
+class HandlerCola(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: con la cola llena descarta el registro"""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # Igual que QueueHandler.prepare pero conservando 'comando' y la traza por separado
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+_handlers = []
+
+
+def crear_handler_cola(stream=None):
+    """
+    Factory para LOGGING (settings.py): HandlerCola + QueueListener que
+    escribe en 'stream' (stderr por defecto) con FormatoJSON y FiltroRedaccion.
+    """
+    salida = logging.StreamHandler(stream or sys.stderr)
+    salida.setFormatter(FormatoJSON())
+    salida.addFilter(FiltroRedaccion())
+    handler = HandlerCola(queue.Queue(LOG_COLA_MAX))
+    handler.listener = logging.handlers.QueueListener(handler.queue, salida, respect_handler_level=True)
+    handler.listener.start()
+    _handlers.append(handler)
+    return handler
+
+
+def _detener():
+    for handler in _handlers:
+        handler.listener.stop()
+
+
+def _despues_de_fork():
+    # El thread del listener no pasa al hijo (gunicorn --preload): cola y thread nuevos
+    for handler in _handlers:
+        handler.queue = handler.listener.queue = queue.Queue(LOG_COLA_MAX)
+        handler.listener._thread = None
+        handler.listener.start()
+
+
+atexit.register(_detener)
+os.register_at_fork(after_in_child=_despues_de_fork)
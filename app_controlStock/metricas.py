@@ -0,0 +1,312 @@
+"""
+Métricas de latencia (cliente VFP y vistas) y contadores de los caches
+Cada worker acumula histogramas y contadores en memoria. Con METRICAS_DIR, un
+thread del worker escribe su instantánea en METRICAS_DIR/<pid>.json cada
+METRICAS_INTERVALO segundos; /metrics suma las de todos los workers y responde
+en el formato de texto de Prometheus. Sin directorio, /metrics muestra solo
+las del worker que atiende el request. Los archivos de workers que ya terminaron
+(reciclados por gunicorn) se borran: sus contadores dejan de sumarse.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from .cache import cache_tokens, cache_pendientes
+from .pendientes import estadisticas_indices
+from .pool_tcp import pool
+from .circuito import circuito
+from .__init__ import METRICAS, METRICAS_DIR, METRICAS_INTERVALO
+
+logger = logging.getLogger(__name__)
+
+SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# nombre: (ayuda, buckets)
+HISTOGRAMAS = {
+    "controlstock_vfp_segundos": ("Duración total de un intercambio con VFP", SEGUNDOS),
+    "controlstock_vfp_conexion_segundos": ("Apertura de la conexión (solo conexiones nuevas)", SEGUNDOS),
+    "controlstock_vfp_primer_byte_segundos": ("Desde el envío hasta el primer byte de la respuesta", SEGUNDOS),
+    "controlstock_vfp_cola_segundos": ("Desde el último byte hasta dar la respuesta por completa "
+                                       "(TCP_TAIL_TIMEOUT en la lectura sin framing)", SEGUNDOS),
+    "controlstock_vfp_decodificacion_segundos": ("Desencriptado y parseo de la respuesta", SEGUNDOS),
+    "controlstock_vfp_enviados_bytes": ("Bytes enviados a VFP por intercambio", BYTES),
+    "controlstock_vfp_recibidos_bytes": ("Bytes recibidos de VFP por intercambio", BYTES),
+    "controlstock_vista_segundos": ("Duración de cada vista", SEGUNDOS),
+}
+# nombre: ayuda
+CONTADORES = {
+    "controlstock_vfp_errores_total": "Intercambios con VFP sin respuesta, por motivo",
+    "controlstock_cache_eventos_total": "Consultas y eventos de los caches (hits, misses, ...)",
+    "controlstock_pool_conexiones_total": "Conexiones del pool TCP por evento",
+    "controlstock_circuito_eventos_total": "Cortacircuitos de los servidores VFP: consultas rechazadas, "
+                                           "pruebas, aperturas y cierres",
+}
+
+
+class Registro:
+    """Histogramas y contadores de un proceso. Un único lock para todo el registro"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}  # (nombre, etiquetas) -> [cuenta por bucket..., +Inf, suma, cuenta]
+        self._contadores = {}   # (nombre, etiquetas) -> valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        buckets = HISTOGRAMAS[nombre][1]
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        posicion = bisect_left(buckets, valor)
+        with self._lock:
+            serie = self._histogramas.get(clave)
+            if serie is None:
+                serie = self._histogramas[clave] = [0] * (len(buckets) + 3)
+            serie[posicion] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def incrementar(self, nombre, cantidad=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+
+    def instantanea(self):
+        """Contenido del registro serializable a JSON"""
+        with self._lock:
+            return {
+                "histogramas": [[nombre, etiquetas, list(serie)] for (nombre, etiquetas), serie in self._histogramas.items()],
+                "contadores": [[nombre, etiquetas, valor] for (nombre, etiquetas), valor in self._contadores.items()],
+            }
+
+
+def _estadisticas_caches():
+    """Contadores que los caches y el pool ya llevan, como contadores de este proceso"""
+    contadores = []
+    for cache, estadisticas in (("tokens", cache_tokens.estadisticas), ("pendientes", cache_pendientes.estadisticas),
+                                ("indices", estadisticas_indices)):
+        for evento, valor in estadisticas.items():
+            contadores.append(["controlstock_cache_eventos_total", (("cache", cache), ("evento", evento)), valor])
+    for evento, valor in pool.estadisticas.items():
+        contadores.append(["controlstock_pool_conexiones_total", (("evento", evento),), valor])
+    for evento, valor in circuito.estadisticas.items():
+        contadores.append(["controlstock_circuito_eventos_total", (("evento", evento),), valor])
+    return contadores
+
+
+def combinar(instantaneas):
+    """Suma instantáneas de varios procesos: ({(nombre, etiquetas): serie}, {(nombre, etiquetas): valor})"""
+    histogramas, contadores = {}, {}
+    for instantanea in instantaneas:
+        for nombre, etiquetas, serie in instantanea["histogramas"]:
+            clave = (nombre, tuple(tuple(par) for par in etiquetas))
+            actual = histogramas.get(clave)
+            histogramas[clave] = list(serie) if actual is None else [a + b for a, b in zip(actual, serie)]
+        for nombre, etiquetas, valor in instantanea["contadores"]:
+            clave = (nombre, tuple(tuple(par) for par in etiquetas))
+            contadores[clave] = contadores.get(clave, 0) + valor
+    return histogramas, contadores
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+
+def formato_prometheus(histogramas, contadores):
+    """Formato de texto de Prometheus (0.0.4)"""
+    lineas = []
+    for nombre, (ayuda, buckets) in HISTOGRAMAS.items():
+        series = sorted((etiquetas, serie) for (n, etiquetas), serie in histogramas.items() if n == nombre)
+        if not series:
+            continue
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+        for etiquetas, serie in series:
+            acumulado = 0
+            for limite, cantidad in zip(buckets + ("+Inf",), serie):
+                acumulado += cantidad
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', limite),))} {acumulado}")
+            lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {serie[-2]}")
+            lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {serie[-1]}")
+    for nombre, ayuda in CONTADORES.items():
+        series = sorted((etiquetas, valor) for (n, etiquetas), valor in contadores.items() if n == nombre)
+        if not series:
+            continue
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter"]
+        lineas += [f"{nombre}{_etiquetas(etiquetas)} {valor}" for etiquetas, valor in series]
+    return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+
+def observar(nombre, valor, **etiquetas):
+    if METRICAS:
+        registro.observar(nombre, valor, **etiquetas)
+        _asegurar_escritor()
+
+
+def incrementar(nombre, cantidad=1, **etiquetas):
+    if METRICAS:
+        registro.incrementar(nombre, cantidad, **etiquetas)
+        _asegurar_escritor()
+
+
+def instantanea_local():
+    instantanea = registro.instantanea()
+    instantanea["contadores"] += _estadisticas_caches()
+    return instantanea
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+
+def borrar(pid, directorio=None):
+    """Borra la instantánea de un worker que terminó (ver child_exit en gunicorn_config.py)"""
+    directorio = directorio or METRICAS_DIR
+    if directorio:
+        try:
+            os.remove(os.path.join(directorio, f"{pid}.json"))
+        except FileNotFoundError:
+            pass
+
+
+def exportar(directorio=None):
+    """Texto de /metrics: este proceso más las instantáneas de los otros workers vivos (METRICAS_DIR)"""
+    directorio = directorio or METRICAS_DIR
+    instantaneas = [instantanea_local()]
+    if directorio:
+        propio = _archivo(directorio)
+        for archivo in glob.glob(os.path.join(directorio, "*.json")):
+            if archivo == propio:
+                continue
+            pid = os.path.splitext(os.path.basename(archivo))[0]
+            if pid.isdigit() and not _proceso_vivo(int(pid)):
+                # Worker reciclado sin pasar por child_exit (p.ej. matado con SIGKILL)
+                borrar(pid, directorio)
+                continue
+            try:
+                with open(archivo) as f:
+                    instantaneas.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("Métricas ilegibles en %s: %s", archivo, e)
+    return formato_prometheus(*combinar(instantaneas))
+
+
+class Medicion:
+    """
+    Tiempos y bytes de un intercambio con VFP. El cliente TCP completa los
+    campos a medida que avanza (ver tcp_client._SocketMedido) y al final
+    llama a registrar(). Los tiempos son de time.perf_counter().
+    """
+
+    __slots__ = ("comando", "modo", "inicio", "conexion", "enviado", "primer_byte", "ultimo_byte",
+                 "fin_lectura", "decodificacion", "bytes_enviados", "bytes_recibidos", "error")
+
+    def __init__(self, comando, modo):
+        self.comando = comando or "desconocido"
+        self.modo = modo
+        self.inicio = time.perf_counter()
+        self.conexion = self.enviado = self.primer_byte = self.ultimo_byte = None
+        self.fin_lectura = self.decodificacion = self.error = None
+        self.bytes_enviados = self.bytes_recibidos = 0
+
+    def conectado(self, desde):
+        self.conexion = time.perf_counter() - desde
+
+    def enviado_ahora(self, cantidad):
+        self.bytes_enviados += cantidad
+        self.enviado = time.perf_counter()
+
+    def recibido_ahora(self, cantidad):
+        ahora = time.perf_counter()
+        if self.primer_byte is None:
+            self.primer_byte = ahora
+        self.ultimo_byte = ahora
+        self.bytes_recibidos += cantidad
+
+    def decodificado(self, desde):
+        self.decodificacion = (self.decodificacion or 0) + time.perf_counter() - desde
+
+    def registrar(self):
+        if not METRICAS:
+            return
+        etiquetas = {"comando": self.comando, "modo": self.modo}
+        observar("controlstock_vfp_segundos", time.perf_counter() - self.inicio, **etiquetas)
+        if self.conexion is not None:
+            observar("controlstock_vfp_conexion_segundos", self.conexion, **etiquetas)
+        if self.primer_byte is not None and self.enviado is not None:
+            observar("controlstock_vfp_primer_byte_segundos", max(self.primer_byte - self.enviado, 0), **etiquetas)
+        if self.fin_lectura is not None and self.ultimo_byte is not None:
+            observar("controlstock_vfp_cola_segundos", self.fin_lectura - self.ultimo_byte, **etiquetas)
+        if self.decodificacion is not None:
+            observar("controlstock_vfp_decodificacion_segundos", self.decodificacion, **etiquetas)
+        if self.bytes_enviados:
+            observar("controlstock_vfp_enviados_bytes", self.bytes_enviados, **etiquetas)
+        if self.bytes_recibidos:
+            observar("controlstock_vfp_recibidos_bytes", self.bytes_recibidos, **etiquetas)
+        if self.error:
+            incrementar("controlstock_vfp_errores_total", comando=self.comando, motivo=self.error)
+
+
+# Escritor de este worker: un thread daemon que se arranca con la primera métrica
+_escritor = None
+_lock_escritor = threading.Lock()
+
+
+def _archivo(directorio):
+    return os.path.join(directorio, f"{os.getpid()}.json")
+
+
+def escribir(directorio=None):
+    """Guarda la instantánea de este proceso en METRICAS_DIR (reemplazo atómico del archivo)"""
+    directorio = directorio or METRICAS_DIR
+    if not directorio:
+        return
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        archivo = _archivo(directorio)
+        with open(archivo + ".tmp", "w") as f:
+            json.dump(instantanea_local(), f)
+        os.replace(archivo + ".tmp", archivo)
+    except OSError as e:
+        logger.warning("No se pudieron escribir las métricas en %s: %s", directorio, e)
+
+
+def _asegurar_escritor():
+    global _escritor
+    if _escritor is not None or not METRICAS_DIR:
+        return
+    with _lock_escritor:
+        if _escritor is None:
+            _escritor = threading.Thread(target=_escribir_periodicamente, name="controlstock-metricas", daemon=True)
+            _escritor.start()
+            atexit.register(escribir)
+
+
+def _escribir_periodicamente():
+    while True:
+        time.sleep(METRICAS_INTERVALO)
+        escribir()
+
+
+def _despues_de_fork():
+    # El hijo no hereda el thread (p.ej. gunicorn --preload) y empieza con sus propias métricas
+    global _escritor, registro
+    _escritor = None
+    registro = Registro()
+
+
+os.register_at_fork(after_in_child=_despues_de_fork)
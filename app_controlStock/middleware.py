@@ -0,0 +1,41 @@
+"""
+Middleware de métricas: duración de cada vista (por nombre de URL y clase de status)
+Sirve para vistas sync y async sin forzar el cambio de contexto.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metricas
+
+
+def _observar(request, response, inicio):
+    coincidencia = request.resolver_match
+    metricas.observar("controlstock_vista_segundos", time.perf_counter() - inicio,
+                      vista=coincidencia.url_name if coincidencia and coincidencia.url_name else "sin_ruta",
+                      status=f"{response.status_code // 100}xx")
+
+
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        inicio = time.perf_counter()
+        response = self.get_response(request)
+        _observar(request, response, inicio)
+        return response
+
+    async def __acall__(self, request):
+        inicio = time.perf_counter()
+        response = await self.get_response(request)
+        _observar(request, response, inicio)
+        return response
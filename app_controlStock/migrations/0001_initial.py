@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 12:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroDiferido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usuario', models.CharField(max_length=150)),
+                ('idempotencia', models.CharField(max_length=100)),
+                ('id_solicitud', models.CharField(max_length=100)),
+                ('cantidad', models.IntegerField()),
+                ('token', models.CharField(blank=True, default='', max_length=500)),
+                ('connection_config', models.TextField(blank=True, default='')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviando', 'Enviando'), ('registrado', 'Registrado'), ('rechazado', 'Rechazado')], default='pendiente', max_length=12)),
+                ('mensaje', models.TextField(blank=True, default='')),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reclamado', models.CharField(blank=True, default='', max_length=32)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='registro_diferido_cola')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'idempotencia'), name='registro_diferido_unico')],
+            },
+        ),
+    ]
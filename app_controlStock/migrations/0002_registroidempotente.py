@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 13:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controlStock', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroIdempotente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usuario', models.CharField(max_length=150)),
+                ('id_solicitud', models.CharField(max_length=100)),
+                ('clave', models.CharField(max_length=100)),
+                ('estado', models.CharField(blank=True, choices=[('', 'Sin resultado'), ('completado', 'Completado'), ('incierto', 'Incierto')], default='', max_length=12)),
+                ('respuesta', models.JSONField(blank=True, null=True)),
+                ('en_curso_desde', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['actualizado'], name='registro_idempotente_vence')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'id_solicitud', 'clave'), name='registro_idempotente_unico')],
+            },
+        ),
+    ]
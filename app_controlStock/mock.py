@@ -1,18 +1,48 @@
 #!/usr/bin/env python3
 """
-Mock VFP Server - Simula la interfaz Visual FoxPro para testing local
+Mock VFP Server - Simula la interfaz Visual FoxPro para testing local y pruebas de carga
 Escucha en localhost:5555 (configurable)
+
+- Servidor asyncio: miles de conexiones sin un thread por conexión. El
+  desencriptado, el proceso y el encriptado corren en el executor por defecto.
+- Mismo cifrado que VFP (algoritmoEncriptacionCasero, variantes sobre bytes).
+- Perfiles de latencia y fallas inyectables (ver Perfil y PERFILES).
+- Datasets de pendientes generados de cualquier tamaño (ver cargar_pendientes).
+- El estado (pendientes, versión, historial, controles) se modifica bajo _lock.
 """
-import socket
+import argparse
+import asyncio
 import json
+import random
+import re
+import socket
 import threading
-import time
-from datetime import datetime
+from collections import deque
+from datetime import date, datetime, timedelta
+
+try:
+    from .algoritmoEncriptacionCasero import encriptar, desencriptar, encriptar_bytes, desencriptar_bytes, texto_a_bytes
+except ImportError:
+    # Ejecutado como script: python mock.py
+    from algoritmoEncriptacionCasero import encriptar, desencriptar, encriptar_bytes, desencriptar_bytes, texto_a_bytes
 
 # Configuración
 HOST = '127.0.0.1'  # localhost
 PORT = 5555
-BUFFER_SIZE = 2048
+BUFFER_SIZE = 64 * 1024
+LONGITUD_HEADER = 10  # Igual que tcp_client.LONGITUD_HEADER
+ESPERA_MENSAJE = 5.0  # Segundos máximos esperando el resto de un mensaje sin framing
+
+# Si es True el servidor no cierra la conexión después de responder
+# (simula un VFP que deja el socket abierto)
+MANTENER_CONEXION = False
+
+# Segundos de demora antes de responder cada comando (simula un VFP lento).
+# Se suma a la demora del perfil activo
+LATENCIA = 0.0
+
+# Un print por comando/conexión (apagado en iniciar_en_background: ruido en tests y carga)
+VERBOSO = True
 
 # Base de datos mock
 TOKENS_VALIDOS = {
@@ -38,29 +68,257 @@ PENDIENTES_MOCK = [
 # Registro de stocks controlados
 STOCKS_CONTROLADOS = []
 
+# Versión de la lista de pendientes: aumenta con cada alta/baja. El historial
+# permite responder controlPendientes con delta desde una VersionPendientes
+PENDIENTES_VERSION = 1
+HISTORIAL_PENDIENTES = deque(maxlen=1000)  # (versión, idSolicitud)
+
+# Protege el estado de arriba: los comandos se procesan en threads del executor
+_lock = threading.RLock()
+# Último JSON serializado de los pendientes: (lista, versión, largo, texto)
+_pendientes_serializados = None
+
+
+class Perfil:
+    """
+    Comportamiento de VFP a simular: latencia y fallas.
+
+    Args:
+        latencia: segundos fijos antes de cada respuesta
+        variacion: hasta estos segundos extra por respuesta (uniforme)
+        prob_lenta, latencia_lenta: cola de latencia (p.ej. 1% de las respuestas 2s más tarde)
+        prob_error: responde {"estado": False} sin procesar el comando
+        prob_corte: cierra la conexión (RST) sin procesar ni responder
+        prob_sin_respuesta: no procesa ni responde; el cliente llega a su timeout
+        prob_perdida: procesa el comando pero no responde (VFP lo aplicó y la respuesta se perdió)
+        comandos: si se indica, las fallas solo aplican a esos comandos (en minúsculas)
+        semilla: para repetir la misma secuencia de demoras y fallas
+    """
+
+    def __init__(self, latencia=0.0, variacion=0.0, prob_lenta=0.0, latencia_lenta=0.0, prob_error=0.0,
+                 prob_corte=0.0, prob_sin_respuesta=0.0, prob_perdida=0.0, comandos=None, semilla=None):
+        self.latencia = latencia
+        self.variacion = variacion
+        self.prob_lenta = prob_lenta
+        self.latencia_lenta = latencia_lenta
+        self.fallas = (("corte", prob_corte), ("sin_respuesta", prob_sin_respuesta),
+                       ("perdida", prob_perdida), ("error", prob_error))
+        self.comandos = set(comandos) if comandos is not None else None
+        self._azar = random.Random(semilla)
+
+    def demora(self):
+        demora = self.latencia
+        if self.variacion:
+            demora += self._azar.uniform(0, self.variacion)
+        if self.prob_lenta and self._azar.random() < self.prob_lenta:
+            demora += self.latencia_lenta
+        return demora
+
+    def sortear_falla(self, comando):
+        """None o "corte" / "sin_respuesta" / "perdida" / "error" """
+        if self.comandos is not None and comando not in self.comandos:
+            return None
+        sorteo = self._azar.random()
+        for falla, probabilidad in self.fallas:
+            if sorteo < probabilidad:
+                return falla
+            sorteo -= probabilidad
+        return None
+
+
+PERFILES = {
+    "rapido": Perfil(),
+    "lan": Perfil(latencia=0.002, variacion=0.003),
+    "wan": Perfil(latencia=0.06, variacion=0.04, prob_lenta=0.02, latencia_lenta=1.5),
+    "inestable": Perfil(latencia=0.05, variacion=0.1, prob_lenta=0.05, latencia_lenta=3.0,
+                        prob_error=0.01, prob_corte=0.02, prob_perdida=0.02),
+}
+PERFIL = PERFILES["rapido"]
+
+_PRODUCTOS = ("Tornillo", "Tuerca", "Arandela", "Bulón", "Perno", "Cable UTP", "Conector", "Caño", "Codo",
+              "Cinta aisladora", "Abrazadera", "Tarugo", "Clavo", "Bisagra", "Llave térmica", "Disyuntor")
+_MEDIDAS = ("1/4", "3/8", "1/2", "M6", "M8", "M10", "Cat5e", "Cat6", "RJ45", "20mm", "40mm", "2m", "10A", "16A")
+_ACABADOS = ("", "", "zincado", "acero inoxidable", "galvanizado", "negro", "x 100 u.", "reforzado")
+
 
 def encriptar_mock(mensaje):
-    """Mock de encriptación - solo devuelve el mensaje"""
-    return mensaje
+    """Encripta igual que VFP (mismo algoritmo que usa el cliente)"""
+    return encriptar(mensaje)
 
 
 def desencriptar_mock(mensaje):
-    """Mock de desencriptación - solo devuelve el mensaje"""
-    return mensaje
+    """Desencripta igual que VFP (mismo algoritmo que usa el cliente)"""
+    return desencriptar(mensaje)
+
+
+def _log(mensaje):
+    if VERBOSO:
+        print(mensaje)
+
+
+def enmarcar_respuesta(payload, framing, terminador=0):
+    """Aplica el framing pedido por el cliente al payload encriptado (bytes)"""
+    if framing == "longitud":
+        return f"{len(payload):0{LONGITUD_HEADER}d}".encode('ascii') + payload
+    if framing == "terminador":
+        return payload + bytes([terminador])
+    return payload
+
+
+# ============ DATASETS ============
+
+def generar_pendientes(cantidad, semilla=0):
+    """
+    Pendientes sintéticos [idSolicitud, codigo, descripcion, fecha] con ids únicos,
+    códigos repetidos entre solicitudes y descripciones variadas (para búsquedas)
+    """
+    azar = random.Random(semilla)
+    productos = max(1, cantidad // 3)
+    inicio = date(2024, 1, 1)
+    pendientes = []
+    for i in range(1, cantidad + 1):
+        producto = azar.randrange(productos)
+        descripcion = " ".join(filter(None, (_PRODUCTOS[producto % len(_PRODUCTOS)],
+                                             _MEDIDAS[producto // len(_PRODUCTOS) % len(_MEDIDAS)],
+                                             azar.choice(_ACABADOS))))
+        fecha = inicio + timedelta(days=azar.randrange(365))
+        pendientes.append([f"SOL{i:07d}", f"PROD{producto:06d}", descripcion, fecha.isoformat()])
+    return pendientes
+
+
+def cargar_pendientes(cantidad, semilla=0):
+    """Reemplaza los pendientes por un dataset generado (nueva versión, sin historial para deltas)"""
+    global PENDIENTES_MOCK, PENDIENTES_VERSION
+    pendientes = generar_pendientes(cantidad, semilla)
+    with _lock:
+        PENDIENTES_MOCK = pendientes
+        PENDIENTES_VERSION += 1
+        HISTORIAL_PENDIENTES.clear()
+
+
+# ============ ESTADO ============
+
+def registrar_cambio_pendiente(id_solicitud):
+    """Anota un alta o baja de la solicitud en el historial de versiones"""
+    global PENDIENTES_VERSION
+    with _lock:
+        PENDIENTES_VERSION += 1
+        HISTORIAL_PENDIENTES.append((PENDIENTES_VERSION, id_solicitud))
+
+
+def agregar_pendiente(item):
+    """Agrega una solicitud pendiente [idSolicitud, codigo, descripcion, fecha]"""
+    with _lock:
+        PENDIENTES_MOCK.append(item)
+        registrar_cambio_pendiente(item[0])
+
+
+def delta_pendientes(desde):
+    """
+    (agregados, eliminados) desde la versión 'desde', o None si no se puede
+    calcular (versión desconocida o fuera del historial) y hay que mandar todo
+    """
+    try:
+        desde = int(desde)
+    except (TypeError, ValueError):
+        return None
+    with _lock:
+        if desde > PENDIENTES_VERSION:
+            return None
+        if desde < PENDIENTES_VERSION and (not HISTORIAL_PENDIENTES or HISTORIAL_PENDIENTES[0][0] > desde + 1):
+            return None
 
+        tocados = {id_solicitud for version, id_solicitud in HISTORIAL_PENDIENTES if version > desde}
+        agregados = [item for item in PENDIENTES_MOCK if item[0] in tocados]
+    actuales = {item[0] for item in agregados}
+    eliminados = [id_solicitud for id_solicitud in tocados if id_solicitud not in actuales]
+    return agregados, eliminados
+
+
+class _JSONCrudo(str):
+    """Fragmento JSON ya serializado: se inserta tal cual en la respuesta"""
+
+
+def _pendientes_json():
+    """JSON de la lista de pendientes, serializado una sola vez por versión"""
+    global _pendientes_serializados
+    with _lock:
+        clave = (PENDIENTES_MOCK, PENDIENTES_VERSION, len(PENDIENTES_MOCK))
+        cacheado = _pendientes_serializados
+        if cacheado is None or cacheado[0] is not clave[0] or cacheado[1:3] != clave[1:]:
+            cacheado = _pendientes_serializados = clave + (_JSONCrudo(json.dumps(PENDIENTES_MOCK, ensure_ascii=False)),)
+        return cacheado[3]
+
+
+_NO_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def _serializar(respuesta, solo_ascii=False):
+    """
+    JSON de la respuesta. solo_ascii (framing "terminador"): los caracteres no
+    ASCII van escapados como \\uXXXX para que ningún byte encriptado sea el terminador.
+    """
+    crudos = [(clave, valor) for clave, valor in respuesta.items() if isinstance(valor, _JSONCrudo)]
+    if not crudos:
+        return json.dumps(respuesta, ensure_ascii=solo_ascii)
+    texto = json.dumps({k: v for k, v in respuesta.items() if not isinstance(v, _JSONCrudo)}, ensure_ascii=solo_ascii)
+    agregados = ", ".join(f"{json.dumps(clave)}: {valor}" for clave, valor in crudos)
+    texto = texto[:-1] + (", " if len(texto) > 2 else "") + agregados + "}"
+    if solo_ascii:
+        # Los fragmentos crudos se serializaron con ensure_ascii=False
+        texto = _NO_ASCII.sub(lambda m: json.dumps(m.group())[1:-1], texto)
+    return texto
+
+
+def registrar_control(id_solicitud, cantidad, usr_activo):
+    """Registra un control: lo saca de pendientes y lo agrega a STOCKS_CONTROLADOS"""
+    # Buscar y remover la solicitud de pendientes
+    solicitud_encontrada = None
+    with _lock:
+        for i, item in enumerate(PENDIENTES_MOCK):
+            if item[0] == id_solicitud:
+                solicitud_encontrada = PENDIENTES_MOCK.pop(i)
+                registrar_cambio_pendiente(id_solicitud)
+                break
+
+        if not solicitud_encontrada:
+            _log(f"   ❌ Solicitud no encontrada: {id_solicitud}")
+            return {
+                "estado": False,
+                "mensaje": f"Solicitud {id_solicitud} no encontrada"
+            }
+
+        # Registrar el stock controlado
+        STOCKS_CONTROLADOS.append({
+            "idSolicitud": id_solicitud,
+            "codigo": solicitud_encontrada[1],
+            "descripcion": solicitud_encontrada[2],
+            "cantidad": cantidad,
+            "usuario": usr_activo,
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        restantes = len(PENDIENTES_MOCK)
+
+    _log(f"   ✅ Stock controlado: {id_solicitud} - {cantidad} unidades")
+    _log(f"   📦 Pendientes restantes: {restantes}")
+    return {
+        "estado": True,
+        "mensaje": f"Stock controlado correctamente. Código: {solicitud_encontrada[1]}, Cantidad: {cantidad}"
+    }
+
+
+# ============ COMANDOS ============
 
 def procesar_comando(comando_dict):
     """Procesa comandos según el protocolo VFP"""
     comando = comando_dict.get("Comando", "").lower()
-    
-    print(f"\n📨 Comando recibido: {comando}")
-    print(f"   Datos: {json.dumps(comando_dict, indent=2, ensure_ascii=False)}")
-    
+
+    _log(f"\n📨 Comando recibido: {comando}")
+
     # ============ VERIFICAR TOKEN ============
     if comando == "verificartoken":
         token = comando_dict.get("Token", "")
-        vista = comando_dict.get("Vista", "")
-        
+
         if token in TOKENS_VALIDOS:
             user_data = TOKENS_VALIDOS[token]
             respuesta = {
@@ -70,173 +328,347 @@ def procesar_comando(comando_dict):
                 "nombre": user_data["nombre"],
                 "token": token
             }
-            print(f"   ✅ Token válido para: {user_data['nombre']}")
+            _log(f"   ✅ Token válido para: {user_data['nombre']}")
         else:
             respuesta = {
                 "estado": False,
                 "mensaje": "Token inválido o expirado"
             }
-            print(f"   ❌ Token inválido: {token}")
-        
+            _log(f"   ❌ Token inválido: {token}")
+
         return respuesta
-    
+
     # ============ CONTROL PENDIENTES ============
     elif comando == "controlpendientes":
         token = comando_dict.get("Token", "")
-        usr_activo = comando_dict.get("usrActivo", "")
-        
+
         # Validar token
         if token not in TOKENS_VALIDOS:
             return {
                 "estado": False,
                 "mensaje": "Token inválido"
             }
-        
-        respuesta = {
-            "estado": True,
-            "mensaje": "",
-            "deposito": "Depósito Central",
-            "cod_deposito": "DEP001",
-            "pendientes": PENDIENTES_MOCK.copy()  # Copia para no modificar el original
-        }
-        print(f"   ✅ Devolviendo {len(PENDIENTES_MOCK)} pendientes")
+
+        with _lock:
+            respuesta = {
+                "estado": True,
+                "mensaje": "",
+                "deposito": "Depósito Central",
+                "cod_deposito": "DEP001",
+                "VersionPendientes": PENDIENTES_VERSION
+            }
+
+            delta = None
+            if "VersionPendientes" in comando_dict:
+                delta = delta_pendientes(comando_dict["VersionPendientes"])
+            if delta is not None:
+                respuesta["Delta"] = True
+                respuesta["Agregados"], respuesta["Eliminados"] = delta
+                _log(f"   ✅ Devolviendo delta desde versión {comando_dict['VersionPendientes']}: "
+                     f"+{len(delta[0])} -{len(delta[1])}")
+            else:
+                respuesta["pendientes"] = _pendientes_json()
+                _log(f"   ✅ Devolviendo {len(PENDIENTES_MOCK)} pendientes")
         return respuesta
-    
+
     # ============ STOCK CONTROLADO ============
-    elif comando == "stockcontrolado":
-        token = comando_dict.get("token", "")
-        id_solicitud = comando_dict.get("idSolicitud", "")
-        cantidad = comando_dict.get("cantidad", 0)
+    elif comando in ("stockcontrolado", "registrarstockcontrolado"):
+        token = comando_dict.get("Token", comando_dict.get("token", ""))
         usr_activo = comando_dict.get("UsrActivo", "")
-        
+
         # Validar token
         if token not in TOKENS_VALIDOS:
             return {
                 "estado": False,
                 "mensaje": "Token inválido"
             }
-        
-        # Buscar y remover la solicitud de pendientes
-        solicitud_encontrada = None
-        for i, item in enumerate(PENDIENTES_MOCK):
-            if item[0] == id_solicitud:
-                solicitud_encontrada = PENDIENTES_MOCK.pop(i)
-                break
-        
-        if solicitud_encontrada:
-            # Registrar el stock controlado
-            registro = {
-                "idSolicitud": id_solicitud,
-                "codigo": solicitud_encontrada[1],
-                "descripcion": solicitud_encontrada[2],
-                "cantidad": cantidad,
-                "usuario": usr_activo,
-                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            STOCKS_CONTROLADOS.append(registro)
-            
-            respuesta = {
-                "estado": True,
-                "mensaje": f"Stock controlado correctamente. Código: {solicitud_encontrada[1]}, Cantidad: {cantidad}"
-            }
-            print(f"   ✅ Stock controlado: {id_solicitud} - {cantidad} unidades")
-            print(f"   📦 Pendientes restantes: {len(PENDIENTES_MOCK)}")
-        else:
-            respuesta = {
+
+        return registrar_control(comando_dict.get("idSolicitud", ""), comando_dict.get("cantidad", 0), usr_activo)
+
+    # ============ STOCK CONTROLADO EN LOTE ============
+    elif comando == "registrarstockcontroladolote":
+        token = comando_dict.get("Token", comando_dict.get("token", ""))
+        usr_activo = comando_dict.get("UsrActivo", "")
+
+        if token not in TOKENS_VALIDOS:
+            return {
                 "estado": False,
-                "mensaje": f"Solicitud {id_solicitud} no encontrada"
+                "mensaje": "Token inválido"
             }
-            print(f"   ❌ Solicitud no encontrada: {id_solicitud}")
-        
-        return respuesta
-    
+
+        resultados = []
+        for item in comando_dict.get("Items", []):
+            resultado = registrar_control(item.get("idSolicitud", ""), item.get("cantidad", 0), usr_activo)
+            resultados.append({"idSolicitud": item.get("idSolicitud", ""), **resultado})
+
+        return {
+            "estado": True,
+            "mensaje": "",
+            "resultados": resultados
+        }
+
     # ============ COMANDO DESCONOCIDO ============
     else:
-        print(f"   ⚠️  Comando desconocido: {comando}")
+        _log(f"   ⚠️  Comando desconocido: {comando}")
         return {
             "estado": False,
             "mensaje": f"Comando '{comando}' no reconocido"
         }
 
 
-def manejar_cliente(conn, addr):
-    """Maneja la conexión de un cliente"""
-    print(f"\n🔌 Nueva conexión desde {addr}")
-    
+def procesar_payload(payload):
+    """
+    Desencripta, procesa y encripta la respuesta con el framing pedido por el cliente.
+    Corre en un thread del executor.
+
+    Returns:
+        tuple: (bytes a enviar o None si no hay que responder, falla sorteada por PERFIL o None)
+    """
+    framing = None
+    falla = None
     try:
-        # Recibir datos
-        data = conn.recv(BUFFER_SIZE)
+        comando_dict = json.loads(desencriptar_bytes(payload).decode('latin-1'))
+        framing = comando_dict.get("Framing")
+        falla = PERFIL.sortear_falla(str(comando_dict.get("Comando", "")).lower())
+        if falla in ("corte", "sin_respuesta"):
+            _log(f"   💥 Falla simulada: {falla}")
+            return None, falla
+        if falla == "error":
+            respuesta = {"estado": False, "mensaje": "Error simulado de VFP"}
+        else:
+            respuesta = procesar_comando(comando_dict)
+        if falla == "perdida":
+            _log("   💥 Falla simulada: comando procesado sin respuesta")
+            return None, falla
+        if "IdMensaje" in comando_dict:
+            # Correlación para clientes que envían varios comandos en pipeline
+            respuesta["IdMensaje"] = comando_dict["IdMensaje"]
+    except (ValueError, IndexError, AttributeError) as e:
+        _log(f"   ❌ Error parseando JSON: {e}")
+        respuesta = {"estado": False, "mensaje": "JSON inválido"}
+
+    payload_respuesta = encriptar_bytes(texto_a_bytes(_serializar(respuesta, solo_ascii=framing == "terminador")))
+    return enmarcar_respuesta(payload_respuesta, framing), falla
+
+
+# ============ SERVIDOR ============
+
+def _mensaje_completo(buffer):
+    """Un mensaje sin framing está completo cuando desencriptado es un JSON válido"""
+    try:
+        json.loads(desencriptar_bytes(buffer).decode('latin-1'))
+        return True
+    except (ValueError, IndexError):
+        return False
+
+
+async def _esperar_cierre(reader):
+    """Como VFP: no cerrar hasta que el cliente cierre"""
+    try:
+        while await reader.read(BUFFER_SIZE):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def _responder(reader, writer, payload):
+    """Procesa y responde un mensaje aplicando el perfil. False si la conexión ya no sirve"""
+    datos, falla = await asyncio.get_running_loop().run_in_executor(None, procesar_payload, payload)
+    if falla == "corte":
+        writer.transport.abort()
+        return False
+    demora = LATENCIA + PERFIL.demora()
+    if demora:
+        await asyncio.sleep(demora)
+    if datos is None:
+        await _esperar_cierre(reader)
+        return False
+    writer.write(datos)
+    await writer.drain()
+    return True
+
+
+async def _leer_hasta(reader, buffer, largo):
+    while len(buffer) < largo:
+        data = await reader.read(BUFFER_SIZE)
         if not data:
-            print(f"   ⚠️  Sin datos recibidos de {addr}")
-            return
-        
-        # Decodificar (mock - asume que viene en latin-1)
-        mensaje_recibido = data.decode('latin-1', errors='replace')
-        mensaje_desencriptado = desencriptar_mock(mensaje_recibido)
-        
-        # Parsear JSON
-        try:
-            comando_dict = json.loads(mensaje_desencriptado)
-        except json.JSONDecodeError as e:
-            print(f"   ❌ Error parseando JSON: {e}")
-            respuesta = {"estado": False, "mensaje": "JSON inválido"}
-            respuesta_json = json.dumps(respuesta, ensure_ascii=False)
-            conn.sendall(respuesta_json.encode('latin-1', errors='replace'))
+            return None
+        buffer += data
+    return buffer
+
+
+async def manejar_cliente(reader, writer, mantener_conexion=None):
+    """
+    Maneja la conexión de un cliente.
+
+    Solicitudes sin framing: un único mensaje por conexión (se lee hasta que el
+    payload desencriptado sea un JSON completo).
+    Solicitudes con header de longitud (keep-alive): se atienden en loop
+    sobre la misma conexión hasta que el cliente la cierre.
+    """
+    addr = writer.get_extra_info("peername")
+    _log(f"\n🔌 Nueva conexión desde {addr}")
+    if mantener_conexion is None:
+        mantener_conexion = MANTENER_CONEXION
+
+    buffer = b''
+    try:
+        while True:
+            if not buffer:
+                buffer = await reader.read(BUFFER_SIZE)
+                if not buffer:
+                    return
+
+            # Un payload encriptado nunca empieza con un dígito: es el header de longitud
+            if buffer[:1].isdigit():
+                buffer = await _leer_hasta(reader, buffer, LONGITUD_HEADER)
+                if buffer is not None:
+                    longitud = int(buffer[:LONGITUD_HEADER])
+                    buffer = await _leer_hasta(reader, buffer, LONGITUD_HEADER + longitud)
+                if buffer is None:
+                    _log(f"   ⚠️  Conexión cerrada con datos incompletos de {addr}")
+                    return
+                payload = buffer[LONGITUD_HEADER:LONGITUD_HEADER + longitud]
+                buffer = buffer[LONGITUD_HEADER + longitud:]
+                if not await _responder(reader, writer, payload):
+                    return
+                _log(f"   📤 Respuesta enviada a {addr} (keep-alive)")
+                continue
+
+            # Mensaje sin framing: puede llegar en varios segmentos
+            while not _mensaje_completo(buffer):
+                try:
+                    data = await asyncio.wait_for(reader.read(BUFFER_SIZE), ESPERA_MENSAJE)
+                except asyncio.TimeoutError:
+                    data = b''
+                if not data:
+                    break
+                buffer += data
+            if await _responder(reader, writer, buffer):
+                _log(f"   📤 Respuesta enviada a {addr}")
+                if mantener_conexion:
+                    await _esperar_cierre(reader)
             return
-        
-        # Procesar comando
-        respuesta = procesar_comando(comando_dict)
-        
-        # Enviar respuesta
-        respuesta_json = json.dumps(respuesta, ensure_ascii=False)
-        respuesta_encriptada = encriptar_mock(respuesta_json)
-        conn.sendall(respuesta_encriptada.encode('latin-1', errors='replace'))
-        
-        print(f"   📤 Respuesta enviada a {addr}")
-        
+
     except Exception as e:
-        print(f"   ❌ Error manejando cliente {addr}: {e}")
+        _log(f"   ❌ Error manejando cliente {addr}: {e}")
     finally:
-        conn.close()
-        print(f"   🔌 Conexión cerrada con {addr}")
+        writer.close()
+        _log(f"   🔌 Conexión cerrada con {addr}")
 
 
-def servidor_tcp():
+def _socket_servidor(host, port, backlog):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((host, port))
+    s.listen(backlog)
+    return s
+
+
+def _configurar(latencia=None, perfil=None, pendientes=None, semilla=0):
+    global LATENCIA, PERFIL
+    if latencia is not None:
+        LATENCIA = latencia
+    if perfil is not None:
+        PERFIL = PERFILES[perfil] if isinstance(perfil, str) else perfil
+    if pendientes is not None:
+        cargar_pendientes(pendientes, semilla)
+
+
+class ServidorEnBackground:
+    """Servidor mock corriendo en su propio event loop (thread daemon)"""
+
+    def __init__(self, sock, mantener_conexion):
+        self.sock = sock
+        self.loop = asyncio.new_event_loop()
+        self._servidor = None
+        listo = threading.Event()
+        threading.Thread(target=self._correr, args=(mantener_conexion, listo), daemon=True).start()
+        listo.wait()
+
+    def _correr(self, mantener_conexion, listo):
+        asyncio.set_event_loop(self.loop)
+        self._servidor = self.loop.run_until_complete(asyncio.start_server(
+            lambda r, w: manejar_cliente(r, w, mantener_conexion), sock=self.sock))
+        listo.set()
+        self.loop.run_forever()
+
+    def close(self):
+        def detener():
+            self._servidor.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(detener)
+
+
+def iniciar_en_background(host=HOST, port=0, mantener_conexion=False, latencia=None, perfil=None,
+                          pendientes=None, semilla=0, verboso=False):
+    """
+    Inicia el servidor mock en un thread daemon (para tests y benchmarks).
+    'latencia' (segundos), 'perfil' (nombre de PERFILES o Perfil) y 'pendientes'
+    (cantidad a generar) reemplazan la configuración para todo el proceso.
+
+    Returns:
+        tuple: (servidor con close(), puerto asignado)
+    """
+    global VERBOSO
+    VERBOSO = verboso
+    _configurar(latencia, perfil, pendientes, semilla)
+    s = _socket_servidor(host, port, 1024)
+    return ServidorEnBackground(s, mantener_conexion), s.getsockname()[1]
+
+
+async def _servir(s, mantener_conexion):
+    servidor = await asyncio.start_server(lambda r, w: manejar_cliente(r, w, mantener_conexion), sock=s)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def servidor_tcp(host=HOST, port=PORT, mantener_conexion=False):
     """Inicia el servidor TCP mock"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen(5)
-        
-        print("=" * 60)
-        print("🚀 MOCK VFP SERVER INICIADO")
-        print("=" * 60)
-        print(f"📍 Host: {HOST}")
-        print(f"🔌 Puerto: {PORT}")
-        print(f"🔑 Tokens válidos:")
-        for token, data in TOKENS_VALIDOS.items():
-            print(f"   - {token[:20]}... → {data['nombre']}")
-        print(f"📦 Pendientes iniciales: {len(PENDIENTES_MOCK)}")
-        print("=" * 60)
-        print("\n⏳ Esperando conexiones...\n")
-        
-        try:
-            while True:
-                conn, addr = s.accept()
-                # Manejar cada cliente en un thread separado
-                thread = threading.Thread(target=manejar_cliente, args=(conn, addr))
-                thread.daemon = True
-                thread.start()
-        except KeyboardInterrupt:
-            print("\n\n🛑 Servidor detenido por usuario")
-            print(f"\n📊 RESUMEN DE SESIÓN:")
-            print(f"   Stocks controlados: {len(STOCKS_CONTROLADOS)}")
-            print(f"   Pendientes restantes: {len(PENDIENTES_MOCK)}")
-            if STOCKS_CONTROLADOS:
-                print(f"\n📋 Registros de stocks controlados:")
-                for reg in STOCKS_CONTROLADOS:
-                    print(f"   - {reg['codigo']}: {reg['cantidad']} unidades ({reg['fecha']})")
+    s = _socket_servidor(host, port, 1024)
+
+    print("=" * 60)
+    print("🚀 MOCK VFP SERVER INICIADO")
+    print("=" * 60)
+    print(f"📍 Host: {host}")
+    print(f"🔌 Puerto: {port}")
+    print(f"🔗 Mantener conexión abierta: {'sí' if mantener_conexion else 'no'}")
+    print(f"🐢 Latencia por comando: {LATENCIA}s (+ perfil)")
+    print(f"🔑 Tokens válidos:")
+    for token, data in TOKENS_VALIDOS.items():
+        print(f"   - {token[:20]}... → {data['nombre']}")
+    print(f"📦 Pendientes iniciales: {len(PENDIENTES_MOCK)}")
+    print("=" * 60)
+    print("\n⏳ Esperando conexiones...\n")
+
+    try:
+        asyncio.run(_servir(s, mantener_conexion))
+    except KeyboardInterrupt:
+        print("\n\n🛑 Servidor detenido por usuario")
+        print(f"\n📊 RESUMEN DE SESIÓN:")
+        print(f"   Stocks controlados: {len(STOCKS_CONTROLADOS)}")
+        print(f"   Pendientes restantes: {len(PENDIENTES_MOCK)}")
+        if STOCKS_CONTROLADOS and VERBOSO:
+            print(f"\n📋 Registros de stocks controlados:")
+            for reg in STOCKS_CONTROLADOS[-50:]:
+                print(f"   - {reg['codigo']}: {reg['cantidad']} unidades ({reg['fecha']})")
 
 
 if __name__ == "__main__":
-    servidor_tcp()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mock VFP Server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--mantener-conexion", action="store_true",
+                        help="No cerrar el socket después de responder (como algunos VFP)")
+    parser.add_argument("--latencia", type=float, default=LATENCIA,
+                        help="Segundos de demora antes de responder cada comando")
+    parser.add_argument("--perfil", choices=sorted(PERFILES), default="rapido",
+                        help="Latencia y fallas simuladas")
+    parser.add_argument("--pendientes", type=int, default=None,
+                        help="Generar esta cantidad de pendientes (p.ej. 100000)")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del dataset generado")
+    parser.add_argument("--silencioso", action="store_true", help="Sin un print por comando (pruebas de carga)")
+    args = parser.parse_args()
+    VERBOSO = not args.silencioso
+    _configurar(args.latencia, args.perfil, args.pendientes, args.semilla)
+    servidor_tcp(args.host, args.port, args.mantener_conexion)
@@ -1,3 +1,78 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class RegistroDiferido(models.Model):
+    """Control aceptado en modo diferido (REGISTRO_DIFERIDO), enviado a VFP por diferido.vaciar"""
+
+    PENDIENTE = "pendiente"
+    ENVIANDO = "enviando"
+    REGISTRADO = "registrado"
+    RECHAZADO = "rechazado"
+    ESTADOS = [
+        (PENDIENTE, "Pendiente"),
+        (ENVIANDO, "Enviando"),
+        (REGISTRADO, "Registrado"),
+        (RECHAZADO, "Rechazado"),
+    ]
+
+    usuario = models.CharField(max_length=150)
+    idempotencia = models.CharField(max_length=100)
+    id_solicitud = models.CharField(max_length=100)
+    cantidad = models.IntegerField()
+    # Para enviarlo fuera del request: token y connection_config con el servidor ya
+    # resuelto del operador (ver diferido.encolar; el token se borra al terminar)
+    token = models.CharField(max_length=500, blank=True, default="")
+    connection_config = models.TextField(blank=True, default="")
+    estado = models.CharField(max_length=12, choices=ESTADOS, default=PENDIENTE)
+    mensaje = models.TextField(blank=True, default="")
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    reclamado = models.CharField(max_length=32, blank=True, default="")  # Vaciado que lo está enviando
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["usuario", "idempotencia"], name="registro_diferido_unico"),
+        ]
+        indexes = [
+            models.Index(fields=["estado", "proximo_intento"], name="registro_diferido_cola"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario} {self.id_solicitud} x{self.cantidad} ({self.estado})"
+
+
+class RegistroIdempotente(models.Model):
+    """
+    Reserva y resultado de un registro con clave de idempotencia (ver idempotencia.py).
+    La restricción única hace que la reserva sea un INSERT atómico entre workers.
+    """
+
+    COMPLETADO = "completado"
+    INCIERTO = "incierto"
+    ESTADOS = [
+        ("", "Sin resultado"),
+        (COMPLETADO, "Completado"),
+        (INCIERTO, "Incierto"),
+    ]
+
+    usuario = models.CharField(max_length=150)
+    id_solicitud = models.CharField(max_length=100)
+    clave = models.CharField(max_length=100)
+    estado = models.CharField(max_length=12, choices=ESTADOS, blank=True, default="")
+    respuesta = models.JSONField(null=True, blank=True)
+    en_curso_desde = models.DateTimeField(null=True, blank=True)  # Reserva de un request que lo está enviando
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["usuario", "id_solicitud", "clave"], name="registro_idempotente_unico"),
+        ]
+        indexes = [
+            models.Index(fields=["actualizado"], name="registro_idempotente_vence"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario} {self.id_solicitud} {self.clave} ({self.estado or 'en curso'})"
@@ -0,0 +1,96 @@
+"""
+Normalización de las respuestas de VFP
+VFP no es consistente con las mayúsculas de las claves ("Estado"/"estado",
+"IdSolicitud"/"IDSOLICITUD"...). Un Esquema declara, para cada campo canónico,
+sus variantes en orden de prioridad. La primera vez que ve un conjunto de claves
+arma el plan (clave de la respuesta → campo canónico) y lo reutiliza: cada dict
+se normaliza con una sola pasada sobre el plan en vez de cadenas de dict.get.
+"""
+VALORES_VERDADEROS = frozenset(("T", "TRUE", "1", "OK"))
+
+
+def a_booleano(valor):
+    """'T'/'TRUE'/'1'/'OK' (cualquier capitalización) o bool → bool"""
+    if isinstance(valor, bool):
+        return valor
+    return str(valor).upper() in VALORES_VERDADEROS
+
+
+class Esquema:
+    """
+    Args:
+        campos: {campo canónico: (variante, variante, ...)} en orden de prioridad
+        defaults: {campo canónico: valor si no viene ninguna variante} (None si no se indica).
+            Se comparten entre resultados: usar valores inmutables.
+        max_planes: planes cacheados como máximo (se descartan todos al llenarse)
+        constructor: si se indica, normalizar() devuelve constructor(campo1, campo2, ...)
+            (en el orden de 'campos') en lugar de un dict
+    """
+
+    def __init__(self, campos, defaults=None, max_planes=256, constructor=None):
+        defaults = defaults or {}
+        self.constructor = constructor
+        self.campos = [(canonico, tuple(variantes), defaults.get(canonico)) for canonico, variantes in campos.items()]
+        self.max_planes = max_planes
+        self._planes = {}
+        # Último plan "exacto" (todas las claves del dict se usan):
+        # (cantidad de claves, primera variante usada, función)
+        self._ultimo = None
+
+    def _compilar(self, claves):
+        """
+        Arma una función que devuelve el dict normalizado con un único literal
+        {campo: datos[variante], ...} (o constructor(datos[variante], ...)).
+        Si alguna variante no está, la función lanza KeyError (así se detecta
+        que el plan no sirve para otro dict).
+        """
+        presentes = set(claves)
+        valores, constantes, usadas = [], {}, set()
+        for i, (canonico, variantes, default) in enumerate(self.campos):
+            for variante in variantes:
+                if variante in presentes:
+                    valores.append(f"datos[{variante!r}]")
+                    usadas.add(variante)
+                    break
+            else:
+                constantes[f"_d{i}"] = default
+                valores.append(f"_d{i}")
+
+        if self.constructor is not None:
+            constantes["_constructor"] = self.constructor
+            expresion = f"_constructor({', '.join(valores)})"
+        else:
+            expresion = "{" + ", ".join(f"{c!r}: {v}" for (c, _, _), v in zip(self.campos, valores)) + "}"
+        argumentos = "".join(f", {nombre}={nombre}" for nombre in constantes)
+        codigo = f"def normalizar(datos{argumentos}):\n    return {expresion}\n"
+        espacio = dict(constantes)
+        exec(codigo, espacio)
+        # Exacto: el dict no tiene claves fuera del plan, así que otro dict con la
+        # misma cantidad de claves y sin KeyError tiene exactamente las mismas
+        primera = next((v for v in claves if v in usadas), None)
+        return espacio["normalizar"], primera, usadas == presentes
+
+    def plan(self, datos):
+        """Función normalizadora cacheada para las claves de 'datos' (el orden de las claves es parte de la clave)"""
+        claves = tuple(datos)
+        plan = self._planes.get(claves)
+        if plan is None:
+            if len(self._planes) >= self.max_planes:
+                self._planes.clear()
+            plan = self._planes[claves] = self._compilar(claves)
+        funcion, primera, exacto = plan
+        if exacto:
+            self._ultimo = (len(claves), primera, funcion)
+        return funcion
+
+    def normalizar(self, datos):
+        """Devuelve un dict nuevo solo con los campos canónicos (o el objeto del constructor)"""
+        ultimo = self._ultimo
+        # Camino rápido: mismo tamaño y misma primera variante que el último dict
+        # (lo normal dentro de una respuesta); el KeyError cubre el resto
+        if ultimo is not None and len(datos) == ultimo[0] and ultimo[1] in datos:
+            try:
+                return ultimo[2](datos)
+            except KeyError:
+                pass
+        return self.plan(datos)(datos)
@@ -0,0 +1,236 @@
+"""
+Registro compacto de un pendiente, su transporte en columnas hacia el navegador
+y el índice para paginar/buscar sobre un snapshot de la lista
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from .__init__ import INDICES_PENDIENTES_MAX
+
+# Formato negociado con el navegador (?formato=columnas) y nombre de cada columna
+FORMATO_COLUMNAS = "columnas"
+COLUMNAS = (("id", "idSolicitud"), ("codigo", "codigo"), ("descripcion", "descripcion"), ("fecha", "fecha"))
+_PALABRAS = re.compile(r"\w+").findall
+
+
+class Pendiente:
+    """Un pendiente ya normalizado (fecha en dd/mm/yyyy). Sin __dict__ por instancia."""
+
+    __slots__ = ("idSolicitud", "codigo", "descripcion", "fecha")
+
+    def __init__(self, idSolicitud, codigo, descripcion, fecha):
+        self.idSolicitud = idSolicitud
+        self.codigo = codigo
+        self.descripcion = descripcion
+        self.fecha = fecha
+
+    def __eq__(self, otro):
+        if not isinstance(otro, Pendiente):
+            return NotImplemented
+        return (self.idSolicitud, self.codigo, self.descripcion, self.fecha) == \
+            (otro.idSolicitud, otro.codigo, otro.descripcion, otro.fecha)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Pendiente({self.idSolicitud!r}, {self.codigo!r}, {self.descripcion!r}, {self.fecha!r})"
+
+    def __getstate__(self):
+        # Para el backend "django" del cache (pickle)
+        return (self.idSolicitud, self.codigo, self.descripcion, self.fecha)
+
+    def __setstate__(self, estado):
+        self.idSolicitud, self.codigo, self.descripcion, self.fecha = estado
+
+    def como_dict(self):
+        return {"idSolicitud": self.idSolicitud, "codigo": self.codigo,
+                "descripcion": self.descripcion, "fecha": self.fecha}
+
+
+def a_columnas(pendientes):
+    """[Pendiente, ...] → {"id": [...], "codigo": [...], "descripcion": [...], "fecha": [...]}"""
+    return {columna: [getattr(p, atributo) for p in pendientes] for columna, atributo in COLUMNAS}
+
+
+def a_dicts(pendientes):
+    """[Pendiente, ...] → [{"idSolicitud", "codigo", "descripcion", "fecha"}, ...] (formato anterior)"""
+    return [p.como_dict() for p in pendientes]
+
+
+def _buscar_en_unidos(unido, inicios, texto):
+    """Posiciones de los valores (unidos con \\x00, cada uno empieza en inicios[i]) que contienen texto"""
+    posiciones = set()
+    if not texto or "\x00" in texto:
+        return posiciones
+    buscar = unido.find
+    k = buscar(texto)
+    while k >= 0:
+        i = bisect_right(inicios, k) - 1
+        posiciones.add(i)
+        # Seguir desde el próximo valor: ya se sabe que este coincide
+        k = buscar(texto, inicios[i + 1]) if i + 1 < len(inicios) else -1
+    return posiciones
+
+
+def _unir(valores):
+    inicios, posicion = [], 0
+    for valor in valores:
+        inicios.append(posicion)
+        posicion += len(valor) + 1
+    return "\x00".join(valores), inicios
+
+
+class IndicePendientes:
+    """
+    Índice en memoria de un snapshot de pendientes para paginar y buscar sin
+    recorrer la lista en Python:
+    - códigos ordenados: prefijo de código con bisect
+    - palabras de la descripción → posiciones: substring de la descripción
+      (se arma con la primera búsqueda por descripción)
+    - número y código unidos en un único string: substring con str.find (q)
+    - código exacto → posiciones (hash): lo escaneado por el lector de códigos
+    Las búsquedas devuelven posiciones en el orden original de la lista.
+    """
+
+    def __init__(self, pendientes):
+        self.pendientes = pendientes
+        self._codigos_lista = [str(p.codigo).casefold() for p in pendientes]
+        self._posiciones_codigos = sorted(range(len(pendientes)), key=self._codigos_lista.__getitem__)
+        self._codigos = [self._codigos_lista[i] for i in self._posiciones_codigos]
+        self._descripciones = None
+        self._palabras = None
+        self._unidos = None
+        self._por_codigo_exacto = None
+        self._fragmentos = {}   # Memo: fragmento → posiciones de las descripciones con alguna palabra que lo contiene
+        self._resultados = {}   # Memo: filtros → posiciones (paginar la misma búsqueda)
+
+    def __len__(self):
+        return len(self.pendientes)
+
+    def por_codigo(self, prefijo):
+        """Posiciones cuyo código empieza con prefijo"""
+        prefijo = prefijo.casefold()
+        inicio = bisect_left(self._codigos, prefijo)
+        fin = bisect_right(self._codigos, prefijo + "\U0010ffff", inicio)
+        return set(self._posiciones_codigos[inicio:fin])
+
+    def por_codigo_exacto(self, codigo):
+        """Pendientes con exactamente ese código (sin distinguir mayúsculas), en O(1)"""
+        if self._por_codigo_exacto is None:
+            por_codigo = {}
+            for i, codigo_item in enumerate(self._codigos_lista):
+                por_codigo.setdefault(codigo_item, []).append(i)
+            self._por_codigo_exacto = por_codigo
+        pendientes = self.pendientes
+        return [pendientes[i] for i in self._por_codigo_exacto.get(codigo.strip().casefold(), ())]
+
+    def _indice_palabras(self):
+        if self._palabras is None:
+            descripciones = [str(p.descripcion).casefold() for p in self.pendientes]
+            palabras = {}
+            for i, descripcion in enumerate(descripciones):
+                for palabra in set(_PALABRAS(descripcion)):
+                    palabras.setdefault(palabra, []).append(i)
+            self._descripciones = descripciones
+            self._palabras = palabras
+        return self._palabras
+
+    def por_descripcion(self, texto):
+        """Posiciones cuya descripción contiene texto"""
+        texto = texto.casefold()
+        palabras = self._indice_palabras()
+        fragmentos = _PALABRAS(texto)
+        if not fragmentos:
+            # Solo separadores: no hay palabras que consultar
+            return {i for i, descripcion in enumerate(self._descripciones) if texto in descripcion}
+        # Cada fragmento del texto buscado está dentro de alguna palabra de la descripción
+        candidatos = None
+        for fragmento in fragmentos:
+            posiciones = self._con_fragmento(palabras, fragmento)
+            candidatos = posiciones if candidatos is None else candidatos & posiciones
+            if not candidatos:
+                return set()
+        if texto == fragmentos[0]:
+            return set(candidatos)
+        # Varios fragmentos (o separadores en el texto): confirmar el substring completo
+        descripciones = self._descripciones
+        return {i for i in candidatos if texto in descripciones[i]}
+
+    def _con_fragmento(self, palabras, fragmento):
+        posiciones = self._fragmentos.get(fragmento)
+        if posiciones is None:
+            posiciones = set()
+            for palabra, lista in palabras.items():
+                if fragmento in palabra:
+                    posiciones.update(lista)
+            if len(self._fragmentos) >= 1024:
+                self._fragmentos.clear()
+            self._fragmentos[fragmento] = posiciones
+        return posiciones
+
+    def por_texto(self, q):
+        """Posiciones cuyo número, código o descripción contienen q"""
+        q = q.casefold()
+        if self._unidos is None:
+            self._unidos = (_unir([str(p.idSolicitud).casefold() for p in self.pendientes]),
+                            _unir(self._codigos_lista))
+        resultado = self.por_descripcion(q)
+        for unido, inicios in self._unidos:
+            resultado |= _buscar_en_unidos(unido, inicios, q)
+        return resultado
+
+    def buscar(self, q="", codigo="", descripcion=""):
+        """Posiciones (en el orden de la lista) que cumplen todos los filtros indicados"""
+        filtros = (q.strip(), codigo.strip(), descripcion.strip())
+        if not any(filtros):
+            return range(len(self.pendientes))
+        resultado = self._resultados.get(filtros)
+        if resultado is None:
+            q, codigo, descripcion = filtros
+            conjuntos = []
+            if codigo:
+                conjuntos.append(self.por_codigo(codigo))
+            if descripcion:
+                conjuntos.append(self.por_descripcion(descripcion))
+            if q:
+                conjuntos.append(self.por_texto(q))
+            resultado = sorted(set.intersection(*conjuntos))
+            if len(self._resultados) >= 256:
+                self._resultados.clear()
+            self._resultados[filtros] = resultado
+        return resultado
+
+    def pagina(self, offset, limit, **filtros):
+        """(pendientes de la página, total de coincidencias)"""
+        posiciones = self.buscar(**filtros)
+        pendientes = self.pendientes
+        return [pendientes[i] for i in posiciones[offset:offset + limit]], len(posiciones)
+
+
+# Índices por snapshot (clave "snapshot" de la respuesta de controlPendientes), por worker
+_indices = OrderedDict()
+_lock_indices = threading.Lock()
+estadisticas_indices = {"hits": 0, "misses": 0}
+
+
+def indice_de(respuesta):
+    """IndicePendientes del snapshot: se arma una sola vez y lo reutilizan todas las páginas y búsquedas"""
+    snapshot = respuesta.get("snapshot")
+    if snapshot is None:
+        return IndicePendientes(respuesta.get("pendientes", []))
+    with _lock_indices:
+        indice = _indices.get(snapshot)
+        if indice is not None:
+            _indices.move_to_end(snapshot)
+            estadisticas_indices["hits"] += 1
+            return indice
+    # Armarlo fuera del lock; si dos threads lo arman a la vez queda el último
+    indice = IndicePendientes(respuesta.get("pendientes", []))
+    with _lock_indices:
+        estadisticas_indices["misses"] += 1
+        _indices[snapshot] = indice
+        while len(_indices) > INDICES_PENDIENTES_MAX:
+            _indices.popitem(last=False)
+    return indice
@@ -0,0 +1,154 @@
+"""
+Pool de conexiones TCP persistentes hacia los servidores VFP
+Se comparte dentro de cada worker de gunicorn (un pool por proceso)
+"""
+import logging
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from .__init__ import TCP_TIMEOUT, TCP_POOL_MAX_POR_HOST, TCP_POOL_IDLE_TIMEOUT, TCP_POOL_ESPERA_CHECKOUT
+
+logger = logging.getLogger(__name__)
+
+
+class PoolAgotado(Exception):
+    """No se obtuvo una conexión libre dentro del tiempo de espera"""
+
+
+def conexion_sana(s):
+    """
+    Health check sin bloqueo: una conexión ociosa no debería tener nada para leer.
+    Si es legible, el servidor la cerró (EOF) o quedaron datos basura de otra respuesta.
+    """
+    try:
+        legibles, _, _ = select.select([s], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not legibles
+
+
+class _PoolHost:
+    """Conexiones de un único (host, puerto)"""
+
+    def __init__(self):
+        self.libres = deque()  # (socket, timestamp último uso)
+        self.en_uso = 0
+        self.condicion = threading.Condition()
+        # cerrar_todo() incrementa la generación: las conexiones prestadas antes
+        # se cierran al devolverlas en vez de volver a libres
+        self.generacion = 0
+        self.prestadas = {}  # socket -> generación en que se prestó
+
+
+class PoolConexiones:
+
+    def __init__(self, max_por_host=TCP_POOL_MAX_POR_HOST, idle_timeout=TCP_POOL_IDLE_TIMEOUT,
+                 espera_checkout=TCP_POOL_ESPERA_CHECKOUT, timeout=TCP_TIMEOUT):
+        self.max_por_host = max_por_host
+        self.idle_timeout = idle_timeout
+        self.espera_checkout = espera_checkout
+        self.timeout = timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.estadisticas = {"creadas": 0, "reutilizadas": 0, "descartadas": 0}
+
+    def _pool_host(self, clave):
+        with self._lock:
+            pool = self._hosts.get(clave)
+            if pool is None:
+                pool = self._hosts[clave] = _PoolHost()
+            return pool
+
+    def _descartar(self, s):
+        self.estadisticas["descartadas"] += 1
+        try:
+            s.close()
+        except OSError:
+            pass
+
+    def _desalojar_ociosas(self, pool, ahora):
+        # Las más viejas quedan a la izquierda (se devuelven por la derecha)
+        while pool.libres and ahora - pool.libres[0][1] > self.idle_timeout:
+            s, _ = pool.libres.popleft()
+            self._descartar(s)
+
+    def obtener(self, host, port):
+        """
+        Devuelve (socket, reutilizada). Espera hasta espera_checkout si se alcanzó
+        max_por_host; en ese caso lanza PoolAgotado.
+        """
+        pool = self._pool_host((host, port))
+        limite = time.monotonic() + self.espera_checkout
+
+        with pool.condicion:
+            while True:
+                self._desalojar_ociosas(pool, time.monotonic())
+
+                while pool.libres:
+                    s, _ = pool.libres.pop()
+                    if conexion_sana(s):
+                        pool.en_uso += 1
+                        pool.prestadas[s] = pool.generacion
+                        self.estadisticas["reutilizadas"] += 1
+                        s.settimeout(self.timeout)
+                        return s, True
+                    self._descartar(s)
+
+                if pool.en_uso < self.max_por_host:
+                    pool.en_uso += 1
+                    generacion = pool.generacion
+                    break
+
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise PoolAgotado(f"Sin conexiones libres para {host}:{port}")
+                pool.condicion.wait(restante)
+
+        # Conectar fuera del lock para no bloquear a otros threads
+        try:
+            s = socket.create_connection((host, port), timeout=self.timeout)
+        except Exception:
+            self._liberar_cupo(pool)
+            raise
+        with pool.condicion:
+            pool.prestadas[s] = generacion
+        self.estadisticas["creadas"] += 1
+        return s, False
+
+    def _liberar_cupo(self, pool):
+        with pool.condicion:
+            pool.en_uso -= 1
+            pool.condicion.notify()
+
+    def devolver(self, host, port, s, reutilizable=True):
+        """Devuelve la conexión al pool; si no es reutilizable se cierra."""
+        pool = self._pool_host((host, port))
+        with pool.condicion:
+            pool.en_uso -= 1
+            generacion = pool.prestadas.pop(s, None)
+            if reutilizable and generacion == pool.generacion:
+                pool.libres.append((s, time.monotonic()))
+            else:
+                self._descartar(s)
+            pool.condicion.notify()
+
+    def cerrar_todo(self):
+        """
+        Cierra las conexiones libres. Las prestadas siguen contando en en_uso
+        (el límite por host se mantiene) y se cierran cuando se devuelven.
+        """
+        with self._lock:
+            hosts = list(self._hosts.values())
+        for pool in hosts:
+            with pool.condicion:
+                pool.generacion += 1
+                while pool.libres:
+                    s, _ = pool.libres.pop()
+                    self._descartar(s)
+
+
+# Pool compartido por todo el worker (se crea al importar, las conexiones son lazy)
+pool = PoolConexiones()
@@ -3,17 +3,76 @@ Servicios y lógica de negocio para la aplicación controlStock
 Incluye llamadas a APIs externas y validaciones
 """
 import logging
+import uuid
 from datetime import datetime
-from .tcp_client import enviar_consulta_tcp
-from .__init__ import APP_VERSION
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+
+from .tcp_client import (
+    enviar_consulta_tcp, enviar_consulta_tcp_async, enviar_consultas_tcp, es_sin_respuesta, es_no_enviado
+)
+from .cache import cache_tokens, cache_pendientes
+from .idempotencia import almacen_idempotencia, COMPLETADO, INCIERTO
+from .normalizacion import Esquema, a_booleano
+from .pendientes import Pendiente
+from .utils import get_connection_config
+from .__init__ import APP_VERSION, CACHE_FECHAS_MAX
 
 logger = logging.getLogger(__name__)
 
+# Variantes de las claves que usa VFP en cada respuesta (ver normalizacion.Esquema)
+ESQUEMA_ESTADO = Esquema({
+    "estado": ("Estado", "estado"),
+    "mensaje": ("Mensaje", "mensaje"),
+}, defaults={"mensaje": ""})
+
+ESQUEMA_VERIFICAR_TOKEN = Esquema({
+    "estado": ("Estado", "estado"),
+    "mensaje": ("Mensaje", "mensaje"),
+    "usuario": ("Usuario", "usuario"),
+    "nombre": ("Nombre", "nombre"),
+    "token": ("Token", "token"),
+}, defaults={"usuario": "", "nombre": "", "token": ""})
+
+ESQUEMA_CONTROL_PENDIENTES = Esquema({
+    "estado": ("Estado", "estado"),
+    "mensaje": ("Mensaje", "mensaje"),
+    "deposito": ("Deposito", "deposito"),
+    "version": ("VersionPendientes", "versionPendientes", "version"),
+    "delta": ("Delta", "delta"),
+    "pendientes": ("Pendientes", "PENDIENTES", "pendientes"),
+    "agregados": ("Agregados", "agregados"),
+    "eliminados": ("Eliminados", "eliminados"),
+}, defaults={"mensaje": "", "deposito": "", "delta": False})
+
+ESQUEMA_PENDIENTE = Esquema({
+    "idSolicitud": ("idSolicitud", "idsolicitud", "IdSolicitud", "IDSOLICITUD", "ID"),
+    "codigo": ("codigo", "Codigo", "CODIGO"),
+    "descripcion": ("descripcion", "Descripcion", "DESCRIPCION"),
+    "fecha": ("fecha", "Fecha", "FECHA"),
+}, defaults={"idSolicitud": "", "codigo": "", "descripcion": "", "fecha": ""}, constructor=Pendiente)
+
+ESQUEMA_LOTE = Esquema({
+    "resultados": ("Resultados", "resultados"),
+})
+
+ESQUEMA_RESULTADO_LOTE = Esquema({
+    "idSolicitud": ("idSolicitud", "IdSolicitud", "IDSOLICITUD"),
+    "estado": ("Estado", "estado"),
+    "mensaje": ("Mensaje", "mensaje"),
+}, defaults={"mensaje": ""})
+
 
 def formatear_fecha(fecha_str):
     """
     Convierte una fecha en formato ISO (YYYY-MM-DD) o datetime a formato argentino (dd/mm/yyyy)
 
+    Reconoce los formatos por su forma (largo y posición de los separadores) y
+    arma el resultado cortando el string, con un LRU porque dentro de una lista
+    se repiten pocas fechas. Lo que no tiene una forma conocida pasa por
+    _formatear_fecha_strptime (mismo resultado que antes).
+
     Args:
         fecha_str: String en formato ISO, datetime object, o cualquier formato reconocible
 
@@ -27,6 +86,62 @@ def formatear_fecha(fecha_str):
     if isinstance(fecha_str, datetime):
         return fecha_str.strftime("%d/%m/%Y")
 
+    return _formatear_texto_fecha(str(fecha_str).strip())
+
+
+def _digitos(texto):
+    return texto.isascii() and texto.isdigit()
+
+
+def _fecha_valida(anio, mes, dia):
+    try:
+        datetime(int(anio), int(mes), int(dia))
+    except ValueError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=CACHE_FECHAS_MAX)
+def _formatear_texto_fecha(fecha_str):
+    largo = len(fecha_str)
+
+    # Si ya está en formato dd/mm/yyyy, devolverlo tal cual
+    if largo == 10 and fecha_str[2] == '/' and fecha_str[5] == '/':
+        return fecha_str
+
+    anio = mes = dia = None
+    if largo == 8 and _digitos(fecha_str):
+        # 20251212 (formato compacto sin separadores - VFP)
+        anio, mes, dia = fecha_str[:4], fecha_str[4:6], fecha_str[6:]
+    elif largo == 10 and fecha_str[4] == fecha_str[7] and fecha_str[4] in '-/':
+        # 2024-12-01 / 2024/12/01
+        anio, mes, dia = fecha_str[:4], fecha_str[5:7], fecha_str[8:]
+    elif largo == 10 and fecha_str[2] == '-' and fecha_str[5] == '-':
+        # 01-12-2024
+        dia, mes, anio = fecha_str[:2], fecha_str[3:5], fecha_str[6:]
+    elif largo == 19 and fecha_str[4] == '-' and fecha_str[7] == '-' and fecha_str[10] == 'T':
+        # 2024-12-01T14:30:00: alcanza con validar la hora
+        hora = fecha_str[11:]
+        if hora[2] == ':' and hora[5] == ':' and _digitos(hora[:2] + hora[3:5] + hora[6:]) \
+                and int(hora[:2]) < 24 and int(hora[3:5]) < 60 and int(hora[6:]) < 60:
+            anio, mes, dia = fecha_str[:4], fecha_str[5:7], fecha_str[8:10]
+
+    if anio is not None and _digitos(anio + mes + dia) and anio >= "1000" and _fecha_valida(anio, mes, dia):
+        return f"{dia}/{mes}/{anio}"
+
+    # Forma no reconocida (p.ej. "2024-1-5" o fechas inválidas): camino lento
+    return _formatear_fecha_strptime(fecha_str)
+
+
+def _formatear_fecha_strptime(fecha_str):
+    """Implementación original con strptime (referencia y fallback de formatear_fecha)"""
+    if not fecha_str:
+        return ""
+
+    # Si ya es datetime, convertir directamente
+    if isinstance(fecha_str, datetime):
+        return fecha_str.strftime("%d/%m/%Y")
+
     # Intentar parsear diferentes formatos comunes
     formatos = [
         "%Y%m%d",             # 20251212 (formato compacto sin separadores - VFP)
@@ -53,16 +168,24 @@ def formatear_fecha(fecha_str):
     # Si no se pudo parsear, devolver el string original
     return fecha_str
 
-def comando_verificarToken(token, request):
+def invalidar_token(token, request):
+    """Descarta el verificarToken cacheado (logout o VFP devolvió estado false)"""
+    host, port = get_connection_config(request)
+    cache_tokens.invalidar(token, host, port)
 
-    mensaje = {
+
+# ============ VERIFICAR TOKEN ============
+
+def _mensaje_verificarToken(token):
+    return {
         "Comando": "verificarToken",
         "Token": token,
         "Vista": "CONTROLSTOCK",
         "Version": APP_VERSION
     }
 
-    r = enviar_consulta_tcp(mensaje, request=request)
+
+def _procesar_verificarToken(r, token, host, port):
 
     # Sin respuesta del servidor
     if not r:
@@ -71,31 +194,89 @@ def comando_verificarToken(token, request):
             "mensaje": "Sin respuesta del servidor"
         }
 
+    campos = ESQUEMA_VERIFICAR_TOKEN.normalizar(r)
+
     # Si viene estado = false, devolver exactamente lo que vino
-    if r.get("estado") is not True:
+    if campos["estado"] is None or not a_booleano(campos["estado"]):
+        cache_tokens.invalidar(token, host, port)
         return {
             "estado": False,
-            "mensaje": r.get("mensaje", "Token inválido")
+            "mensaje": "Token inválido" if campos["mensaje"] is None else campos["mensaje"]
         }
 
     # Token válido → devolver datos completos
-    return {
+    resultado = {
         "estado": True,
-        "usuario": r.get("usuario", ""),
-        "nombre":  r.get("nombre", ""),
-        "mensaje": r.get("mensaje", ""),
-        "token":   r.get("token", "")
+        "usuario": campos["usuario"],
+        "nombre":  campos["nombre"],
+        "mensaje": campos["mensaje"] or "",
+        "token":   campos["token"]
     }
+    cache_tokens.guardar(token, host, port, resultado)
+    return resultado
+
+
+def comando_verificarToken(token, request):
+
+    # Token verificado recientemente contra el mismo servidor → evitar el round-trip
+    host, port = get_connection_config(request)
+    cacheado = cache_tokens.obtener(token, host, port)
+    if cacheado:
+        logger.debug("[CONTROLSTOCK] verificarToken desde cache para %s:%s", host, port)
+        return dict(cacheado)
+
+    r = enviar_consulta_tcp(_mensaje_verificarToken(token), request=request)
+    return _procesar_verificarToken(r, token, host, port)
+
+
+async def comando_verificarToken_async(token, request):
+    """Igual que comando_verificarToken, sin bloquear el event loop"""
+    host, port = get_connection_config(request)
+    cacheado = cache_tokens.obtener(token, host, port)
+    if cacheado:
+        logger.debug("[CONTROLSTOCK] verificarToken desde cache para %s:%s", host, port)
+        return dict(cacheado)
+
+    r = await enviar_consulta_tcp_async(_mensaje_verificarToken(token), request=request)
+    return _procesar_verificarToken(r, token, host, port)
+
 
+# ============ CONTROL PENDIENTES ============
 
-def comando_controlPendientes(token, request, usrActivo=None):
+def comando_controlPendientes(token, request, usrActivo=None, usar_cache=True):
+    """
+    Pendientes del usuario, servidos desde cache_pendientes cuando es posible
+    (ver CachePendientes). usar_cache=False fuerza la consulta a VFP.
+    """
+    usr = usrActivo if usrActivo is not None else "no definido"
+    if not usar_cache:
+        return _consultar_pendientes(token, request, usr)
+
+    host, port = get_connection_config(request)
+    return cache_pendientes.obtener(token, host, port, usr,
+                                    lambda base: _consultar_pendientes(token, request, usr, base))
+
+
+async def comando_controlPendientes_async(token, request, usrActivo=None, usar_cache=True):
+    """Igual que comando_controlPendientes, sin bloquear el event loop"""
+    usr = usrActivo if usrActivo is not None else "no definido"
+    if not usar_cache:
+        return await _consultar_pendientes_async(token, request, usr)
+
+    host, port = get_connection_config(request)
+    return await cache_pendientes.obtener_async(token, host, port, usr,
+                                                lambda base: _consultar_pendientes_async(token, request, usr, base))
+
+
+def _mensaje_controlPendientes(token, usr, version=None):
     """
     Solicitud (App → VFP)
     {
     "Comando": "controlPendientes",
     "Token": "123abc456def",
     "Vista": "CONTROLSTOCK",
-    "usrActivo": "usuario123"
+    "usrActivo": "usuario123",
+    "VersionPendientes": 41          (opcional, solo servidores con "delta")
     }
 
     Respuesta (VFP → App)
@@ -106,79 +287,185 @@ def comando_controlPendientes(token, request, usrActivo=None):
     "Pendientes": [idSolicitud, cod, descripcion]
     }
 
+    Con VersionPendientes el servidor puede responder solo los cambios:
+    {
+    "Estado": "T",
+    "Deposito": "",
+    "Delta": "T",
+    "VersionPendientes": 43,
+    "Agregados": [[idSolicitud, cod, descripcion, fecha], ...],
+    "Eliminados": [idSolicitud, ...]
+    }
+
     o
     {
         "Estado": "F",
         "Mensaje": "Token inválido"
     }
     """
-    # Usar usrActivo pasado desde la vista (no hardcodear)
-    usr = usrActivo if usrActivo is not None else "no definido"
-
+    logger.info("[CONTROLSTOCK] Consultando stock pendientes (Version: %s) (usrActivo: %s) (desde versión: %s)",
+                APP_VERSION, usr, version, extra={"comando": "controlPendientes"})
     mensaje = {
         "Comando": "controlPendientes",
         "Token": token,
         "Vista": "CONTROLSTOCK",
         "usrActivo": usr
     }
+    if version is not None:
+        mensaje["VersionPendientes"] = version
+    return mensaje
+
+
+def _version_base(request, base):
+    """Versión de la lista cacheada a partir de la cual pedir el delta (None = lista completa)"""
+    if not base or base.get("version") is None:
+        return None
+    _, _, protocolo = get_connection_config(request, con_protocolo=True)
+    return base["version"] if protocolo and protocolo.get('delta') else None
 
-    logger.info(f"[CONTROLSTOCK] Consultando stock pendientes para token: {token[:10]}... (Version: {APP_VERSION}) (usrActivo: {usr})")
-    respuesta = enviar_consulta_tcp(mensaje, request=request)
+
+def _consultar_pendientes(token, request, usr, base=None):
+    version = _version_base(request, base)
+    respuesta = enviar_consulta_tcp(_mensaje_controlPendientes(token, usr, version), request=request,
+                                    procesar_items=_ITEMS_PENDIENTES)
+    return _procesar_controlPendientes(respuesta, token, request, base, normalizado=True)
+
+
+async def _consultar_pendientes_async(token, request, usr, base=None):
+    version = _version_base(request, base)
+    respuesta = await enviar_consulta_tcp_async(_mensaje_controlPendientes(token, usr, version), request=request,
+                                                procesar_items=_ITEMS_PENDIENTES)
+    return _procesar_controlPendientes(respuesta, token, request, base, normalizado=True)
+
+
+def _normalizar_item(item):
+    """Un pendiente de VFP (posicional o dict con claves en cualquier capitalización) → Pendiente, o None"""
+    # Si el elemento es una lista/tuple posicional, mapear por posición
+    if not isinstance(item, dict):
+        try:
+            idSolicitud = item[0]
+            codigo = item[1]
+            descripcion = item[2]
+            fecha = item[3] if len(item) > 3 else ""
+        except Exception:
+            # No se pudo normalizar el elemento, lo omitimos
+            return None
+    else:
+        # Item es dict: normalizar posibles claves (plan cacheado por conjunto de claves)
+        pendiente = ESQUEMA_PENDIENTE.normalizar(item)
+        pendiente.fecha = formatear_fecha(pendiente.fecha)
+        return pendiente
+    return Pendiente(idSolicitud, codigo, descripcion, formatear_fecha(fecha))
+
+
+# Arrays de controlPendientes que se normalizan elemento por elemento mientras se
+# decodifica la respuesta (ver tcp_client._decodificar_json_por_bloques)
+_ITEMS_PENDIENTES = {"pendientes": _normalizar_item, "agregados": _normalizar_item}
+
+
+def _iterar_normalizados(pendientes_raw):
+    """Generador: normaliza de a un elemento, omitiendo los que no se pueden interpretar"""
+    if not isinstance(pendientes_raw, list):
+        return
+    for item in pendientes_raw:
+        normalizado = _normalizar_item(item)
+        if normalizado is not None:
+            yield normalizado
+
+
+def _normalizar_pendientes(pendientes_raw, normalizado=False):
+    """Lista de VFP → lista de Pendiente (si ya viene normalizada por bloques, se usa tal cual)"""
+    if normalizado:
+        return pendientes_raw if isinstance(pendientes_raw, list) else []
+    return list(_iterar_normalizados(pendientes_raw))
+
+
+def _aplicar_delta(base_pendientes, agregados, eliminados):
+    """Aplica altas/bajas (por idSolicitud) sobre la lista normalizada anterior"""
+    quitar = {str(i) for i in eliminados}
+    quitar.update(str(p.idSolicitud) for p in agregados)  # Un agregado repetido reemplaza al anterior
+    return [p for p in base_pendientes if str(p.idSolicitud) not in quitar] + agregados
+
+
+def _procesar_controlPendientes(respuesta, token, request, base=None, normalizado=False):
 
     # Si no hay respuesta, devolver estructura consistente
     if not respuesta:
         return {"estado": False, "mensaje": "Sin respuesta del servidor", "pendientes": []}
 
-    # Normalizar 'Estado' a booleano
-    estado_raw = respuesta.get("Estado", respuesta.get("estado"))
-    if isinstance(estado_raw, bool):
-        respuesta["estado"] = estado_raw
+    # Normalizar 'Estado' a booleano, mensaje y deposito
+    campos = ESQUEMA_CONTROL_PENDIENTES.normalizar(respuesta)
+    respuesta["estado"] = a_booleano(campos["estado"])
+    respuesta["mensaje"] = campos["mensaje"]
+    respuesta["deposito"] = campos["deposito"]
+
+    # Versión de la lista (si el servidor la informa) para pedir deltas en la próxima consulta
+    respuesta["version"] = campos["version"]
+    respuesta["delta_desde"] = None
+
+    if respuesta["estado"] and a_booleano(campos["delta"]) and base is not None:
+        agregados = _normalizar_pendientes(campos["agregados"], normalizado)
+        eliminados = campos["eliminados"]
+        if not isinstance(eliminados, list):
+            eliminados = []
+        respuesta["pendientes"] = _aplicar_delta(base.get("pendientes", []), agregados, eliminados)
+        if not respuesta["deposito"]:
+            respuesta["deposito"] = base.get("deposito", "")
+        # Se guarda el delta para reenviarlo al navegador que tenga la versión base
+        respuesta["delta_desde"] = base.get("version")
+        respuesta["agregados"] = agregados
+        respuesta["eliminados"] = [str(i) for i in eliminados]
+        logger.info("[CONTROLSTOCK] Delta pendientes %s → %s: +%d -%d",
+                    base.get('version'), respuesta['version'], len(agregados), len(eliminados))
     else:
-        respuesta["estado"] = str(estado_raw).upper() in ("T", "TRUE", "1", "OK")
-
-    # Normalizar mensaje y deposito
-    respuesta["mensaje"] = respuesta.get("Mensaje", respuesta.get("mensaje", ""))
-    respuesta["deposito"] = respuesta.get("Deposito", respuesta.get("deposito", ""))
-
-    # Obtener lista de pendientes en cualquiera de las variantes de clave
-    pendientes_raw = respuesta.get("Pendientes", respuesta.get("PENDIENTES", respuesta.get("pendientes", [])))
-
-    pendientes_normalizados = []
-    if isinstance(pendientes_raw, list):
-        for item in pendientes_raw:
-            # Si el elemento es una lista/tuple posicional, mapear por posición
-            if not isinstance(item, dict):
-                try:
-                    idSolicitud = item[0]
-                    codigo = item[1]
-                    descripcion = item[2]
-                    fecha = item[3] if len(item) > 3 else ""
-                    pendientes_normalizados.append({
-                        "idSolicitud": idSolicitud,
-                        "codigo": codigo,
-                        "descripcion": descripcion,
-                        "fecha": formatear_fecha(fecha)
-                    })
-                except Exception:
-                    # No se pudo normalizar el elemento, lo omitimos
-                    continue
-            else:
-                # Item es dict: normalizar posibles claves
-                idSolicitud = item.get("idSolicitud", item.get("idsolicitud", item.get("IdSolicitud", item.get("IDSOLICITUD", item.get("ID", "")))))
-                codigo = item.get("codigo", item.get("Codigo", item.get("CODIGO", "")))
-                descripcion = item.get("descripcion", item.get("Descripcion", item.get("DESCRIPCION", "")))
-                fecha = item.get("fecha", item.get("Fecha", item.get("FECHA", "")))
-                pendientes_normalizados.append({
-                    "idSolicitud": idSolicitud,
-                    "codigo": codigo,
-                    "descripcion": descripcion,
-                    "fecha": formatear_fecha(fecha)
-                })
-
-    respuesta["pendientes"] = pendientes_normalizados
+        # Lista de pendientes en cualquiera de las variantes de clave
+        respuesta["pendientes"] = _normalizar_pendientes(campos["pendientes"], normalizado)
+
+    # Identifica esta lista: las copias del cache la comparten y con ella se
+    # reutiliza el índice de búsqueda/paginación (ver pendientes.indice_de)
+    respuesta["snapshot"] = uuid.uuid4().hex
+
+    if respuesta["estado"] is False:
+        invalidar_token(token, request)
     return respuesta
 
-def comando_stockControlado(token, request, usrActivo, idSolicitud, cantidad):
+
+# ============ VERIFICAR TOKEN + PENDIENTES ============
+
+def comando_verificarYPendientes(token, request, usrActivo):
+    """
+    verificarToken y controlPendientes en un único intercambio con VFP
+    (pipeline sobre una conexión si el servidor soporta keepalive).
+
+    Returns:
+        tuple: (resultado de verificarToken, resultado de controlPendientes o None si el token es inválido)
+    """
+    host, port = get_connection_config(request)
+
+    # Con el token ya verificado alcanza con los pendientes (que a su vez pueden venir del cache)
+    cacheado = cache_tokens.obtener(token, host, port)
+    if cacheado:
+        return dict(cacheado), comando_controlPendientes(token, request, usrActivo=usrActivo)
+
+    base = cache_pendientes.base(token, host, port, usrActivo)
+    r_token, r_pendientes = enviar_consultas_tcp(
+        [_mensaje_verificarToken(token),
+         _mensaje_controlPendientes(token, usrActivo, _version_base(request, base))],
+        request=request
+    )
+
+    verificarToken = _procesar_verificarToken(r_token, token, host, port)
+    if not verificarToken["estado"]:
+        return verificarToken, None
+
+    pendientes = _procesar_controlPendientes(r_pendientes, token, request, base)
+    cache_pendientes.precargar(token, host, port, usrActivo, pendientes)
+    return verificarToken, pendientes
+
+
+# ============ STOCK CONTROLADO ============
+
+def _mensaje_stockControlado(token, usrActivo, idSolicitud, cantidad):
     """
     Debo enviar esta estructura de datos a VFP (App → VFP)
     {
@@ -191,7 +478,9 @@ def comando_stockControlado(token, request, usrActivo, idSolicitud, cantidad):
     }"
 
     """
-    mensaje = {
+    logger.info("[CONTROLSTOCK] Enviando StockControlado idSolicitud=%s cantidad=%s usrActivo=%s",
+                idSolicitud, cantidad, usrActivo, extra={"comando": "RegistrarStockControlado"})
+    return {
         "Comando": "RegistrarStockControlado",
         "Token": token,
         "Vista": "CONTROLSTOCK",
@@ -200,17 +489,298 @@ def comando_stockControlado(token, request, usrActivo, idSolicitud, cantidad):
         "cantidad": int(cantidad)
     }
 
-    logger.info(f"[CONTROLSTOCK] Enviando StockControlado idSolicitud={idSolicitud} cantidad={cantidad} usrActivo={usrActivo}")
-    respuesta = enviar_consulta_tcp(mensaje, request=request)
 
-    if not respuesta:
-        return {"estado": False, "mensaje": "Sin respuesta del servidor"}
+def _normalizar_estado(respuesta):
+    """Normaliza 'Estado'/'estado' a booleano y 'Mensaje'/'mensaje' en el lugar"""
+    campos = ESQUEMA_ESTADO.normalizar(respuesta)
+    respuesta["estado"] = a_booleano(campos["estado"])
+    respuesta["mensaje"] = campos["mensaje"]
+    return respuesta
+
 
-    estado_raw = respuesta.get("Estado", respuesta.get("estado"))
-    if isinstance(estado_raw, bool):
-        respuesta["estado"] = estado_raw
+def _procesar_stockControlado(respuesta, token, request, usrActivo):
+
+    if es_sin_respuesta(respuesta):
+        # Timeout o conexión cortada: no es un rechazo de VFP, el token sigue siendo válido
+        return {"estado": False, "mensaje": respuesta["mensaje"] if respuesta else SIN_RESPUESTA}
+
+    _normalizar_estado(respuesta)
+    if respuesta["estado"] is False:
+        invalidar_token(token, request)
     else:
-        respuesta["estado"] = str(estado_raw).upper() in ("T", "TRUE", "1", "OK")
+        # El control registrado ya no es pendiente para nadie en ese depósito
+        host, port = get_connection_config(request)
+        cache_pendientes.invalidar(token, host, port, usrActivo)
+    return respuesta
+
+
+SIN_RESPUESTA = "Sin respuesta del servidor"
+
+
+def _para_reintentar(mensaje):
+    """Resultado de un registro que no se pudo confirmar: el navegador lo reintenta con la misma clave"""
+    return {"estado": False, "mensaje": mensaje, "reintentar": True}
+
+
+def _reservar_registro(usrActivo, idSolicitud, idempotencia):
+    """
+    Consulta almacen_idempotencia antes de enviar. Devuelve (respuesta, incierto):
+    - respuesta: lo que hay que contestar sin hablar con VFP (duplicado o en curso)
+    - respuesta None: este request tomó la reserva y debe enviar (y finalizar);
+      incierto indica que un intento anterior quedó sin respuesta
+    Sin clave de idempotencia no hay reserva: (None, False).
+    """
+    if not idempotencia:
+        return None, False
+    previo = almacen_idempotencia.consultar(usrActivo, idSolicitud, idempotencia)
+    if previo is not None and previo["estado"] == COMPLETADO:
+        logger.info("[CONTROLSTOCK] Registro duplicado (clave %s): respondido sin enviar a VFP", idempotencia)
+        return dict(previo["respuesta"]), False
+    if not almacen_idempotencia.reservar(usrActivo, idSolicitud, idempotencia):
+        logger.info("[CONTROLSTOCK] Registro en curso (clave %s): se pide reintentar", idempotencia)
+        return _para_reintentar("El registro ya se está enviando"), False
+    # Releer con la reserva tomada: otro request pudo terminar entre la consulta y la reserva
+    previo = almacen_idempotencia.consultar(usrActivo, idSolicitud, idempotencia)
+    if previo is not None and previo["estado"] == COMPLETADO:
+        almacen_idempotencia.liberar(usrActivo, idSolicitud, idempotencia)
+        return dict(previo["respuesta"]), False
+    return None, previo is not None and previo["estado"] == INCIERTO
+
+
+def _sigue_pendiente(respuesta_pendientes, idSolicitud):
+    """True/False según la lista de pendientes recién pedida a VFP; None si no se pudo obtener"""
+    if not respuesta_pendientes or respuesta_pendientes.get("estado") is not True:
+        return None
+    idSolicitud = str(idSolicitud)
+    return any(str(p.idSolicitud) == idSolicitud for p in respuesta_pendientes.get("pendientes", []))
+
+
+def _verificar_incierto(respuesta_pendientes, token, request, usrActivo, idSolicitud, idempotencia):
+    """
+    Un intento anterior no tuvo respuesta: si la solicitud ya no está pendiente VFP
+    lo aplicó (se da por registrado sin reenviar). Devuelve la respuesta final, o
+    None si sigue pendiente y hay que enviarlo.
+    """
+    pendiente = _sigue_pendiente(respuesta_pendientes, idSolicitud)
+    if pendiente:
+        return None
+    if pendiente is None:
+        almacen_idempotencia.finalizar(usrActivo, idSolicitud, idempotencia, None)
+        return _para_reintentar(SIN_RESPUESTA)
+    logger.info("[CONTROLSTOCK] Registro sin respuesta ya aplicado por VFP (clave %s)", idempotencia)
+    respuesta = {"estado": True, "mensaje": ""}
+    almacen_idempotencia.finalizar(usrActivo, idSolicitud, idempotencia, respuesta)
+    host, port = get_connection_config(request)
+    cache_pendientes.invalidar(token, host, port, usrActivo)
+    return respuesta
+
+
+def _finalizar_registro(crudo, respuesta, usrActivo, idSolicitud, idempotencia):
+    """
+    Guarda el resultado del envío en almacen_idempotencia (sin respuesta de VFP:
+    incierto). Si no llegó a enviarse (circuito abierto) solo se libera la reserva.
+    """
+    if es_no_enviado(crudo):
+        if idempotencia:
+            almacen_idempotencia.liberar(usrActivo, idSolicitud, idempotencia)
+        return _para_reintentar(crudo["mensaje"])
+    if es_sin_respuesta(crudo):
+        # Error de red, no un rechazo de VFP: siempre se reintenta (y el token no se invalida)
+        if idempotencia:
+            almacen_idempotencia.finalizar(usrActivo, idSolicitud, idempotencia, None)
+        return _para_reintentar(SIN_RESPUESTA)
+    if idempotencia:
+        almacen_idempotencia.finalizar(usrActivo, idSolicitud, idempotencia, respuesta)
+    return respuesta
 
-    respuesta["mensaje"] = respuesta.get("Mensaje", respuesta.get("mensaje", ""))
-    return respuesta
\ No newline at end of file
+
+def comando_stockControlado(token, request, usrActivo, idSolicitud, cantidad, idempotencia=None):
+    """
+    Registra un control. Con idempotencia (clave generada por el navegador) los
+    duplicados se responden desde almacen_idempotencia sin volver a VFP, y un
+    intento anterior sin respuesta se verifica contra la lista de pendientes
+    antes de reenviarlo (ver idempotencia.py).
+    """
+    previo, incierto = _reservar_registro(usrActivo, idSolicitud, idempotencia)
+    if previo is not None:
+        return previo
+    if incierto:
+        pendientes = comando_controlPendientes(token, request, usrActivo, usar_cache=False)
+        verificado = _verificar_incierto(pendientes, token, request, usrActivo, idSolicitud, idempotencia)
+        if verificado is not None:
+            return verificado
+    mensaje = _mensaje_stockControlado(token, usrActivo, idSolicitud, cantidad)
+    crudo = enviar_consulta_tcp(mensaje, request=request)
+    respuesta = _procesar_stockControlado(crudo, token, request, usrActivo)
+    return _finalizar_registro(crudo, respuesta, usrActivo, idSolicitud, idempotencia)
+
+
+async def comando_stockControlado_async(token, request, usrActivo, idSolicitud, cantidad, idempotencia=None):
+    """Igual que comando_stockControlado, sin bloquear el event loop (el almacén de idempotencia usa el ORM)"""
+    previo, incierto = await sync_to_async(_reservar_registro)(usrActivo, idSolicitud, idempotencia)
+    if previo is not None:
+        return previo
+    if incierto:
+        pendientes = await comando_controlPendientes_async(token, request, usrActivo, usar_cache=False)
+        verificado = await sync_to_async(_verificar_incierto)(pendientes, token, request, usrActivo, idSolicitud,
+                                                             idempotencia)
+        if verificado is not None:
+            return verificado
+    mensaje = _mensaje_stockControlado(token, usrActivo, idSolicitud, cantidad)
+    crudo = await enviar_consulta_tcp_async(mensaje, request=request)
+    respuesta = _procesar_stockControlado(crudo, token, request, usrActivo)
+    return await sync_to_async(_finalizar_registro)(crudo, respuesta, usrActivo, idSolicitud, idempotencia)
+
+
+# ============ STOCK CONTROLADO EN LOTE ============
+
+def _mensaje_stockControladoLote(token, usrActivo, items):
+    """
+    (App → VFP), solo para servidores con la capacidad "lote"
+    {
+    "Comando": "RegistrarStockControladoLote",
+    "Token": "123abc",
+    "Vista": "CONTROLSTOCK",
+    "UsrActivo": "A",
+    "Items": [{"idSolicitud": idSolicitud, "cantidad": cantidad}, ...]
+    }
+
+    Respuesta (VFP → App)
+    {
+    "Estado": "T",
+    "Mensaje": "",
+    "Resultados": [{"idSolicitud": idSolicitud, "Estado": "T", "Mensaje": ""}, ...]
+    }
+    """
+    logger.info("[CONTROLSTOCK] Enviando StockControladoLote items=%d usrActivo=%s", len(items), usrActivo)
+    return {
+        "Comando": "RegistrarStockControladoLote",
+        "Token": token,
+        "Vista": "CONTROLSTOCK",
+        "UsrActivo": usrActivo,
+        "Items": [{"idSolicitud": i["idSolicitud"], "cantidad": int(i["cantidad"])} for i in items]
+    }
+
+
+def _resultados_lote(respuesta, items):
+    """Resultado por item a partir de la respuesta de RegistrarStockControladoLote"""
+    if not respuesta:
+        respuesta = {"estado": False, "mensaje": "Sin respuesta del servidor"}
+    _normalizar_estado(respuesta)
+
+    por_id = {}
+    for r in ESQUEMA_LOTE.normalizar(respuesta)["resultados"] or []:
+        if isinstance(r, dict):
+            r = ESQUEMA_RESULTADO_LOTE.normalizar(r)
+            r["estado"] = a_booleano(r["estado"])
+            por_id[str(r["idSolicitud"])] = r
+
+    resultados = []
+    for item in items:
+        r = por_id.get(str(item["idSolicitud"]))
+        if r is None:
+            # VFP rechazó el lote completo (p.ej. token inválido) o no informó este item
+            r = {"estado": False, "mensaje": respuesta["mensaje"] or "Sin resultado para el item"}
+        resultados.append({"idSolicitud": item["idSolicitud"], "estado": r["estado"], "mensaje": r["mensaje"]})
+    return resultados
+
+
+def comando_stockControladoLote(token, request, usrActivo, items):
+    """
+    Registra varios controles en un único intercambio con VFP.
+
+    Si el servidor soporta el comando de lote se envía un solo mensaje; si no,
+    se envían todos los RegistrarStockControlado juntos (en pipeline sobre una
+    única conexión cuando el servidor soporta keepalive).
+
+    Args:
+        items: lista de {"idSolicitud": ..., "cantidad": ..., "idempotencia": clave opcional}.
+            Los items con clave pasan por almacen_idempotencia como en comando_stockControlado
+            (los inciertos se verifican todos con una sola consulta de pendientes).
+
+    Returns:
+        dict: {"estado": True si todos se registraron, "mensaje", "registrados",
+               "token_invalido": True si no se registró ninguno porque VFP rechazó el token,
+               "resultados": [{"idSolicitud", "estado", "mensaje", "reintentar" si corresponde}, ...]}
+    """
+    host, port, protocolo = get_connection_config(request, con_protocolo=True)
+
+    previos, inciertos = [], []
+    for posicion, item in enumerate(items):
+        previo, incierto = _reservar_registro(usrActivo, item["idSolicitud"], item.get("idempotencia"))
+        previos.append(previo)
+        if incierto:
+            inciertos.append(posicion)
+    if inciertos:
+        pendientes = comando_controlPendientes(token, request, usrActivo, usar_cache=False)
+        for posicion in inciertos:
+            item = items[posicion]
+            previos[posicion] = _verificar_incierto(pendientes, token, request, usrActivo,
+                                                    item["idSolicitud"], item["idempotencia"])
+    a_enviar = [i for i, previo in zip(items, previos) if previo is None]
+
+    enviados, crudos, respuesta_lote = [], [], None
+    if a_enviar and protocolo and protocolo.get('lote'):
+        respuesta_lote = enviar_consulta_tcp(_mensaje_stockControladoLote(token, usrActivo, a_enviar), request=request)
+        crudos = [respuesta_lote] * len(a_enviar)
+        enviados = _resultados_lote(respuesta_lote, a_enviar)
+    elif a_enviar:
+        mensajes = [_mensaje_stockControlado(token, usrActivo, i["idSolicitud"], i["cantidad"]) for i in a_enviar]
+        crudos = enviar_consultas_tcp(mensajes, request=request)
+        for item, r in zip(a_enviar, crudos):
+            r = _normalizar_estado(r or {"estado": False, "mensaje": SIN_RESPUESTA})
+            enviados.append({"idSolicitud": item["idSolicitud"], "estado": r["estado"], "mensaje": r["mensaje"]})
+
+    for item, r, crudo in zip(a_enviar, enviados, crudos):
+        final = _finalizar_registro(crudo, {"estado": r["estado"], "mensaje": r["mensaje"]},
+                                    usrActivo, item["idSolicitud"], item.get("idempotencia"))
+        if final.get("reintentar"):
+            r["reintentar"] = True
+    enviados = iter(enviados)
+    resultados = []
+    for item, previo in zip(items, previos):
+        if previo is None:
+            resultados.append(next(enviados))
+            continue
+        r = {"idSolicitud": item["idSolicitud"], "estado": previo["estado"], "mensaje": previo["mensaje"]}
+        if previo.get("reintentar"):
+            r["reintentar"] = True
+        resultados.append(r)
+
+    registrados = sum(1 for r in resultados if r["estado"])
+    token_invalido = False
+    if registrados:
+        # Los controles registrados ya no son pendientes para nadie en ese depósito
+        if a_enviar:
+            cache_pendientes.invalidar(token, host, port, usrActivo)
+    elif a_enviar and not any(r.get("reintentar") for r in resultados):
+        token_invalido = _token_rechazado(token, request, respuesta_lote)
+
+    return {
+        "estado": registrados == len(resultados),
+        "mensaje": "" if registrados else (resultados[0]["mensaje"] if resultados else ""),
+        "registrados": registrados,
+        "token_invalido": token_invalido,
+        "resultados": resultados,
+    }
+
+
+def _token_rechazado(token, request, respuesta_lote=None):
+    """
+    Todos los items de un lote volvieron rechazados: puede ser el token (VFP rechaza
+    cualquier comando) o un rechazo de cada item (p.ej. ya registrado por otro operador).
+    Con el comando de lote, VFP rechaza el token rechazando el lote completo; sin él,
+    se descarta el verificarToken cacheado y se vuelve a verificar con VFP.
+    Una falla de red no cuenta como token inválido.
+    """
+    if respuesta_lote is not None:
+        rechazado = not es_sin_respuesta(respuesta_lote) and respuesta_lote.get("estado") is False
+        if rechazado:
+            invalidar_token(token, request)
+        return rechazado
+    invalidar_token(token, request)
+    host, port = get_connection_config(request)
+    crudo = enviar_consulta_tcp(_mensaje_verificarToken(token), request=request)
+    if es_sin_respuesta(crudo):
+        return False
+    return _procesar_verificarToken(crudo, token, host, port)["estado"] is not True
@@ -11,6 +11,26 @@
     let modalAlerta = null;
     let errorAutenticacion = false; // Flag para evitar actualizar pendientes tras error 401
 
+    // Configuración enviada por el servidor (ver controlStock_view)
+    const configEl = document.getElementById('controlstock-config');
+    const CONFIG = configEl ? JSON.parse(configEl.textContent) : {};
+
+    // Registro en lote: los controles se encolan y se envían juntos a /registrar-lote/
+    const registroLote = CONFIG.registroLote || null;
+    const registroDiferido = CONFIG.registroDiferido || null;
+    let colaRegistros = [];
+    let diferidos = [];  // Aceptados por el servidor (registro diferido), esperando el resultado de VFP
+    let timerDiferidos = null;
+    let timerCola = null;
+    let enviandoCola = false;
+
+    // Versión de la lista renderizada: con ella /pendientes/ responde solo altas/bajas
+    window.versionPendientes = CONFIG.versionPendientes ?? null;
+
+    // Tabla de pendientes: umbral de scroll virtual, tamaño de página y lista inline larga
+    window.configTablaPendientes = CONFIG.tablaPendientes || {};
+    window.pendientesInline = CONFIG.pendientesInline || null;
+
     // Helpers para cookies
     function getCookie(name) {
         const value = `; ${document.cookie}`;
@@ -30,7 +50,7 @@
     if (modalElement && window.bootstrap) {
         modalControl = new bootstrap.Modal(modalElement);
 
-        // Actualizar pendientes al cerrar modal
+        // Al cerrar el modal
         modalElement.addEventListener('hidden.bs.modal', function() {
             console.log('🔄 Modal cerrado');
             solicitudSeleccionada = null;
@@ -43,19 +63,9 @@
                 return;
             }
 
-            console.log('✅ Actualizando pendientes');
-            // Restaurar estado del botón Confirmar si quedó deshabilitado
-            try {
-                const btn = modalElement.querySelector('.btn-success');
-                if (btn && btn.dataset && btn.dataset.origHtml) {
-                    btn.disabled = false;
-                    btn.innerHTML = btn.dataset.origHtml;
-                    delete btn.dataset.origHtml;
-                }
-            } catch (e) {
-                console.warn('No se pudo restaurar el botón confirmar del modal', e);
-            }
-            actualizarPendientes();
+            // El registro ya sacó la fila de la tabla y sigue en segundo plano:
+            // no hace falta recargar la lista (ver COLA DE REGISTROS)
+            marcarFilasEnCola();
         });
     }
 
@@ -196,6 +206,16 @@
         }
     }
 
+    // Abrir modal para una solicitud {idSolicitud, codigo, descripcion, fecha}
+    // (desde una fila de la tabla o desde un código escaneado)
+    window.abrirModalSolicitud = function(obj) {
+        if (estaEnCola(obj.idSolicitud)) {
+            mostrarAlerta('Este control ya está en cola para registrarse', 'warning');
+            return;
+        }
+        abrirModalControl(obj);
+    };
+
     // Helper: abrir modal desde una fila que contiene data-* attributes
     window.abrirModalControlFromRow = function(el) {
         if (!el || !el.dataset) return;
@@ -205,7 +225,7 @@
             descripcion: el.dataset.desc || el.getAttribute('data-desc') || '',
             fecha: el.dataset.fecha || el.getAttribute('data-fecha') || ''
         };
-        abrirModalControl(obj);
+        window.abrirModalSolicitud(obj);
     };
 
     function confirmarControl() {
@@ -259,46 +279,142 @@
         }
     }
 
+    // Registro optimista: el control se guarda en la cola persistente, la fila
+    // desaparece de la tabla y el modal se cierra enseguida. El envío a VFP
+    // sigue en segundo plano (ver COLA DE REGISTROS)
     function ejecutarRegistro() {
         if (modalConfirmarRegistro) {
             modalConfirmarRegistro.hide();
         }
+        if (!solicitudSeleccionada) return;
 
         const cantidadEl = document.getElementById('cantidad-contada');
         const cantidadContada = cantidadEl ? cantidadEl.value.trim() : '';
-        
-        const token = obtenerToken();
-        let tokenLimpio = token;
-        if (tokenLimpio) {
-            tokenLimpio = tokenLimpio.replace(/^["']+|["']+$/g, '');
-            tokenLimpio = tokenLimpio.replace(/\\/g, '');
-            tokenLimpio = tokenLimpio.trim();
+
+        encolarRegistro({
+            idempotencia: nuevaClaveIdempotencia(),
+            usuario: CONFIG.usuario || '',
+            idSolicitud: String(solicitudSeleccionada.idSolicitud || solicitudSeleccionada[0] || ''),
+            cantidad: cantidadContada,
+            creado: Date.now()
+        });
+        if (modalControl) {
+            modalControl.hide();
         }
+        solicitudSeleccionada = null;
+    }
+
+    // ============ COLA DE REGISTROS ============
+    // Cada control se guarda en IndexedDB antes de enviarse: sobrevive a recargas
+    // y cortes de red y se reintenta con espera creciente. La clave de idempotencia
+    // evita que el reintento de algo que VFP ya registró se cuente dos veces.
+    // Con registroLote se envían juntos a /registrar-lote/; si no, de a uno a /registrar/.
+    const REINTENTO_MIN_MS = 2000;
+    const REINTENTO_MAX_MS = 60000;
+    let intentosFallidos = 0;
+    const colaPersistente = abrirColaPersistente();
+
+    function abrirColaPersistente() {
+        if (!window.indexedDB) return Promise.resolve(null);
+        return new Promise(resolve => {
+            const pedido = indexedDB.open('controlStock', 1);
+            pedido.onupgradeneeded = () => pedido.result.createObjectStore('registros', { keyPath: 'idempotencia' });
+            pedido.onsuccess = () => resolve(pedido.result);
+            pedido.onerror = () => {
+                console.warn('⚠️ IndexedDB no disponible: la cola de registros queda solo en memoria');
+                resolve(null);
+            };
+        });
+    }
+
+    function operarCola(modo, operacion) {
+        return colaPersistente.then(db => {
+            if (!db) return null;
+            return new Promise((resolve, reject) => {
+                const transaccion = db.transaction('registros', modo);
+                const pedido = operacion(transaccion.objectStore('registros'));
+                transaccion.oncomplete = () => resolve(pedido ? pedido.result : null);
+                transaccion.onerror = () => reject(transaccion.error);
+            });
+        }).catch(err => console.warn('⚠️ Error en la cola persistente de registros:', err));
+    }
+
+    function guardarEnCola(item) {
+        return operarCola('readwrite', store => { store.put(item); });
+    }
 
-        const btnConfirmar = modalElement ? modalElement.querySelector('.btn-success') : null;
-        let textoOriginal = null;
-        if (btnConfirmar) {
-            textoOriginal = btnConfirmar.innerHTML;
-            // Guardar HTML original en data-attribute para poder restaurarlo si el modal se cierra
-            try { btnConfirmar.dataset.origHtml = textoOriginal; } catch (e) { /* ignore */ }
-            btnConfirmar.disabled = true;
-            btnConfirmar.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Guardando...';
+    function quitarDeCola(items) {
+        return operarCola('readwrite', store => { items.forEach(item => store.delete(item.idempotencia)); });
+    }
+
+    function leerCola() {
+        return operarCola('readonly', store => store.getAll());
+    }
+
+    function nuevaClaveIdempotencia() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+    }
+
+    function estaEnCola(idSolicitud) {
+        const id = String(idSolicitud);
+        return colaRegistros.some(item => String(item.idSolicitud) === id) ||
+            diferidos.some(item => String(item.idSolicitud) === id);
+    }
+
+    function marcarFilasEnCola() {
+        document.querySelectorAll('.solicitud-row').forEach(row => {
+            row.classList.toggle('table-warning', estaEnCola(row.dataset.id));
+        });
+    }
+
+    function encolarRegistro(item) {
+        colaRegistros.push(item);
+        guardarEnCola(item);
+        ocultarPendientes([item.idSolicitud]);
+        marcarFilasEnCola();
+        mostrarAlerta(`Control en cola (${colaRegistros.length} sin enviar)`, 'success');
+        programarEnvio();
+    }
+
+    function sacarDeCola(items) {
+        const claves = new Set(items.map(item => item.idempotencia));
+        colaRegistros = colaRegistros.filter(item => !claves.has(item.idempotencia));
+        quitarDeCola(items);
+    }
+
+    // Sin lote se envía enseguida; con lote, al juntar registroLote.tamanio o tras la demora
+    function programarEnvio(demora) {
+        if (enviandoCola || !colaRegistros.length || errorAutenticacion) return;
+        if (demora === undefined) {
+            demora = !registroLote || colaRegistros.length >= registroLote.tamanio ? 0 : registroLote.demoraMs;
         }
+        if (timerCola) {
+            if (demora > 0) return;
+            clearTimeout(timerCola);
+        }
+        timerCola = setTimeout(enviarColaRegistros, demora);
+    }
 
-        const headers = {
-            'Content-Type': 'application/json',
-            'X-CSRFToken': getCookie('csrftoken') || ''
-        };
+    function tokenParaEnvio() {
+        let token = obtenerToken();
+        if (token) {
+            token = token.replace(/^["']+|["']+$/g, '').replace(/\\/g, '').trim();
+        }
+        return token;
+    }
 
-        const body = {
-            token: tokenLimpio,
-            idSolicitud: solicitudSeleccionada.idSolicitud || solicitudSeleccionada[0] || '',
-            cantidad: cantidadContada
-        };
+    function itemParaEnvio(item) {
+        return { idSolicitud: item.idSolicitud, cantidad: item.cantidad, idempotencia: item.idempotencia };
+    }
 
-        fetch('/registrar/', {
+    function postRegistro(url, body) {
+        return fetch(url, {
             method: 'POST',
-            headers: headers,
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken') || ''
+            },
             body: JSON.stringify(body),
             credentials: 'same-origin'
         })
@@ -307,70 +423,239 @@
             if (resp.status === 401) {
                 return resp.json().then(data => {
                     console.log('🚫 Error 401 - Usuario deshabilitado o sesión inválida');
-                    const redirectUrl = data.redirect || 'https://cormons.app/login/?logout=1';
+                    const error = new Error('Sesión inválida');
+                    error.redirect = data.redirect || 'https://cormons.app/login/?logout=1';
                     // SIEMPRE usar el mensaje de VFP (data.error)
-                    const mensaje = data.error || data.mensaje || 'Error de autenticación';
-
-                    // Marcar que hubo error de autenticación para evitar actualizar pendientes
-                    errorAutenticacion = true;
-
-                    // Cerrar modal de control si está abierto
-                    if (modalControl) {
-                        modalControl.hide();
-                    }
-
-                    // Mostrar modal de error bloqueante (sin countdown)
-                    window.mostrarErrorConRedirect(mensaje, redirectUrl);
-                    throw new Error('Sesión inválida');
+                    error.mensajeVFP = data.error || data.mensaje || 'Error de autenticación';
+                    throw error;
                 });
             }
+            // 503 con resultados: VFP no confirmó alguno; se reintenta con la misma clave.
+            // 409 con resultados: VFP rechazó todos los items (no el token); se muestran los rechazos
+            if (resp.status === 503 || resp.status === 409) {
+                return resp.json().catch(() => { throw new Error(`HTTP ${resp.status}`); });
+            }
             if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
             return resp.json();
-        })
-        .then(data => {
-            console.log('📡 Respuesta registrar:', data);
+        });
+    }
 
-            if (data.estado === true || data.estado === 'T') {
-                if (modalControl) {
-                    modalControl.hide();
-                }
-                // Solo mostrar modal si VFP envió un mensaje
-                if (data.mensaje && data.mensaje.trim() !== '') {
-                    mostrarAlerta(data.mensaje, 'info-modal');
+    function reintentarMasTarde() {
+        intentosFallidos++;
+        const espera = Math.min(REINTENTO_MAX_MS, REINTENTO_MIN_MS * 2 ** (intentosFallidos - 1));
+        console.warn(`⏳ ${colaRegistros.length} control(es) en cola; reintento en ${espera / 1000}s`);
+        if (intentosFallidos === 1) {
+            mostrarAlerta('Sin comunicación con el servidor. Los controles quedan en cola y se reintentarán.', 'warning');
+        }
+        timerCola = setTimeout(enviarColaRegistros, espera);
+    }
+
+    function enviarColaRegistros() {
+        if (timerCola) {
+            clearTimeout(timerCola);
+            timerCola = null;
+        }
+        if (enviandoCola || !colaRegistros.length || errorAutenticacion) return;
+
+        const lote = colaRegistros.slice(0, registroLote ? registroLote.tamanio : 1);
+        enviandoCola = true;
+        console.log(`📤 Enviando ${lote.length} control(es)`);
+
+        // Resultados por item, en el mismo orden que lote
+        const envio = registroLote
+            ? postRegistro('/registrar-lote/', { token: tokenParaEnvio(), items: lote.map(itemParaEnvio) })
+                .then(data => data.resultados || [])
+            : postRegistro('/registrar/', Object.assign({ token: tokenParaEnvio() }, itemParaEnvio(lote[0])))
+                .then(data => [{
+                    estado: data.estado === true || data.estado === 'T',
+                    mensaje: data.mensaje || '',
+                    reintentar: data.reintentar === true,
+                    diferido: data.diferido === true
+                }]);
+
+        envio
+        .then(resultados => {
+            console.log('📡 Resultado del envío:', resultados);
+            const exitosos = [];
+            const rechazados = [];
+            const aReintentar = [];
+            const aceptados = [];
+            lote.forEach((item, i) => {
+                const r = resultados[i] || { estado: false, mensaje: 'Sin resultado para el item' };
+                if (r.diferido) {
+                    // Guardado en el servidor: el resultado de VFP se consulta después
+                    aceptados.push(item);
+                    return;
                 }
-                // Restaurar botón confirmar si quedó con spinner
-                if (btnConfirmar) {
-                    try {
-                        btnConfirmar.disabled = false;
-                        btnConfirmar.innerHTML = textoOriginal || btnConfirmar.dataset.origHtml || '<i class="fas fa-check me-1"></i>Confirmar';
-                        delete btnConfirmar.dataset.origHtml;
-                    } catch (e) { console.warn('No se pudo restaurar btnConfirmar tras éxito', e); }
+                if (r.reintentar) {
+                    // Sin confirmar (VFP no respondió o ya se está enviando): sigue en la cola
+                    aReintentar.push(item);
+                    return;
                 }
-                solicitudSeleccionada = null;
+                (r.estado ? exitosos : rechazados).push(Object.assign({}, item, { mensaje: r.mensaje || '' }));
+            });
+            aceptarDiferidos(aceptados);
+            sacarDeCola(exitosos.concat(rechazados));
+            marcarRegistrados(exitosos.map(item => item.idSolicitud));
+            if (aReintentar.length) {
+                reintentarMasTarde();
             } else {
-                // SIEMPRE usar mensaje de VFP si existe (incluso si es vacío)
-                const mensaje = data.mensaje !== undefined && data.mensaje !== null ? data.mensaje : 'Error en la operación';
-                mostrarAlerta(mensaje, 'error');
-                if (btnConfirmar) {
-                    btnConfirmar.disabled = false;
-                    btnConfirmar.innerHTML = textoOriginal;
-                }
+                intentosFallidos = 0;
+            }
+            if (!exitosos.length && !rechazados.length) return;
+
+            // Los rechazados vuelven a la tabla
+            const mensajesVFP = exitosos.map(item => item.mensaje).filter(m => m.trim() !== '');
+            if (rechazados.length) {
+                avisarRechazados(rechazados);
+            } else if (mensajesVFP.length) {
+                // Solo mostrar modal si VFP envió un mensaje
+                mostrarAlerta(mensajesVFP.join('\n'), 'info-modal');
+            } else {
+                mostrarAlerta(`${exitosos.length} control(es) registrado(s)`, 'success');
             }
         })
         .catch(err => {
-            console.error('❌ Error registrar control:', err);
-            // No mostrar alerta si ya estamos redirigiendo
-            if (err.message !== 'Sesión inválida') {
-                // Error de red o servidor - mostrar error genérico
-                mostrarAlerta('Error de comunicación. Intente nuevamente.', 'error');
+            if (err.message === 'Sesión inválida') {
+                // Lo enviado no se reintenta (puede ser un rechazo de VFP); lo que
+                // quedó sin enviar sigue en la cola para el próximo inicio de sesión
+                errorAutenticacion = true;
+                sacarDeCola(lote);
+                mostrarPendientes(lote.map(item => item.idSolicitud));
+                if (modalControl) {
+                    modalControl.hide();
+                }
+                // Mostrar modal de error bloqueante (sin countdown)
+                window.mostrarErrorConRedirect(err.mensajeVFP, err.redirect);
+                return;
             }
-            if (btnConfirmar && err.message !== 'Sesión inválida') {
-                btnConfirmar.disabled = false;
-                btnConfirmar.innerHTML = textoOriginal;
+            // Error de red o del servidor: quedan en la cola y se reintentan con espera creciente
+            console.error('❌ Error enviando controles:', err);
+            reintentarMasTarde();
+        })
+        .finally(() => {
+            enviandoCola = false;
+            marcarFilasEnCola();
+            if (!timerCola) programarEnvio();
+        });
+    }
+
+    // Los rechazados vuelven a la tabla
+    function avisarRechazados(rechazados) {
+        mostrarPendientes(rechazados.map(item => item.idSolicitud));
+        mostrarAlerta(rechazados.map(item => `${item.idSolicitud}: ${item.mensaje || 'No registrado'}`).join('\n'), 'error');
+    }
+
+    // Registro diferido: el servidor ya guardó estos controles y los envía a VFP
+    // por su cuenta. Siguen en IndexedDB (marcados) hasta conocer el resultado
+    function aceptarDiferidos(items) {
+        if (!items.length) return;
+        const claves = new Set(items.map(item => item.idempotencia));
+        colaRegistros = colaRegistros.filter(item => !claves.has(item.idempotencia));
+        items.forEach(item => {
+            item.diferido = true;
+            guardarEnCola(item);
+        });
+        diferidos = diferidos.concat(items);
+        programarConsultaDiferidos();
+    }
+
+    function programarConsultaDiferidos() {
+        if (timerDiferidos || !diferidos.length) return;
+        timerDiferidos = setTimeout(consultarDiferidos, registroDiferido ? registroDiferido.consultaMs : REINTENTO_MIN_MS);
+    }
+
+    function consultarDiferidos() {
+        timerDiferidos = null;
+        const consultados = diferidos.slice(0, 200);
+        const claves = consultados.map(item => encodeURIComponent(item.idempotencia)).join(',');
+        fetch(`/registrar/estado/?claves=${claves}`, { credentials: 'same-origin' })
+        .then(resp => {
+            if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+            return resp.json();
+        })
+        .then(data => {
+            const registros = data.registros || {};
+            const registrados = [];
+            const rechazados = [];
+            const desconocidos = [];
+            consultados.forEach(item => {
+                const r = registros[item.idempotencia];
+                if (!r) {
+                    desconocidos.push(item);
+                } else if (r.estado === 'registrado') {
+                    registrados.push(item);
+                } else if (r.estado === 'rechazado') {
+                    rechazados.push(Object.assign({}, item, { mensaje: r.mensaje || '' }));
+                }
+            });
+            const terminados = new Set(registrados.concat(rechazados, desconocidos).map(item => item.idempotencia));
+            diferidos = diferidos.filter(item => !terminados.has(item.idempotencia));
+            quitarDeCola(registrados.concat(rechazados));
+            marcarRegistrados(registrados.map(item => item.idSolicitud));
+            if (rechazados.length) {
+                avisarRechazados(rechazados);
+            } else if (registrados.length) {
+                mostrarAlerta(`${registrados.length} control(es) registrado(s)`, 'success');
+            }
+            // El servidor no los tiene: vuelven a la cola de envío con la misma clave
+            if (desconocidos.length) {
+                desconocidos.forEach(item => {
+                    item.diferido = false;
+                    guardarEnCola(item);
+                });
+                colaRegistros = colaRegistros.concat(desconocidos);
+                programarEnvio(0);
             }
+        })
+        .catch(err => console.warn('⚠️ Error consultando registros diferidos:', err))
+        .finally(() => {
+            marcarFilasEnCola();
+            programarConsultaDiferidos();
         });
     }
 
+    // Controles que quedaron sin enviar (recarga de la página, corte de red, cierre)
+    // o aceptados por el servidor sin resultado todavía
+    leerCola().then(items => {
+        const conocidos = new Set(colaRegistros.concat(diferidos).map(item => item.idempotencia));
+        const propios = (items || [])
+            .filter(item => (item.usuario || '') === (CONFIG.usuario || ''))
+            .filter(item => !conocidos.has(item.idempotencia))
+            .sort((a, b) => a.creado - b.creado);
+        if (!propios.length) return;
+        const sinEnviar = propios.filter(item => !item.diferido);
+        console.log(`📦 ${sinEnviar.length} control(es) sin enviar y ${propios.length - sinEnviar.length} en el servidor recuperados de la cola`);
+        colaRegistros = colaRegistros.concat(sinEnviar);
+        diferidos = diferidos.concat(propios.filter(item => item.diferido));
+        ocultarPendientes(propios.map(item => item.idSolicitud));
+        marcarFilasEnCola();
+        programarEnvio(0);
+        programarConsultaDiferidos();
+    });
+
+    window.addEventListener('online', function() {
+        intentosFallidos = 0;
+        programarEnvio(0);
+    });
+
+    // Al salir de la página, enviar lo que quede en cola sin esperar respuesta.
+    // Siguen en IndexedDB: si se reenvían al volver, la clave de idempotencia evita duplicados
+    window.addEventListener('pagehide', function() {
+        if (!colaRegistros.length || enviandoCola) return;
+        const tamanio = registroLote ? registroLote.tamanio : 10;
+        const body = JSON.stringify({ token: tokenParaEnvio(), items: colaRegistros.slice(0, tamanio).map(itemParaEnvio) });
+        navigator.sendBeacon('/registrar-lote/', new Blob([body], { type: 'application/json' }));
+    });
+
+    // Recarga periódica de la lista completa (registrar ya no la dispara)
+    if (CONFIG.refrescoPendientesMs > 0) {
+        setInterval(function() {
+            if (document.hidden || errorAutenticacion || document.querySelector('.modal.show')) return;
+            actualizarPendientes(true);
+        }, CONFIG.refrescoPendientesMs);
+    }
+
     function mostrarMensaje(mensaje, tipo = "info") {
         const container = document.getElementById('solicitudes-container');
         if (!container) return;
@@ -457,33 +742,46 @@
     window.mostrarError = mostrarError;
     window.mostrarErrorConRedirect = mostrarErrorConRedirect;
     window.mostrarAlerta = mostrarAlerta;
+    window.enviarColaRegistros = enviarColaRegistros;
+    window.marcarFilasEnCola = marcarFilasEnCola;
 
     console.log('✅ controlStock.js inicializado (adaptado)');
 })();
 
-function actualizarPendientes() {
-    console.log('🔄 Actualizando pendientes...');
-    
-    const btnActualizar = document.getElementById('btn-actualizar');
-    const container = document.getElementById('solicitudes-container');
-    
-    if (btnActualizar) {
-        btnActualizar.disabled = true;
-        btnActualizar.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Actualizando...';
-    }
-    
-    if (container) {
-        container.innerHTML = `
-            <div class="card-body p-4 text-center">
-                <div class="spinner-border text-primary" role="status">
-                    <span class="visually-hidden">Cargando...</span>
-                </div>
-                <p class="mt-2 mb-0">Actualizando pendientes...</p>
-            </div>
-        `;
-    }
-    
-    fetch('/pendientes/', {
+// ============ TABLA DE PENDIENTES ============
+// La lista se guarda en memoria en columnas ({id, codigo, descripcion, fecha}).
+// Hasta tablaPendientes.umbralVirtual filas se dibujan todas; con más, solo las
+// visibles dentro de un contenedor con scroll (scroll virtual) y dos filas
+// espaciadoras que ocupan el alto del resto. Con tablaPendientes.pagina > 0 la
+// lista se pide al servidor de a páginas (/pendientes/?offset=&limit=&q=).
+// Los clicks en las filas los atiende un único listener en el contenedor.
+const ALTO_FILA_INICIAL = 49;  // px; se corrige midiendo las filas dibujadas
+const FILAS_EXTRA = 10;        // Filas dibujadas por encima y por debajo de las visibles
+
+const tablaPendientes = {
+    columnas: null,       // Lista completa (modo local)
+    indices: null,        // Posiciones que pasan el filtro (null = todas)
+    filtro: '',
+    paginas: new Map(),   // Modo paginado: número de página → columnas
+    pedidas: new Set(),
+    total: 0,             // Modo paginado: coincidencias según el servidor
+    generacion: 0,        // Descarta páginas pedidas para una lista/filtro anterior
+    ocultos: new Map(),   // idSolicitud → 0 si está en la cola de registros, o cuándo se registró
+    altoFila: ALTO_FILA_INICIAL,
+    frame: null
+};
+
+function configTabla() {
+    return Object.assign({ umbralVirtual: 200, pagina: 0 }, window.configTablaPendientes || {});
+}
+
+function tablaPaginada() {
+    return configTabla().pagina > 0;
+}
+
+// GET a /pendientes/. Con 401 muestra el mensaje de VFP y redirige al login
+function pedirPendientes(url) {
+    return fetch(url, {
         method: 'GET',
         credentials: 'same-origin',
         headers: {
@@ -508,7 +806,52 @@ function actualizarPendientes() {
             throw new Error(`HTTP ${resp.status}`);
         }
         return resp.json();
-    })
+    });
+}
+
+function urlPagina(numero) {
+    const tamanio = configTabla().pagina;
+    return `/pendientes/?formato=columnas&offset=${numero * tamanio}&limit=${tamanio}` +
+        `&q=${encodeURIComponent(tablaPendientes.filtro)}`;
+}
+
+// silencioso: recarga periódica, sin spinner ni mensajes de error en la tabla
+function actualizarPendientes(silencioso) {
+    console.log('🔄 Actualizando pendientes...');
+    
+    const btnActualizar = silencioso ? null : document.getElementById('btn-actualizar');
+    const container = document.getElementById('solicitudes-container');
+    const inicio = Date.now();
+    
+    if (btnActualizar) {
+        btnActualizar.disabled = true;
+        btnActualizar.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Actualizando...';
+    }
+    
+    // Con una versión conocida se pide el delta y la tabla actual queda visible;
+    // sin versión se recarga la lista completa
+    // formato=columnas: {id: [...], codigo: [...], ...} en vez de un objeto por fila
+    // En modo paginado se pide la primera página (con el filtro actual)
+    const paginado = tablaPaginada();
+    const generacion = ++tablaPendientes.generacion;
+    let url = '/pendientes/?formato=columnas';
+    if (paginado) {
+        url = urlPagina(0);
+    } else if (window.versionPendientes !== null && window.versionPendientes !== undefined) {
+        url += '&version=' + encodeURIComponent(window.versionPendientes);
+    }
+    if (url.indexOf('&version=') === -1 && container && !silencioso) {
+        container.innerHTML = `
+            <div class="card-body p-4 text-center">
+                <div class="spinner-border text-primary" role="status">
+                    <span class="visually-hidden">Cargando...</span>
+                </div>
+                <p class="mt-2 mb-0">Actualizando pendientes...</p>
+            </div>
+        `;
+    }
+    
+    pedirPendientes(url)
     .then(data => {
         console.log('📡 Pendientes actualizados:', data);
         console.log('📦 DEBUG: data.deposito =', data.deposito);
@@ -521,6 +864,9 @@ function actualizarPendientes() {
             return;
         }
 
+        // Esta lista ya refleja los registros confirmados antes de pedirla
+        liberarRegistrados(inicio);
+
         // Actualizar depósito si viene en la respuesta
         console.log('📦 Buscando elementos de depósito...');
         const depositoElMobile = document.getElementById('deposito-info');
@@ -544,12 +890,25 @@ function actualizarPendientes() {
             console.warn('⚠️ data.deposito está vacío o undefined');
         }
 
-        renderizarPendientes(data.pendientes || [], data.mensaje);
+        if (data.total !== undefined) {
+            // Página: la versión describe la lista completa, no sirve para pedir deltas
+            if (generacion === tablaPendientes.generacion) {
+                renderizarPagina(data, data.mensaje);
+            }
+            window.versionPendientes = null;
+            return;
+        }
+        if (data.delta) {
+            aplicarDeltaPendientes(data.agregados || [], data.eliminados || [], data.mensaje);
+        } else {
+            renderizarPendientes(data.pendientes || [], data.mensaje);
+        }
+        window.versionPendientes = data.version ?? null;
     })
     .catch(err => {
         console.error('❌ Error al actualizar pendientes:', err);
         // No mostrar error si ya estamos redirigiendo
-        if (err.message !== 'Sesión inválida') {
+        if (err.message !== 'Sesión inválida' && !silencioso) {
             mostrarError('Error de comunicación. Intente nuevamente.');
         }
     })
@@ -561,38 +920,178 @@ function actualizarPendientes() {
     });
 }
 
+// Lista completa (modo local)
 function renderizarPendientes(pendientes, mensajeVFP) {
-    const container = document.getElementById('solicitudes-container');
-    if (!container) return;
-
     // Si VFP envió un mensaje, mostrarlo como modal bloqueante
     if (mensajeVFP) {
         mostrarAlerta(mensajeVFP, 'info-modal');
     }
 
-    if (!pendientes || pendientes.length === 0) {
-        // Mostrar mensaje simple en el área (sin el mensaje de VFP, ya se mostró en modal)
-        const mensajeArea = mensajeVFP ? '' : 'No hay solicitudes pendientes';
-        if (mensajeArea) {
-            container.innerHTML = `
-                <div class="card-body p-4 text-center">
-                    <div class="alert alert-info mb-0">${mensajeArea}</div>
-                </div>
-            `;
-        } else {
-            // Si hay mensaje de VFP, dejar el área vacía o con un placeholder
-            container.innerHTML = `
-                <div class="card-body p-4 text-center">
-                    <div class="alert alert-info mb-0">No hay solicitudes pendientes</div>
-                </div>
-            `;
+    tablaPendientes.columnas = aColumnas(pendientes);
+    aplicarFiltroLocal();
+    dibujarTabla(true);
+}
+
+// Primera página de la lista (modo paginado); el resto se pide al hacer scroll
+function renderizarPagina(data, mensajeVFP) {
+    if (mensajeVFP) {
+        mostrarAlerta(mensajeVFP, 'info-modal');
+    }
+
+    const t = tablaPendientes;
+    const numero = Math.floor((data.offset || 0) / configTabla().pagina);
+    t.columnas = null;
+    t.indices = null;
+    t.paginas = new Map([[numero, aColumnas(data.pendientes)]]);
+    t.pedidas = new Set([numero]);
+    t.total = data.total || 0;
+    dibujarTabla(false);
+}
+
+function pedirPagina(numero) {
+    const t = tablaPendientes;
+    if (t.pedidas.has(numero)) return;
+    t.pedidas.add(numero);
+    const generacion = t.generacion;
+
+    pedirPendientes(urlPagina(numero))
+    .then(data => {
+        if (generacion !== t.generacion) return;
+        if (data.error) {
+            t.pedidas.delete(numero);
+            return;
         }
+        t.paginas.set(numero, aColumnas(data.pendientes));
+        t.total = data.total ?? t.total;
+        programarVentana();
+    })
+    .catch(err => {
+        t.pedidas.delete(numero);
+        console.error('❌ Error al pedir página de pendientes:', err);
+    });
+}
+
+// Búsqueda: en memoria si está la lista completa, si no en el servidor (?q=)
+function filtrarPendientes(texto) {
+    const t = tablaPendientes;
+    t.filtro = texto.trim();
+    if (t.columnas) {
+        aplicarFiltroLocal();
+        dibujarTabla(false);
         return;
     }
-    
-    let html = `
+    if (tablaPaginada() && t.paginas.size) {
+        const generacion = ++t.generacion;
+        pedirPendientes(urlPagina(0))
+        .then(data => {
+            if (generacion === t.generacion && !data.error) renderizarPagina(data, null);
+        })
+        .catch(err => console.error('❌ Error al buscar pendientes:', err));
+    }
+}
+
+// Filtro de búsqueda y filas ocultas (registradas o en la cola de registros)
+function aplicarFiltroLocal() {
+    const t = tablaPendientes;
+    const q = t.filtro.toLowerCase();
+    if ((!q && !t.ocultos.size) || !t.columnas) {
+        t.indices = null;
+        return;
+    }
+    const { id, codigo, descripcion } = t.columnas;
+    const ocultos = t.ocultos;
+    const indices = [];
+    for (let i = 0; i < id.length; i++) {
+        if (ocultos.size && ocultos.has(String(id[i]))) continue;
+        if (q && !`${id[i] ?? ''}\u0000${codigo[i] ?? ''}\u0000${descripcion[i] ?? ''}`.toLowerCase().includes(q)) continue;
+        indices.push(i);
+    }
+    t.indices = indices;
+}
+
+// Registro optimista: la fila se oculta al encolar el control y vuelve si VFP
+// lo rechaza. En modo paginado las filas en cola solo se marcan (marcarFilasEnCola)
+function ocultarPendientes(ids) {
+    ids.forEach(id => tablaPendientes.ocultos.set(String(id), 0));
+    redibujarLocal();
+}
+
+function mostrarPendientes(ids) {
+    ids.forEach(id => tablaPendientes.ocultos.delete(String(id)));
+    redibujarLocal();
+}
+
+// Registrados en VFP: siguen ocultos hasta que llegue una lista pedida después
+function marcarRegistrados(ids) {
+    const ahora = Date.now();
+    ids.forEach(id => tablaPendientes.ocultos.set(String(id), ahora));
+}
+
+function liberarRegistrados(desde) {
+    tablaPendientes.ocultos.forEach((registrado, id) => {
+        if (registrado && registrado < desde) tablaPendientes.ocultos.delete(id);
+    });
+}
+
+function redibujarLocal() {
+    if (!tablaPendientes.columnas) return;
+    aplicarFiltroLocal();
+    dibujarTabla(true);
+}
+
+function cantidadFilas() {
+    const t = tablaPendientes;
+    if (!t.columnas) return t.total;
+    return t.indices ? t.indices.length : t.columnas.id.length;
+}
+
+// Fila en la posición i de la tabla (ya filtrada), o null si su página todavía no llegó
+function filaEn(i) {
+    const t = tablaPendientes;
+    let columnas = t.columnas;
+    let j = i;
+    if (columnas) {
+        if (t.indices) j = t.indices[i];
+    } else {
+        const tamanio = configTabla().pagina;
+        const numero = Math.floor(i / tamanio);
+        columnas = t.paginas.get(numero);
+        if (!columnas) {
+            pedirPagina(numero);
+            return null;
+        }
+        j = i - numero * tamanio;
+        if (j >= columnas.id.length) return null;
+    }
+    return [columnas.id[j] ?? '', columnas.codigo[j] ?? '', columnas.descripcion[j] ?? '', columnas.fecha[j] ?? ''];
+}
+
+function dibujarTabla(conservarScroll) {
+    const container = document.getElementById('solicitudes-container');
+    if (!container) return;
+
+    const total = cantidadFilas();
+    if (total === 0) {
+        const texto = tablaPendientes.filtro
+            ? 'Ninguna solicitud coincide con la búsqueda'
+            : 'No hay solicitudes pendientes';
+        container.innerHTML = `
+            <div class="card-body p-4 text-center">
+                <div class="alert alert-info mb-0">${texto}</div>
+            </div>
+        `;
+        return;
+    }
+
+    const config = configTabla();
+    // En modo paginado, más de una página obliga a scroll virtual (el resto se pide al verlo)
+    const virtual = total > config.umbralVirtual || (!tablaPendientes.columnas && total > config.pagina);
+    const anterior = container.querySelector('.tabla-virtual');
+    const scrollTop = conservarScroll && anterior ? anterior.scrollTop : 0;
+
+    container.innerHTML = `
         <div class="card-body p-0">
-            <div class="table-responsive">
+            <div class="table-responsive${virtual ? ' tabla-virtual' : ''}">
                 <table class="table table-hover mb-0">
                     <thead class="bg-light">
                         <tr>
@@ -601,37 +1100,264 @@ function renderizarPendientes(pendientes, mensajeVFP) {
                             <th class="fw-semibold">Descripción</th>
                         </tr>
                     </thead>
-                    <tbody>
+                    <tbody></tbody>
+                </table>
+            </div>
+        </div>
     `;
-    
-    pendientes.forEach(item => {
-        const id = Array.isArray(item) ? item[0] : (item.idsolicitud || item.idSolicitud || '');
-        const codigo = Array.isArray(item) ? item[1] : (item.codigo || '');
-        const descripcion = Array.isArray(item) ? item[2] : (item.descripcion || '');
-        const fecha = Array.isArray(item) ? item[3] : (item.fecha || '');
-        
-        html += `
+    const tbody = container.querySelector('tbody');
+
+    if (!virtual) {
+        let html = '';
+        for (let i = 0; i < total; i++) {
+            const fila = filaEn(i);
+            html += fila ? filaHtml(...fila) : filaCargandoHtml();
+        }
+        tbody.innerHTML = html;
+        if (window.marcarFilasEnCola) window.marcarFilasEnCola();
+        return;
+    }
+
+    // Alto total primero, para que el scroll y clientHeight sean los definitivos
+    const scroller = container.querySelector('.tabla-virtual');
+    tbody.innerHTML = espaciadorHtml(total * tablaPendientes.altoFila);
+    scroller.scrollTop = scrollTop;
+    scroller.addEventListener('scroll', programarVentana, { passive: true });
+    dibujarVentana();
+}
+
+function programarVentana() {
+    if (tablaPendientes.frame === null) {
+        tablaPendientes.frame = requestAnimationFrame(dibujarVentana);
+    }
+}
+
+// Dibuja solo las filas visibles (más FILAS_EXTRA de cada lado) del modo virtual
+function dibujarVentana() {
+    tablaPendientes.frame = null;
+    const container = document.getElementById('solicitudes-container');
+    const scroller = container && container.querySelector('.tabla-virtual');
+    if (!scroller) return;
+
+    const tbody = scroller.querySelector('tbody');
+    const total = cantidadFilas();
+    const alto = tablaPendientes.altoFila;
+    const primera = Math.min(total, Math.max(0, Math.floor(scroller.scrollTop / alto) - FILAS_EXTRA));
+    const ultima = Math.min(total, Math.ceil((scroller.scrollTop + scroller.clientHeight) / alto) + FILAS_EXTRA);
+
+    let html = espaciadorHtml(primera * alto);
+    for (let i = primera; i < ultima; i++) {
+        const fila = filaEn(i);
+        html += fila ? filaHtml(...fila) : filaCargandoHtml();
+    }
+    html += espaciadorHtml((total - ultima) * alto);
+    tbody.innerHTML = html;
+
+    // El alto real depende del ancho de pantalla (descripciones en dos líneas):
+    // se promedia lo dibujado y se usa desde el próximo scroll
+    const filas = tbody.querySelectorAll('.solicitud-row');
+    if (filas.length) {
+        let suma = 0;
+        filas.forEach(row => { suma += row.offsetHeight; });
+        if (suma) tablaPendientes.altoFila = suma / filas.length;
+    }
+    if (window.marcarFilasEnCola) window.marcarFilasEnCola();
+}
+
+// Los pendientes llegan en columnas ({id: [...], codigo: [...], ...}) o, desde
+// servidores anteriores, como array de filas
+function esColumnar(pendientes) {
+    return !!pendientes && !Array.isArray(pendientes) && Array.isArray(pendientes.id);
+}
+
+function cantidadPendientes(pendientes) {
+    if (!pendientes) return 0;
+    return esColumnar(pendientes) ? pendientes.id.length : pendientes.length;
+}
+
+function aColumnas(pendientes) {
+    if (esColumnar(pendientes)) return pendientes;
+    const columnas = { id: [], codigo: [], descripcion: [], fecha: [] };
+    (pendientes || []).forEach(item => {
+        const fila = Array.isArray(item) ? item : [
+            item.idsolicitud || item.idSolicitud || '', item.codigo || '', item.descripcion || '', item.fecha || ''
+        ];
+        columnas.id.push(fila[0] ?? '');
+        columnas.codigo.push(fila[1] ?? '');
+        columnas.descripcion.push(fila[2] ?? '');
+        columnas.fecha.push(fila[3] ?? '');
+    });
+    return columnas;
+}
+
+// Filas renderizadas en el template (modo inline con pocas filas)
+function columnasDesdeFilas(container) {
+    const columnas = { id: [], codigo: [], descripcion: [], fecha: [] };
+    container.querySelectorAll('.solicitud-row').forEach(row => {
+        columnas.id.push(row.dataset.id || '');
+        columnas.codigo.push(row.dataset.cod || '');
+        columnas.descripcion.push(row.dataset.desc || '');
+        columnas.fecha.push(row.dataset.fecha || '');
+    });
+    return columnas;
+}
+
+function filaHtml(id, codigo, descripcion, fecha) {
+    return `
             <tr class="solicitud-row"
                 data-id="${id}"
                 data-cod="${codigo}"
                 data-desc="${descripcion}"
-                data-fecha="${fecha}"
-                onclick="abrirModalControlFromRow(this)">
+                data-fecha="${fecha}">
                 <td>${fecha}</td>
                 <td>${codigo}</td>
                 <td>${descripcion}</td>
             </tr>
         `;
+}
+
+function filaCargandoHtml() {
+    return `<tr class="fila-cargando"><td colspan="3" class="text-muted text-center"
+        style="height: ${tablaPendientes.altoFila}px;">Cargando...</td></tr>`;
+}
+
+function espaciadorHtml(alto) {
+    if (alto <= 0) return '';
+    return `<tr class="espaciador" aria-hidden="true"><td colspan="3" style="height: ${alto}px; padding: 0; border: 0;"></td></tr>`;
+}
+
+function aplicarDeltaPendientes(agregados, eliminados, mensajeVFP) {
+    // Se aplica sobre la lista en memoria y se redibuja (en modo virtual, solo lo visible)
+    const actual = tablaPendientes.columnas;
+    if (!actual) {
+        // La lista estaba vacía: los agregados son la lista completa
+        renderizarPendientes(agregados, mensajeVFP);
+        return;
+    }
+
+    if (mensajeVFP) {
+        mostrarAlerta(mensajeVFP, 'info-modal');
+    }
+
+    const nuevos = aColumnas(agregados);
+    const quitar = new Set(eliminados.map(String));
+    nuevos.id.forEach(id => quitar.add(String(id)));
+
+    const columnas = { id: [], codigo: [], descripcion: [], fecha: [] };
+    for (let i = 0; i < actual.id.length; i++) {
+        if (quitar.has(String(actual.id[i]))) continue;
+        for (const nombre in columnas) columnas[nombre].push(actual[nombre][i]);
+    }
+    for (const nombre in columnas) columnas[nombre] = columnas[nombre].concat(nuevos[nombre]);
+
+    tablaPendientes.columnas = columnas;
+    aplicarFiltroLocal();
+    console.log(`📦 Delta aplicado: +${cantidadPendientes(nuevos)} -${eliminados.length}`);
+    dibujarTabla(true);
+}
+
+// ============ LECTOR DE CÓDIGOS ============
+// El código escaneado se resuelve en el servidor (índice hash del snapshot de
+// pendientes): con una sola solicitud se abre el modal directamente; con varias
+// se filtra la tabla por ese código para elegir.
+function abrirPorCodigo(codigo) {
+    codigo = (codigo || '').trim();
+    if (!codigo) return;
+    console.log('🔎 Buscando código escaneado:', codigo);
+
+    pedirPendientes(`/pendientes/codigo/?formato=columnas&codigo=${encodeURIComponent(codigo)}`)
+    .then(data => {
+        if (data.error) {
+            mostrarAlerta(data.error, 'warning');
+            return;
+        }
+        const encontrados = aColumnas(data.pendientes);
+        const cantidad = cantidadPendientes(encontrados);
+        if (cantidad === 0) {
+            mostrarAlerta(`No hay solicitudes pendientes para el código ${codigo}`, 'warning');
+            return;
+        }
+        if (cantidad === 1) {
+            window.abrirModalSolicitud({
+                idSolicitud: String(encontrados.id[0] ?? ''),
+                codigo: encontrados.codigo[0] ?? '',
+                descripcion: encontrados.descripcion[0] ?? '',
+                fecha: encontrados.fecha[0] ?? ''
+            });
+            return;
+        }
+        const filtro = document.getElementById('filtro-pendientes');
+        if (filtro) filtro.value = codigo;
+        filtrarPendientes(codigo);
+        mostrarAlerta(`${cantidad} solicitudes pendientes para el código ${codigo}: elija una`, 'info');
+    })
+    .catch(err => {
+        console.error('❌ Error al buscar código:', err);
+        if (err.message !== 'Sesión inválida') {
+            mostrarAlerta('No se pudo buscar el código. Intente nuevamente.', 'warning');
+        }
     });
-    
-    html += `
-                    </tbody>
-                </table>
-            </div>
-        </div>
-    `;
-    
-    container.innerHTML = html;
 }
 
-window.actualizarPendientes = actualizarPendientes;
\ No newline at end of file
+window.actualizarPendientes = actualizarPendientes;
+window.abrirPorCodigo = abrirPorCodigo;
+
+// Inicialización de la tabla: click delegado, búsqueda y lista inline
+(function() {
+    const container = document.getElementById('solicitudes-container');
+    if (!container) return;
+
+    // Un solo listener para todas las filas (las del template y las dibujadas acá)
+    container.addEventListener('click', function(e) {
+        const row = e.target.closest('.solicitud-row');
+        if (row && container.contains(row)) window.abrirModalControlFromRow(row);
+    });
+
+    const filtro = document.getElementById('filtro-pendientes');
+    if (filtro) {
+        let espera = null;
+        filtro.addEventListener('input', function() {
+            clearTimeout(espera);
+            espera = setTimeout(() => filtrarPendientes(filtro.value), 150);
+        });
+        // Enter (los lectores de códigos lo envían al final): ir directo a la solicitud
+        filtro.addEventListener('keydown', function(e) {
+            if (e.key !== 'Enter') return;
+            e.preventDefault();
+            abrirPorCodigo(filtro.value);
+        });
+    }
+
+    // Lector de códigos sin foco en ningún campo: "teclea" el código muy rápido
+    // y termina con Enter. Las teclas más espaciadas que ESPERA_ESCANEO_MS no cuentan.
+    const ESPERA_ESCANEO_MS = 50;
+    let escaneado = '';
+    let ultimaTecla = 0;
+    document.addEventListener('keydown', function(e) {
+        const destino = e.target;
+        if (destino && (destino.tagName === 'INPUT' || destino.tagName === 'TEXTAREA' || destino.isContentEditable)) return;
+        if (document.querySelector('.modal.show')) return;
+
+        const ahora = Date.now();
+        if (ahora - ultimaTecla > ESPERA_ESCANEO_MS) escaneado = '';
+        ultimaTecla = ahora;
+
+        if (e.key === 'Enter') {
+            if (escaneado.length >= 3) {
+                e.preventDefault();
+                abrirPorCodigo(escaneado);
+            }
+            escaneado = '';
+        } else if (e.key.length === 1) {
+            escaneado += e.key;
+        }
+    });
+
+    if (window.pendientesInline) {
+        // Lista inline larga: viene en config_js y se dibuja con scroll virtual
+        renderizarPendientes(window.pendientesInline, null);
+        window.pendientesInline = null;
+    } else if (container.querySelector('.solicitud-row')) {
+        tablaPendientes.columnas = columnasDesdeFilas(container);
+    }
+})();
@@ -2,15 +2,85 @@
 Cliente TCP para comunicación con VFP
 Maneja todas las comunicaciones de bajo nivel con el servidor VFP
 """
+import asyncio
 import logging
 import socket
 import json
-from .__init__ import APP_VERSION, TCP_TIMEOUT, TCP_ENABLED
-from .utils import get_connection_config
-from .algoritmoEncriptacionCasero import encriptar, desencriptar
+import time
+from .__init__ import (
+    APP_VERSION, TCP_TIMEOUT, TCP_ENABLED, TCP_TAIL_TIMEOUT, TCP_CHUNK_SIZE, TCP_MAX_RESPUESTA,
+    TCP_DECODIFICAR_EN_THREAD
+)
+from .utils import get_connection_config, extraer_protocolo
+from .algoritmoEncriptacionCasero import (
+    encriptar_bytes, desencriptar_bytes, desencriptar_bytes_por_bloques, texto_a_bytes
+)
+from .json_incremental import leer_objeto
+from .pool_tcp import pool, PoolAgotado
+from .metricas import Medicion
+from .circuito import circuito
+from .logs import iniciar_comando, terminar_comando
 
 logger = logging.getLogger(__name__)
 
+MAX_SIZE = TCP_MAX_RESPUESTA  # Límite para evitar respuestas infinitas
+LONGITUD_HEADER = 10  # Framing "longitud": 10 dígitos ASCII con el largo del payload encriptado
+# Comandos que se pueden reenviar sin riesgo si la conexión se corta (no modifican nada en VFP)
+COMANDOS_SOLO_LECTURA = frozenset({"verificarToken", "controlPendientes"})
+
+
+class RespuestaDemasiadoGrande(Exception):
+    """La respuesta del servidor supera MAX_SIZE"""
+
+
+def _sin_respuesta(mensaje):
+    """Error de transporte: VFP no respondió (el comando pudo haberse procesado o no)"""
+    return {"estado": False, "mensaje": mensaje, "sin_respuesta": True}
+
+
+def es_sin_respuesta(respuesta):
+    """True si VFP no respondió (None o un error de transporte de este módulo)"""
+    return not respuesta or respuesta.get("sin_respuesta") is True
+
+
+def _circuito_abierto():
+    """Respuesta inmediata con el circuito del servidor abierto (ver circuito.py): no se envió nada"""
+    return {**_sin_respuesta("Servidor no disponible, intente nuevamente en unos segundos"), "no_enviado": True}
+
+
+def es_no_enviado(respuesta):
+    """True si la consulta no llegó a enviarse a VFP (se puede reintentar sin riesgo de duplicar)"""
+    return bool(respuesta) and respuesta.get("no_enviado") is True
+
+
+def _registrar(medicion, host, port):
+    """Cierra la medición del intercambio e informa el resultado al cortacircuitos"""
+    medicion.registrar()
+    circuito.registrar(host, port, medicion.error)
+
+
+class _SocketMedido:
+    """Socket que anota en una Medicion los bytes enviados/recibidos y cuándo llegan"""
+
+    __slots__ = ("_s", "_medicion")
+
+    def __init__(self, s, medicion):
+        self._s = s
+        self._medicion = medicion
+
+    def sendall(self, datos):
+        self._s.sendall(datos)
+        self._medicion.enviado_ahora(len(datos))
+
+    def recv_into(self, buffer, cantidad=0):
+        leidos = self._s.recv_into(buffer, cantidad)
+        if leidos:
+            self._medicion.recibido_ahora(leidos)
+        return leidos
+
+    def settimeout(self, timeout):
+        self._s.settimeout(timeout)
+
 
 def decodificar_respuesta_servidor(respuesta_bytes):
     """
@@ -27,7 +97,7 @@ def decodificar_respuesta_servidor(respuesta_bytes):
     for codificacion in codificaciones:
         try:
             respuesta_str = respuesta_bytes.decode(codificacion)
-            logger.debug(f"Respuesta decodificada con {codificacion}")
+            logger.debug("Respuesta decodificada con %s", codificacion)
             return respuesta_str
         except (UnicodeDecodeError, LookupError):
             continue
@@ -37,81 +107,630 @@ def decodificar_respuesta_servidor(respuesta_bytes):
     return respuesta_bytes.decode('utf-8', errors='replace')
 
 
-def enviar_consulta_tcp(mensaje_dict, request=None, ip_custom=None, puerto_custom=None):
+class BufferRecepcion:
+    """
+    Buffer de recepción sobre un bytearray preasignado: recv_into escribe
+    directamente en él (sin concatenar bytes) y crece por duplicación hasta 'maximo'.
+    """
+
+    def __init__(self, capacidad=None, maximo=None):
+        self.maximo = maximo or MAX_SIZE
+        self.buffer = bytearray(min(capacidad or TCP_CHUNK_SIZE, self.maximo))
+        self.largo = 0
+
+    def __len__(self):
+        return self.largo
+
+    def _asegurar_capacidad(self, cantidad):
+        necesaria = min(self.largo + cantidad, self.maximo)
+        if necesaria > len(self.buffer):
+            self.buffer.extend(bytes(min(max(necesaria, len(self.buffer) * 2), self.maximo) - len(self.buffer)))
+
+    def recibir(self, s, cantidad=None):
+        """
+        Lee hasta 'cantidad' bytes (TCP_CHUNK_SIZE por defecto) al final del buffer.
+        Nunca lee más allá de 'maximo': si el buffer está lleno lanza RespuestaDemasiadoGrande.
+
+        Returns:
+            int: bytes leídos (0 si el servidor cerró la conexión)
+        """
+        disponible = self.maximo - self.largo
+        if disponible <= 0:
+            raise RespuestaDemasiadoGrande(self.largo)
+        cantidad = min(cantidad or TCP_CHUNK_SIZE, disponible)
+        self._asegurar_capacidad(cantidad)
+        with memoryview(self.buffer) as vista:
+            leidos = s.recv_into(vista[self.largo:self.largo + cantidad], cantidad)
+        self.largo += leidos
+        return leidos
+
+    def agregar(self, datos):
+        self._asegurar_capacidad(len(datos))
+        self.buffer[self.largo:self.largo + len(datos)] = datos
+        self.largo += len(datos)
+
+    def find(self, marca, inicio=0):
+        return self.buffer.find(marca, inicio, self.largo)
+
+    def resultado(self, largo=None):
+        """Recorta el buffer en el lugar (sin copiar) y lo devuelve como bytearray"""
+        del self.buffer[self.largo if largo is None else largo:]
+        return self.buffer
+
+
+def _leer_exacto(s, cantidad):
+    """Lee exactamente 'cantidad' bytes (o menos si el servidor cierra la conexión)."""
+    buffer = BufferRecepcion(capacidad=cantidad, maximo=cantidad)
+    while len(buffer) < cantidad:
+        if not buffer.recibir(s, cantidad - len(buffer)):
+            break
+    return buffer.resultado()
+
+
+def _leer_hasta_timeout(s, inicial=b''):
+    """
+    Lectura heurística (sin framing): lee chunks hasta que el servidor cierra
+    la conexión o hasta que vence TCP_TAIL_TIMEOUT después del primer chunk.
+    """
+    buffer = BufferRecepcion()
+    if inicial:
+        buffer.agregar(inicial)
+
+    while len(buffer) < buffer.maximo:
+        try:
+            # Después del primer chunk, usar timeout más corto para detectar fin de transmisión
+            if len(buffer):
+                s.settimeout(TCP_TAIL_TIMEOUT)
+
+            leidos = buffer.recibir(s)
+            if not leidos:
+                logger.debug("📭 Recibido chunk vacío. Total acumulado: %d bytes", len(buffer))
+                break
+
+            logger.debug("📦 Chunk recibido: %d bytes. Total: %d bytes", leidos, len(buffer))
+
+            # NO asumir que es el último solo porque es < TCP_CHUNK_SIZE
+            # Seguir intentando leer hasta timeout o chunk vacío
+        except socket.timeout:
+            # Timeout esperando más datos - asumimos que ya terminó la transmisión
+            logger.debug("⏱️ Timeout. Bytes acumulados: %d", len(buffer))
+            if len(buffer):
+                break
+            raise
+
+    if len(buffer) >= buffer.maximo:
+        raise RespuestaDemasiadoGrande(len(buffer))
+    return buffer.resultado()
+
+
+def _leer_con_longitud(s):
+    """Framing "longitud": header de LONGITUD_HEADER dígitos ASCII seguido del payload."""
+    header = _leer_exacto(s, LONGITUD_HEADER)
+    if len(header) < LONGITUD_HEADER or not header.isdigit():
+        # El servidor no respetó el framing: seguir con la lectura por timeout
+        logger.warning("Header de longitud inválido %r, usando lectura por timeout", bytes(header))
+        return _leer_hasta_timeout(s, header)
+
+    longitud = int(header)
+    if longitud >= MAX_SIZE:
+        raise RespuestaDemasiadoGrande(longitud)
+
+    respuesta = _leer_exacto(s, longitud)
+    if len(respuesta) < longitud:
+        logger.warning("Conexión cerrada antes de completar el payload: %d/%s bytes", len(respuesta), longitud)
+    return respuesta
+
+
+def _leer_hasta_terminador(s, terminador):
+    """
+    Framing "terminador": lee hasta encontrar el byte terminador.
+    El byte no debe poder aparecer en el payload encriptado. Por eso en este
+    framing el JSON viaja solo en ASCII en los dos sentidos (no ASCII escapado
+    como \\uXXXX): encriptado con las claves 65-74 cada byte queda entre 65 y 201,
+    así que sirve cualquier terminador fuera de ese rango (TCP_TERMINADOR = 0).
+    Con ñ, º, ¿... sin escapar, bytes como 0xB6-0xBF se encriptan a 0x00.
+    """
+    marca = bytes([terminador])
+    buffer = BufferRecepcion()
+    while True:
+        inicio = len(buffer)
+        if not buffer.recibir(s):
+            logger.warning("Conexión cerrada sin terminador. Bytes acumulados: %d", len(buffer))
+            return buffer.resultado()
+
+        posicion = buffer.find(marca, inicio)
+        if posicion >= 0:
+            return buffer.resultado(posicion)
+
+
+def recibir_respuesta(s, protocolo):
+    """
+    Lee una respuesta completa del socket según el framing negociado.
+
+    Raises:
+        socket.timeout: si no llegó ningún dato dentro de TCP_TIMEOUT
+        RespuestaDemasiadoGrande: si la respuesta supera MAX_SIZE
+    """
+    framing = protocolo.get('framing')
+    if framing == "longitud":
+        return _leer_con_longitud(s)
+    if framing == "terminador":
+        return _leer_hasta_terminador(s, protocolo.get('terminador', 0))
+    return _leer_hasta_timeout(s)
+
+
+def _decodificar_json(respuesta_completa):
+    """Desencripta los bytes recibidos y los convierte a dict"""
+    # CRÍTICO: desencriptar los bytes, convertir a string con latin-1, luego decodificar JSON
+    logger.debug("📏 Total de bytes recibidos antes de desencriptar: %d", len(respuesta_completa))
+
+    # Todo el desencriptado se hace sobre bytes; un único decode latin-1 al final
+    respuesta_desencriptada = desencriptar_bytes(respuesta_completa).decode('latin-1')
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔓 Respuesta desencriptada (primeros 200 chars): %s", respuesta_desencriptada[:200])
+        logger.debug("🔓 Respuesta desencriptada (últimos 50 chars): %s", respuesta_desencriptada[-50:])
+
+    try:
+        return json.loads(respuesta_desencriptada)
+    except json.JSONDecodeError as e:
+        logger.error("❌ Error parseando JSON: %s", e)
+        logger.error("📄 Respuesta desencriptada (primeros 500 chars): %r", respuesta_desencriptada[:500])
+        logger.error("📄 Respuesta desencriptada (últimos 100 chars): %r", respuesta_desencriptada[-100:])
+        return {"estado": False, "mensaje": "Respuesta inválida"}
+
+
+def _decodificar_json_por_bloques(respuesta_completa, procesar_items):
+    """
+    Igual que _decodificar_json, pero desencripta y parsea de a TCP_CHUNK_SIZE bytes:
+    los arrays de las claves de procesar_items se recorren elemento por elemento
+    y se guardan ya procesados (ver json_incremental.leer_objeto).
+    La clave de encriptación es el último byte, así que el payload encriptado
+    tiene que estar completo; lo que no se arma entero es el texto desencriptado.
+    """
+    logger.debug("📏 Total de bytes recibidos antes de desencriptar: %d (por bloques)", len(respuesta_completa))
+
+    fragmentos = (bloque.decode('latin-1')
+                  for bloque in desencriptar_bytes_por_bloques(respuesta_completa, TCP_CHUNK_SIZE))
+    try:
+        return leer_objeto(fragmentos, procesar_items)
+    except json.JSONDecodeError as e:
+        logger.error("❌ Error parseando JSON: %s", e)
+        logger.error("📄 Contexto del error: %r", e.doc[max(e.pos - 100, 0):e.pos + 100])
+        return {"estado": False, "mensaje": "Respuesta inválida"}
+
+
+def _decodificar(respuesta_completa, procesar_items, medicion=None):
+    if medicion is not None:
+        inicio = time.perf_counter()
+        try:
+            return _decodificar(respuesta_completa, procesar_items)
+        finally:
+            medicion.decodificado(inicio)
+    if procesar_items:
+        return _decodificar_json_por_bloques(respuesta_completa, procesar_items)
+    return _decodificar_json(respuesta_completa)
+
+
+def enmarcar_solicitud(contenido_bytes):
+    """En conexiones keep-alive la solicitud también lleva el header de longitud"""
+    return f"{len(contenido_bytes):0{LONGITUD_HEADER}d}".encode('ascii') + contenido_bytes
+
+
+def _obtener_medida(host, port, medicion):
+    """pool.obtener() anotando el tiempo de conexión si hubo que abrir una nueva"""
+    inicio = time.perf_counter()
+    s, reutilizada = pool.obtener(host, port)
+    if not reutilizada:
+        medicion.conectado(inicio)
+    return s, reutilizada
+
+
+def _intercambio_con_pool(host, port, datos, protocolo, medicion, solo_lectura=False):
+    """
+    Envía y recibe usando una conexión del pool. Si una conexión reutilizada
+    resulta estar cerrada por el servidor, reintenta una vez con una conexión
+    nueva solo si la solicitud no llegó a enviarse o si el comando es de solo
+    lectura (solo_lectura): un registro ya enviado pudo haberse aplicado, así
+    que vuelve al llamador como sin respuesta.
+    """
+    for intento in range(2):
+        s, reutilizada = _obtener_medida(host, port, medicion)
+        reutilizable = False
+        enviado = False
+        try:
+            medida = _SocketMedido(s, medicion)
+            medida.sendall(datos)
+            enviado = True
+            respuesta_completa = recibir_respuesta(medida, protocolo)
+            medicion.fin_lectura = time.perf_counter()
+            reutilizable = bool(respuesta_completa)
+            if respuesta_completa or not reutilizada or not solo_lectura:
+                return respuesta_completa
+            logger.warning("Conexión reutilizada cerrada por %s:%s, reintentando con una nueva", host, port)
+        except (ConnectionResetError, BrokenPipeError):
+            if not reutilizada or intento or (enviado and not solo_lectura):
+                raise
+            logger.warning("Conexión reutilizada rechazada por %s:%s, reintentando con una nueva", host, port)
+        finally:
+            pool.devolver(host, port, s, reutilizable=reutilizable)
+    return b''
+
+
+def _resolver_destino(request, ip_custom, puerto_custom, protocolo):
+    """Devuelve (host, port, protocolo) o (None, None, None) si no hay cliente configurado"""
+    if ip_custom and puerto_custom:
+        return ip_custom, int(puerto_custom), protocolo if protocolo is not None else extraer_protocolo(None)
+
+    host, port, protocolo_cookie = get_connection_config(request, con_protocolo=True)
+    if not host or not port:
+        return None, None, None
+    return host, port, protocolo if protocolo is not None else protocolo_cookie
+
+
+def _preparar_solicitud(mensaje_dict, protocolo):
+    """
+    Serializa y encripta el mensaje; devuelve los bytes a enviar.
+    Con framing "terminador" el JSON va solo en ASCII (ver _leer_hasta_terminador).
+    """
+    if protocolo.get('framing'):
+        # Avisar al servidor qué framing esperamos en la respuesta
+        mensaje_dict = {**mensaje_dict, "Framing": protocolo['framing']}
+
+    contenido = json.dumps(mensaje_dict, ensure_ascii=protocolo.get('framing') == "terminador")
+    return encriptar_bytes(texto_a_bytes(contenido))
+
+
+def enviar_consulta_tcp(mensaje_dict, request=None, ip_custom=None, puerto_custom=None, protocolo=None,
+                        procesar_items=None):
+    """
+    Envía un comando encriptado al servidor VFP y devuelve la respuesta como dict.
+
+    Si el servidor soporta framing (connection_config o parámetro 'protocolo'),
+    la lectura termina apenas llega el payload completo; si no, se usa la
+    lectura por timeout (TCP_TAIL_TIMEOUT) como fallback. Si además soporta
+    keepalive, la conexión se toma del pool del worker en lugar de abrir una nueva.
+
+    procesar_items: {clave en minúsculas: función(item)} para respuestas con
+    arrays grandes; se decodifican por bloques procesando cada elemento al leerlo.
+    """
 
     if not TCP_ENABLED:
         return {"estado": False, "mensaje": "Servicio no disponible"}
 
     # Determinar host/port
-    if ip_custom and puerto_custom:
-        host, port = ip_custom, int(puerto_custom)
-    else:
-        host, port = get_connection_config(request)
-        if not host or not port:
-            return {"estado": False, "mensaje": "No hay cliente configurado"}
+    host, port, protocolo = _resolver_destino(request, ip_custom, puerto_custom, protocolo)
+    if not host:
+        return {"estado": False, "mensaje": "No hay cliente configurado"}
+    if not circuito.permitir(host, port):
+        return _circuito_abierto()
+
+    usar_pool = bool(protocolo.get('keepalive') and protocolo.get('framing'))
+    logger.debug("Conectando a %s:%s ... (pool: %s)", host, port, "sí" if usar_pool else "no")
+
+    medicion = Medicion(mensaje_dict.get("Comando"), "pool" if usar_pool else "simple")
+    contexto_log = iniciar_comando(medicion.comando)
+    try:
+        datos = _preparar_solicitud(mensaje_dict, protocolo)
+
+        # Leer la respuesta completa según el framing negociado
+        try:
+            if usar_pool:
+                respuesta_completa = _intercambio_con_pool(host, port, enmarcar_solicitud(datos), protocolo, medicion,
+                                                           medicion.comando in COMANDOS_SOLO_LECTURA)
+            else:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.settimeout(TCP_TIMEOUT)
+                    inicio = time.perf_counter()
+                    s.connect((host, port))
+                    medicion.conectado(inicio)
+                    medida = _SocketMedido(s, medicion)
+                    medida.sendall(datos)
+                    respuesta_completa = recibir_respuesta(medida, protocolo)
+                    medicion.fin_lectura = time.perf_counter()
+        except socket.timeout:
+            medicion.error = "timeout"
+            return _sin_respuesta('Timeout esperando respuesta')
+        except RespuestaDemasiadoGrande as e:
+            logger.warning("Respuesta muy grande: %s bytes", e)
+            medicion.error = "demasiado_grande"
+            return {'estado': False, 'mensaje': 'Respuesta demasiado grande'}
+        except PoolAgotado as e:
+            logger.warning(str(e))
+            medicion.error = "pool_agotado"
+            return _sin_respuesta('Servidor ocupado, intente nuevamente')
 
-    print(f"Conectando a {host}:{port} ...")
+        if not respuesta_completa:
+            medicion.error = "vacia"
+            return _sin_respuesta('No se recibió respuesta')
 
+        return _decodificar(respuesta_completa, procesar_items, medicion)
+    except Exception as e:
+        logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+        medicion.error = "conexion"
+        return _sin_respuesta(str(e))
+    finally:
+        _registrar(medicion, host, port)
+        terminar_comando(contexto_log)
+
+
+def enviar_secuencia_tcp(mensajes, request=None, ip_custom=None, puerto_custom=None, protocolo=None):
+    """
+    Envía varios comandos seguidos y devuelve la lista de respuestas en el mismo orden.
+
+    Con keepalive todos viajan por una única conexión del pool (un comando,
+    su respuesta, el siguiente...). Sin keepalive cada comando usa su propia
+    conexión, como enviar_consulta_tcp.
+    """
+    if not TCP_ENABLED:
+        return [{"estado": False, "mensaje": "Servicio no disponible"} for _ in mensajes]
+
+    host, port, protocolo = _resolver_destino(request, ip_custom, puerto_custom, protocolo)
+    if not host:
+        return [{"estado": False, "mensaje": "No hay cliente configurado"} for _ in mensajes]
+
+    if not (protocolo.get('keepalive') and protocolo.get('framing')):
+        return [enviar_consulta_tcp(m, ip_custom=host, puerto_custom=port, protocolo=protocolo) for m in mensajes]
+    if not circuito.permitir(host, port):
+        return [_circuito_abierto() for _ in mensajes]
+
+    logger.debug("Conectando a %s:%s ... (secuencia de %d comandos)", host, port, len(mensajes))
+
+    # Una medición por toda la secuencia (etiquetada con el comando del primer mensaje)
+    medicion = Medicion(mensajes[0].get("Comando") if mensajes else None, "secuencia")
+    respuestas = []
     try:
-        contenido = json.dumps(mensaje_dict, ensure_ascii=False)
-        contenido = encriptar(contenido)
-
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(TCP_TIMEOUT)
-            s.connect((host, port))
-            s.sendall(contenido.encode('latin-1', errors='replace'))
-
-            # Leer la respuesta completa en chunks hasta que no haya más datos
-            respuesta_completa = b''
-            MAX_SIZE = 1024 * 1024  # Límite de 1MB para evitar respuestas infinitas
-
-            while len(respuesta_completa) < MAX_SIZE:
-                try:
-                    # Después del primer chunk, usar timeout más corto para detectar fin de transmisión
-                    if respuesta_completa:
-                        s.settimeout(1.5)  # 1.5 segundos para chunks subsiguientes (más generoso)
-
-                    chunk = s.recv(4096)
-                    if not chunk:
-                        print(f"📭 Recibido chunk vacío. Total acumulado: {len(respuesta_completa)} bytes")
-                        break
-
-                    print(f"📦 Chunk recibido: {len(chunk)} bytes. Total: {len(respuesta_completa) + len(chunk)} bytes")
-                    respuesta_completa += chunk
-
-                    # NO asumir que es el último solo porque es < 4096
-                    # Seguir intentando leer hasta timeout o chunk vacío
-                except socket.timeout:
-                    # Timeout esperando más datos - asumimos que ya terminó la transmisión
-                    print(f"⏱️ Timeout. Bytes acumulados: {len(respuesta_completa)}")
-                    if respuesta_completa:
-                        break
-                    else:
-                        return {'estado': False, 'mensaje': 'Timeout esperando respuesta'}
+        s, _ = _obtener_medida(host, port, medicion)
+    except Exception as e:
+        logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+        medicion.error = "pool_agotado" if isinstance(e, PoolAgotado) else "conexion"
+        _registrar(medicion, host, port)
+        return [_sin_respuesta(str(e)) for _ in mensajes]
+
+    reutilizable = False
+    medida = _SocketMedido(s, medicion)
+    contexto_log = iniciar_comando(medicion.comando)
+    try:
+        for mensaje_dict in mensajes:
+            medida.sendall(enmarcar_solicitud(_preparar_solicitud(mensaje_dict, protocolo)))
+            respuesta_completa = recibir_respuesta(medida, protocolo)
+            medicion.fin_lectura = time.perf_counter()
+            if not respuesta_completa:
+                raise ConnectionError("No se recibió respuesta")
+            respuestas.append(_decodificar(respuesta_completa, None, medicion))
+        reutilizable = True
+    except socket.timeout:
+        medicion.error = "timeout"
+        respuestas.append(_sin_respuesta('Timeout esperando respuesta'))
+    except RespuestaDemasiadoGrande as e:
+        logger.warning("Respuesta muy grande: %s bytes", e)
+        medicion.error = "demasiado_grande"
+        respuestas.append({'estado': False, 'mensaje': 'Respuesta demasiado grande'})
+    except Exception as e:
+        logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+        medicion.error = "conexion"
+        respuestas.append(_sin_respuesta(str(e)))
+    finally:
+        pool.devolver(host, port, s, reutilizable=reutilizable)
+        _registrar(medicion, host, port)
+        terminar_comando(contexto_log)
+
+    # Los comandos que no llegaron a enviarse se informan como no procesados
+    while len(respuestas) < len(mensajes):
+        respuestas.append(_sin_respuesta("No procesado: se interrumpió la conexión"))
+    return respuestas
+
+
+def _enviar_pipeline(host, port, mensajes, protocolo):
+    """
+    Pipelining sobre una conexión del pool: escribe todas las solicitudes
+    (cada una con su IdMensaje) y después lee las respuestas. Se asocian por
+    IdMensaje si el servidor lo devuelve, o por orden de llegada si no.
+    """
+    datos = b''.join(
+        enmarcar_solicitud(_preparar_solicitud({**m, "IdMensaje": i}, protocolo))
+        for i, m in enumerate(mensajes)
+    )
 
+    # Una medición por todo el pipeline (primer byte: el de la primera respuesta)
+    medicion = Medicion(mensajes[0].get("Comando"), "pipeline")
+    respuestas = [None] * len(mensajes)
+    try:
+        s, _ = _obtener_medida(host, port, medicion)
+    except Exception as e:
+        medicion.error = "pool_agotado" if isinstance(e, PoolAgotado) else "conexion"
+        _registrar(medicion, host, port)
+        raise
+    reutilizable = False
+    error = None
+    medida = _SocketMedido(s, medicion)
+    contexto_log = iniciar_comando(medicion.comando)
+    try:
+        medida.sendall(datos)
+        for orden in range(len(mensajes)):
+            respuesta_completa = recibir_respuesta(medida, protocolo)
+            medicion.fin_lectura = time.perf_counter()
             if not respuesta_completa:
-                return {'estado': False, 'mensaje': 'No se recibió respuesta'}
+                raise ConnectionError("No se recibió respuesta")
+            respuesta = _decodificar(respuesta_completa, None, medicion)
+            id_mensaje = respuesta.get("IdMensaje", orden) if isinstance(respuesta, dict) else orden
+            if not isinstance(id_mensaje, int) or not 0 <= id_mensaje < len(mensajes) or respuestas[id_mensaje] is not None:
+                id_mensaje = orden
+            respuestas[id_mensaje] = respuesta
+        reutilizable = True
+    except socket.timeout:
+        medicion.error = "timeout"
+        error = _sin_respuesta('Timeout esperando respuesta')
+    except RespuestaDemasiadoGrande as e:
+        logger.warning("Respuesta muy grande: %s bytes", e)
+        medicion.error = "demasiado_grande"
+        error = {'estado': False, 'mensaje': 'Respuesta demasiado grande'}
+    except Exception as e:
+        logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+        medicion.error = "conexion"
+        error = _sin_respuesta(str(e))
+    finally:
+        pool.devolver(host, port, s, reutilizable=reutilizable)
+        _registrar(medicion, host, port)
+        terminar_comando(contexto_log)
+
+    # Todos los comandos ya fueron enviados: sin respuesta su resultado es desconocido
+    return [r if r is not None else dict(error) for r in respuestas]
+
+
+def enviar_consultas_tcp(mensajes, request=None, ip_custom=None, puerto_custom=None, protocolo=None):
+    """
+    Envía varios comandos al mismo servidor VFP y devuelve sus respuestas en el
+    mismo orden que 'mensajes'.
+
+    - keepalive + framing "longitud": pipelining sobre una única conexión.
+    - keepalive con otro framing: secuencia sobre una única conexión.
+    - sin keepalive: una conexión por comando.
+    """
+    if not TCP_ENABLED:
+        return [{"estado": False, "mensaje": "Servicio no disponible"} for _ in mensajes]
+
+    host, port, protocolo = _resolver_destino(request, ip_custom, puerto_custom, protocolo)
+    if not host:
+        return [{"estado": False, "mensaje": "No hay cliente configurado"} for _ in mensajes]
+
+    if protocolo.get('keepalive') and protocolo.get('framing') == "longitud" and len(mensajes) > 1:
+        if not circuito.permitir(host, port):
+            return [_circuito_abierto() for _ in mensajes]
+        logger.debug("Conectando a %s:%s ... (pipeline de %d comandos)", host, port, len(mensajes))
+        try:
+            return _enviar_pipeline(host, port, mensajes, protocolo)
+        except PoolAgotado as e:
+            logger.warning(str(e))
+            return [_sin_respuesta('Servidor ocupado, intente nuevamente') for _ in mensajes]
+        except Exception as e:
+            logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+            return [_sin_respuesta(str(e)) for _ in mensajes]
+
+    return enviar_secuencia_tcp(mensajes, ip_custom=host, puerto_custom=port, protocolo=protocolo)
+
+
+# ============ CLIENTE ASYNCIO ============
+
+async def _leer_hasta_timeout_async(reader, inicial=b''):
+    """Equivalente async de _leer_hasta_timeout"""
+    buffer = bytearray(inicial)
+    timeout = TCP_TAIL_TIMEOUT if buffer else TCP_TIMEOUT
+    while len(buffer) < MAX_SIZE:
+        try:
+            chunk = await asyncio.wait_for(reader.read(min(TCP_CHUNK_SIZE, MAX_SIZE - len(buffer))), timeout)
+        except asyncio.TimeoutError:
+            if buffer:
+                break
+            raise
+        if not chunk:
+            break
+        buffer += chunk
+        # Después del primer chunk, usar timeout más corto para detectar fin de transmisión
+        timeout = TCP_TAIL_TIMEOUT
 
-            if len(respuesta_completa) >= MAX_SIZE:
-                logger.warning(f"Respuesta muy grande: {len(respuesta_completa)} bytes")
-                return {'estado': False, 'mensaje': 'Respuesta demasiado grande'}
+    if len(buffer) >= MAX_SIZE:
+        raise RespuestaDemasiadoGrande(len(buffer))
+    return buffer
 
-            # CRÍTICO: Convertir bytes a string con latin-1, desencriptar, luego decodificar JSON
-            print(f"📏 Total de bytes recibidos antes de desencriptar: {len(respuesta_completa)}")
 
-            respuesta_str_encriptada = respuesta_completa.decode('latin-1')
-            respuesta_desencriptada = desencriptar(respuesta_str_encriptada)
+async def recibir_respuesta_async(reader, protocolo):
+    """Equivalente async de recibir_respuesta sobre un asyncio.StreamReader"""
+    framing = protocolo.get('framing')
+
+    if framing == "longitud":
+        try:
+            header = await asyncio.wait_for(reader.readexactly(LONGITUD_HEADER), TCP_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            header = e.partial
+        if len(header) < LONGITUD_HEADER or not header.isdigit():
+            logger.warning("Header de longitud inválido %r, usando lectura por timeout", header)
+            return await _leer_hasta_timeout_async(reader, header)
+
+        longitud = int(header)
+        if longitud >= MAX_SIZE:
+            raise RespuestaDemasiadoGrande(longitud)
+        try:
+            return await asyncio.wait_for(reader.readexactly(longitud), TCP_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            logger.warning("Conexión cerrada antes de completar el payload: %d/%s bytes", len(e.partial), longitud)
+            return e.partial
+
+    if framing == "terminador":
+        try:
+            datos = await asyncio.wait_for(reader.readuntil(bytes([protocolo.get('terminador', 0)])), TCP_TIMEOUT)
+            return datos[:-1]
+        except asyncio.IncompleteReadError as e:
+            logger.warning("Conexión cerrada sin terminador. Bytes acumulados: %d", len(e.partial))
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            raise RespuestaDemasiadoGrande(e.consumed)
+
+    return await _leer_hasta_timeout_async(reader)
+
+
+async def enviar_consulta_tcp_async(mensaje_dict, request=None, ip_custom=None, puerto_custom=None, protocolo=None,
+                                    procesar_items=None):
+    """
+    Versión asyncio de enviar_consulta_tcp (para las vistas async bajo ASGI).
+    Mismo protocolo y mismas respuestas de error; usa una conexión nueva por consulta.
+    Las respuestas de más de TCP_DECODIFICAR_EN_THREAD se decodifican fuera del event loop.
+    """
+
+    if not TCP_ENABLED:
+        return {"estado": False, "mensaje": "Servicio no disponible"}
+
+    host, port, protocolo = _resolver_destino(request, ip_custom, puerto_custom, protocolo)
+    if not host:
+        return {"estado": False, "mensaje": "No hay cliente configurado"}
+    if not circuito.permitir(host, port):
+        return _circuito_abierto()
+
+    logger.debug("Conectando (async) a %s:%s ...", host, port)
+
+    # Sin primer byte ni cola: el StreamReader no expone cuándo llega cada chunk
+    medicion = Medicion(mensaje_dict.get("Comando"), "async")
+    contexto_log = iniciar_comando(medicion.comando)
+    writer = None
+    try:
+        datos = _preparar_solicitud(mensaje_dict, protocolo)
+        if protocolo.get('keepalive') and protocolo.get('framing'):
+            # El servidor espera solicitudes enmarcadas en conexiones keep-alive
+            datos = enmarcar_solicitud(datos)
+
+        try:
+            inicio = time.perf_counter()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, limit=MAX_SIZE + 1), TCP_TIMEOUT
+            )
+            medicion.conectado(inicio)
+            writer.write(datos)
+            await writer.drain()
+            medicion.enviado_ahora(len(datos))
+            respuesta_completa = await recibir_respuesta_async(reader, protocolo)
+            medicion.bytes_recibidos = len(respuesta_completa)
+        except asyncio.TimeoutError:
+            medicion.error = "timeout"
+            return _sin_respuesta('Timeout esperando respuesta')
+        except RespuestaDemasiadoGrande as e:
+            logger.warning("Respuesta muy grande: %s bytes", e)
+            medicion.error = "demasiado_grande"
+            return {'estado': False, 'mensaje': 'Respuesta demasiado grande'}
 
-            print(f"🔓 Respuesta desencriptada (primeros 200 chars): {respuesta_desencriptada[:200]}")
-            print(f"🔓 Respuesta desencriptada (últimos 50 chars): {respuesta_desencriptada[-50:]}")
+        if not respuesta_completa:
+            medicion.error = "vacia"
+            return _sin_respuesta('No se recibió respuesta')
 
-            try:
-                return json.loads(respuesta_desencriptada)
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Error parseando JSON: {e}")
-                logger.error(f"📄 Respuesta desencriptada (primeros 500 chars): {repr(respuesta_desencriptada[:500])}")
-                logger.error(f"📄 Respuesta desencriptada (últimos 100 chars): {repr(respuesta_desencriptada[-100:])}")
-                return {"estado": False, "mensaje": "Respuesta inválida"}
+        if len(respuesta_completa) > TCP_DECODIFICAR_EN_THREAD:
+            # to_thread copia el contexto: los logs del parseo conservan el comando
+            return await asyncio.to_thread(_decodificar, respuesta_completa, procesar_items, medicion)
+        return _decodificar(respuesta_completa, procesar_items, medicion)
     except Exception as e:
-        print("ERROR TCP:", repr(e))
-        return {"estado": False, "mensaje": str(e)}
+        logger.warning("ERROR TCP con %s:%s: %r", host, port, e)
+        medicion.error = "conexion"
+        return _sin_respuesta(str(e))
+    finally:
+        _registrar(medicion, host, port)
+        terminar_comando(contexto_log)
+        if writer is not None:
+            writer.close()
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import pickle
+import queue
+from datetime import datetime
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+from unittest import mock as umock
 
-# Create your tests here.
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import diferido, json_incremental, logs, metricas, mock, services, tcp_client, views
+from .algoritmoEncriptacionCasero import (
+    encriptar, desencriptar, encriptar_bytes, desencriptar_bytes, texto_a_bytes, CLAVES
+)
+from .__init__ import TCP_TAIL_TIMEOUT
+from .cache import BackendMemoria, CachePendientes, cache_tokens
+from .circuito import Cortacircuitos, EstadoArchivo, EstadoMemoria
+from .idempotencia import AlmacenIdempotencia, almacen_idempotencia, COMPLETADO, INCIERTO
+from .models import RegistroDiferido, RegistroIdempotente
+from .normalizacion import Esquema
+from .pendientes import Pendiente, indice_de
+from .pool_tcp import PoolAgotado, PoolConexiones, pool
+from .tcp_client import enviar_consulta_tcp, enviar_consulta_tcp_async, enviar_consultas_tcp
+
+
+MENSAJE_TOKEN = {
+    "Comando": "verificarToken",
+    "Token": "test_token",
+    "Vista": "CONTROLSTOCK",
+    "Version": 1
+}
+
+
+class CifradoBytesTests(SimpleTestCase):
+    """Las variantes sobre bytes deben ser idénticas al algoritmo original"""
+
+    TEXTOS = [
+        "".join(chr(i) for i in range(256)),
+        '{"Comando": "verificarToken", "Token": "123abc", "Nombre": "Juan Pérez Ñandú"}',
+        "Precio € 10 – “oferta”",  # caracteres fuera de latin-1
+        "",
+    ]
+
+    def test_encriptar_identico(self):
+        for clave in CLAVES:
+            for texto in self.TEXTOS:
+                with umock.patch.object(random, "randint", return_value=clave):
+                    esperado = encriptar(texto).encode('latin-1')
+                self.assertEqual(encriptar_bytes(texto_a_bytes(texto), clave), esperado)
+
+    def test_desencriptar_identico(self):
+        datos = bytes(range(256)) * 4
+        for clave in range(256):
+            cifrado = datos + bytes([clave])
+            esperado = desencriptar(cifrado).encode('latin-1')
+            self.assertEqual(desencriptar_bytes(cifrado), esperado)
+            self.assertEqual(desencriptar_bytes(bytearray(cifrado)), esperado)
+            self.assertEqual(desencriptar_bytes(memoryview(cifrado)), esperado)
+
+
+class DecodificacionPorBloquesTests(SimpleTestCase):
+    """Desencriptado y parseo por bloques: mismo resultado que el camino completo"""
+
+    RESPUESTA = {
+        "Estado": "T",
+        "Mensaje": "Depósito \"Ñandú\" [norte]",
+        "Pendientes": [[f"SOL{i:05d}", f"PROD{i}", "Tornillo ]}, 1/4", "20241201"] for i in range(500)]
+                      + [{"IdSolicitud": "SOLX", "Codigo": "C", "Descripcion": "D", "Fecha": ""}, ["incompleto"]],
+        "VersionPendientes": 123456,
+    }
+
+    def test_identico_a_json_loads(self):
+        datos = encriptar_bytes(texto_a_bytes(json.dumps(self.RESPUESTA, ensure_ascii=False)))
+        esperado = services._procesar_controlPendientes(tcp_client._decodificar_json(datos), "t", None)
+        for tamanio in (1, 7, 1000):
+            with umock.patch.object(tcp_client, "TCP_CHUNK_SIZE", tamanio):
+                decodificado = tcp_client._decodificar_json_por_bloques(datos, services._ITEMS_PENDIENTES)
+            resultado = services._procesar_controlPendientes(decodificado, "t", None, normalizado=True)
+            self.assertEqual(resultado["pendientes"], esperado["pendientes"])
+            self.assertEqual(resultado["mensaje"], esperado["mensaje"])
+            self.assertEqual(resultado["version"], 123456)
+
+    def test_valor_grande_no_recorrido_se_parsea_una_vez(self):
+        respuesta = {"Estado": "T", "Eliminados": [f"SOL{i:05d}" for i in range(20000)],
+                     "Agregados": [{"IdSolicitud": "SOL1", "Mensaje": "}"}]}
+        texto = json.dumps(respuesta)
+        fragmentos = [texto[i:i + 64] for i in range(0, len(texto), 64)]
+        with umock.patch.object(json_incremental._decoder, "raw_decode",
+                                wraps=json_incremental._decoder.raw_decode) as decodificar:
+            resultado = json_incremental.leer_objeto(iter(fragmentos), {"agregados": lambda item: item})
+        self.assertEqual(resultado, respuesta)
+        self.assertLess(decodificar.call_count, 20)
+
+    def test_json_invalido(self):
+        datos = encriptar_bytes(b'{"Estado": "T", "Pendientes": [["SOL1", "A"')
+        respuesta = tcp_client._decodificar_json_por_bloques(datos, services._ITEMS_PENDIENTES)
+        self.assertEqual(respuesta, {"estado": False, "mensaje": "Respuesta inválida"})
+
+
+class EsquemaNormalizacionTests(SimpleTestCase):
+
+    def test_prioridad_y_defaults(self):
+        item = {"ID": "X", "IdSolicitud": "SOL1", "CODIGO": "P1", "Fecha": "20241201"}
+        self.assertEqual(services._normalizar_item(item), Pendiente("SOL1", "P1", "", "01/12/2024"))
+
+    def test_plan_cacheado_por_claves(self):
+        esquema = Esquema({"estado": ("Estado", "estado")})
+        self.assertIs(esquema.plan({"Estado": "T", "x": 1}), esquema.plan({"Estado": "F", "x": 2}))
+        self.assertIsNot(esquema.plan({"Estado": "T"}), esquema.plan({"estado": "T"}))
+        self.assertEqual(esquema.normalizar({"otro": 1}), {"estado": None})
+
+    def test_verificar_token_acepta_variantes(self):
+        resultado = services._procesar_verificarToken(
+            {"Estado": "T", "Usuario": "admin", "Nombre": "Admin"}, "t", None, None)
+        self.assertEqual(resultado, {"estado": True, "usuario": "admin", "nombre": "Admin", "mensaje": "", "token": ""})
+        resultado = services._procesar_verificarToken({"estado": False}, "t", None, None)
+        self.assertEqual(resultado, {"estado": False, "mensaje": "Token inválido"})
+
+
+class FormatearFechaTests(SimpleTestCase):
+    """El formateo por forma tiene que dar lo mismo que la versión con strptime"""
+
+    def casos(self):
+        aleatorio = random.Random(13)
+        casos = ["", "   ", "sin fecha", "2024-1-5", "2024121", " 20241201 ", "01/12/2024", "99/99/9999",
+                 "20240229", "20230229", "20241301", "20241200", "00001201", "09991201", "2024-12-01T24:00:00",
+                 "2024-12-01T23:59:60", "2024-12-01T14:30:00", "2024-12-01 14:30:00", "2024-12/01",
+                 "２０２４１２０１", "2024²201", "1-12-2024", "31-04-2024", 20241201]
+        for _ in range(2000):
+            anio, mes, dia = aleatorio.randint(900, 2100), aleatorio.randint(0, 13), aleatorio.randint(0, 32)
+            casos += [f"{anio:04d}{mes:02d}{dia:02d}", f"{anio:04d}-{mes:02d}-{dia:02d}",
+                      f"{anio:04d}/{mes:02d}/{dia:02d}", f"{dia:02d}-{mes:02d}-{anio:04d}",
+                      f"{anio:04d}-{mes:02d}-{dia:02d}T{aleatorio.randint(0, 25):02d}:"
+                      f"{aleatorio.randint(0, 61):02d}:{aleatorio.randint(0, 61):02d}"]
+        return casos
+
+    def test_identico_a_strptime(self):
+        for caso in self.casos():
+            self.assertEqual(services.formatear_fecha(caso), services._formatear_fecha_strptime(caso), caso)
+
+    def test_datetime(self):
+        self.assertEqual(services.formatear_fecha(datetime(2024, 12, 1, 14, 30)), "01/12/2024")
+
+
+class PendienteColumnasTests(SimpleTestCase):
+
+    PENDIENTES = [Pendiente("SOL1", "P1", "Tornillo", "01/12/2024"), Pendiente("SOL2", "P2", "Tuerca", "")]
+
+    def test_respuesta_columnar(self):
+        respuesta = {"estado": True, "mensaje": "", "deposito": "DEP1", "version": 3, "pendientes": self.PENDIENTES}
+        datos = json.loads(views._respuesta_pendientes(respuesta, formato="columnas").content)
+        self.assertEqual(datos["formato"], "columnas")
+        self.assertEqual(datos["pendientes"], {"id": ["SOL1", "SOL2"], "codigo": ["P1", "P2"],
+                                               "descripcion": ["Tornillo", "Tuerca"], "fecha": ["01/12/2024", ""]})
+        # Sin negociar se mantiene el formato anterior
+        datos = json.loads(views._respuesta_pendientes(respuesta).content)
+        self.assertEqual(datos["pendientes"][1], {"idSolicitud": "SOL2", "codigo": "P2", "descripcion": "Tuerca", "fecha": ""})
+
+    def test_pickle_para_cache_django(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.PENDIENTES)), self.PENDIENTES)
+        self.assertFalse(hasattr(self.PENDIENTES[0], "__dict__"))
+
+
+class FramingRespuestaTests(SimpleTestCase):
+    """Latencia del cliente TCP contra un mock que deja la conexión abierta"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background(mantener_conexion=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def consultar(self, protocolo):
+        inicio = time.perf_counter()
+        respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1',
+                                        puerto_custom=self.puerto, protocolo=protocolo)
+        return respuesta, time.perf_counter() - inicio
+
+    def test_framing_longitud_no_espera_timeout(self):
+        respuesta, duracion = self.consultar({'framing': 'longitud', 'terminador': 0})
+        self.assertIs(respuesta["estado"], True)
+        self.assertEqual(respuesta["usuario"], "admin")
+        self.assertLess(duracion, TCP_TAIL_TIMEOUT / 2)
+
+    def test_framing_terminador_no_espera_timeout(self):
+        respuesta, duracion = self.consultar({'framing': 'terminador', 'terminador': 0})
+        self.assertIs(respuesta["estado"], True)
+        self.assertLess(duracion, TCP_TAIL_TIMEOUT / 2)
+
+    def test_framing_terminador_con_texto_no_ascii(self):
+        # º, ¿, ñ... encriptados con algunas claves dan el byte 0 si viajan sin escapar
+        pendientes = [[f"SOL{i:03d}", "PROD¿Ñ", "Caño Nº 3 ¿?", "20241201"] for i in range(50)]
+        mensaje = {"Comando": "controlPendientes", "Token": "test_token", "Vista": "CONTROLSTOCK",
+                   "UsrActivo": "Peña º"}
+        protocolo = {'framing': 'terminador', 'terminador': 0}
+        with umock.patch.object(mock, "PENDIENTES_MOCK", pendientes):
+            for clave in CLAVES:
+                with umock.patch.object(random, "randint", return_value=clave):
+                    respuesta = enviar_consulta_tcp(mensaje, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                                                    protocolo=protocolo)
+                self.assertEqual(respuesta.get("pendientes"), pendientes, clave)
+
+    def test_cliente_async_con_framing(self):
+        inicio = time.perf_counter()
+        respuesta = asyncio.run(enviar_consulta_tcp_async(
+            MENSAJE_TOKEN, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+            protocolo={'framing': 'longitud', 'terminador': 0}
+        ))
+        self.assertIs(respuesta["estado"], True)
+        self.assertLess(time.perf_counter() - inicio, TCP_TAIL_TIMEOUT / 2)
+
+    def test_cliente_async_decodifica_respuestas_grandes_en_thread(self):
+        pendientes = [[f"SOL{i:05d}", f"PROD{i}", "Tornillo", "20241201"] for i in range(3000)]
+        hilos = []
+        real = tcp_client._decodificar
+
+        def decodificar(*args):
+            hilos.append(threading.current_thread())
+            return real(*args)
+
+        mensaje = services._mensaje_controlPendientes("test_token", "admin")
+        for pedido, esperado in ((mensaje, 3000), (MENSAJE_TOKEN, None)):
+            with umock.patch.object(mock, "PENDIENTES_MOCK", pendientes), \
+                    umock.patch.object(tcp_client, "_decodificar", side_effect=decodificar):
+                respuesta = asyncio.run(enviar_consulta_tcp_async(
+                    pedido, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                    protocolo={'framing': 'longitud', 'terminador': 0}, procesar_items=None))
+            self.assertIs(respuesta["estado"], True)
+            if esperado:
+                self.assertEqual(len(respuesta["pendientes"]), esperado)
+        # La lista grande fuera del event loop; verificarToken (chica) en el mismo thread
+        self.assertIsNot(hilos[0], threading.main_thread())
+        self.assertIs(hilos[-1], threading.main_thread())
+
+    def test_sin_framing_usa_timeout_como_fallback(self):
+        respuesta, duracion = self.consultar({'framing': None, 'terminador': 0})
+        self.assertIs(respuesta["estado"], True)
+        self.assertGreaterEqual(duracion, TCP_TAIL_TIMEOUT)
+
+
+class MockVFPTests(SimpleTestCase):
+    """Mock VFP para pruebas de carga: mensajes grandes, perfiles de falla, datasets y estado"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def test_mensaje_sin_framing_en_varios_segmentos(self):
+        mensaje = dict(MENSAJE_TOKEN, Relleno="x" * 20000)
+        datos = encriptar_bytes(texto_a_bytes(json.dumps(mensaje)))
+        with socket.create_connection(("127.0.0.1", self.puerto), timeout=5) as s:
+            s.sendall(datos[:1000])
+            time.sleep(0.05)
+            s.sendall(datos[1000:])
+            respuesta = b""
+            while True:
+                parte = s.recv(4096)
+                if not parte:
+                    break
+                respuesta += parte
+        self.assertEqual(json.loads(desencriptar_bytes(respuesta).decode('latin-1'))["usuario"], "admin")
+
+    def consultar(self, mensaje):
+        return enviar_consulta_tcp(mensaje, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                                   protocolo={'framing': 'longitud', 'terminador': 0})
+
+    def test_perfil_de_fallas(self):
+        perfil = mock.Perfil(prob_error=1.0, comandos={"verificartoken"})
+        with umock.patch.object(mock, "PERFIL", perfil):
+            self.assertEqual(self.consultar(MENSAJE_TOKEN)["mensaje"], "Error simulado de VFP")
+        with umock.patch.object(mock, "PERFIL", mock.Perfil(prob_corte=1.0)):
+            self.assertEqual(self.consultar(MENSAJE_TOKEN)["mensaje"], "No se recibió respuesta")
+        with umock.patch.object(mock, "PERFIL", mock.Perfil(latencia=0.1)):
+            inicio = time.perf_counter()
+            self.assertTrue(self.consultar(MENSAJE_TOKEN)["estado"])
+            self.assertGreaterEqual(time.perf_counter() - inicio, 0.1)
+
+    def test_dataset_generado(self):
+        pendientes = mock.generar_pendientes(5000, semilla=3)
+        self.assertEqual(len({p[0] for p in pendientes}), 5000)
+        self.assertEqual(pendientes, mock.generar_pendientes(5000, semilla=3))
+        self.assertLess(len({p[1] for p in pendientes}), 5000)
+
+    def test_registros_concurrentes(self):
+        pendientes = mock.generar_pendientes(400)
+        with umock.patch.object(mock, "PENDIENTES_MOCK", list(pendientes)), \
+                umock.patch.object(mock, "STOCKS_CONTROLADOS", []), \
+                umock.patch.object(mock, "VERBOSO", False):
+            hilos = [threading.Thread(target=lambda parte=pendientes[i::8]: [
+                mock.registrar_control(p[0], 1, "admin") for p in parte]) for i in range(8)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            self.assertEqual(mock.PENDIENTES_MOCK, [])
+            self.assertEqual(len(mock.STOCKS_CONTROLADOS), 400)
+
+
+class PoolConexionesTests(SimpleTestCase):
+    """Reutilización de conexiones con servidores que soportan keep-alive"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        pool.cerrar_todo()
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def test_reutiliza_conexion_con_keepalive(self):
+        protocolo = {'framing': 'longitud', 'terminador': 0, 'keepalive': True}
+        creadas = pool.estadisticas["creadas"]
+        reutilizadas = pool.estadisticas["reutilizadas"]
+
+        for _ in range(3):
+            respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1',
+                                            puerto_custom=self.puerto, protocolo=protocolo)
+            self.assertIs(respuesta["estado"], True)
+
+        self.assertEqual(pool.estadisticas["creadas"] - creadas, 1)
+        self.assertEqual(pool.estadisticas["reutilizadas"] - reutilizadas, 2)
+
+    def test_cerrar_todo_con_conexiones_prestadas(self):
+        local = PoolConexiones(max_por_host=1, espera_checkout=0.05)
+        s, _ = local.obtener('127.0.0.1', self.puerto)
+        local.cerrar_todo()
+        # La prestada sigue contando para el límite y al devolverla se cierra
+        with self.assertRaises(PoolAgotado):
+            local.obtener('127.0.0.1', self.puerto)
+        local.devolver('127.0.0.1', self.puerto, s)
+        self.assertEqual(s.fileno(), -1)
+        s, reutilizada = local.obtener('127.0.0.1', self.puerto)
+        self.assertFalse(reutilizada)
+        local.devolver('127.0.0.1', self.puerto, s)
+        self.assertEqual(local._hosts[('127.0.0.1', self.puerto)].en_uso, 0)
+        local.cerrar_todo()
+
+    def test_solo_reintenta_comandos_de_lectura(self):
+        protocolo = {'framing': 'longitud', 'terminador': 0, 'keepalive': True}
+        registro = {"Comando": "RegistrarStockControlado", "Token": "test_token", "Vista": "CONTROLSTOCK",
+                    "UsrActivo": "admin", "idSolicitud": "SOL001", "cantidad": 1}
+        real = tcp_client.recibir_respuesta
+
+        def enviar_con_conexion_cerrada(mensaje):
+            # Deja una conexión en el pool; la primera lectura "la encuentra cerrada"
+            # (la conexión se descarta con la respuesta sin leer) y las siguientes son reales
+            enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1', puerto_custom=self.puerto, protocolo=protocolo)
+            lecturas = []
+
+            def recibir(s, protocolo):
+                lecturas.append(s)
+                return b'' if len(lecturas) == 1 else real(s, protocolo)
+
+            with umock.patch.object(tcp_client, "recibir_respuesta", side_effect=recibir), \
+                    umock.patch.object(mock, "PENDIENTES_MOCK", [["SOL001", "PROD001", "Tornillo", "20241201"]]):
+                respuesta = enviar_consulta_tcp(mensaje, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                                                protocolo=protocolo)
+            return respuesta, len(lecturas)
+
+        # verificarToken es de solo lectura: se reintenta con una conexión nueva y responde
+        respuesta, lecturas = enviar_con_conexion_cerrada(MENSAJE_TOKEN)
+        self.assertEqual(lecturas, 2)
+        self.assertIs(respuesta["estado"], True)
+        self.assertFalse(tcp_client.es_sin_respuesta(respuesta))
+
+        # El registro ya enviado no se reenvía: vuelve sin respuesta (el reintento lo verifica)
+        respuesta, lecturas = enviar_con_conexion_cerrada(registro)
+        self.assertEqual(lecturas, 1)
+        self.assertTrue(tcp_client.es_sin_respuesta(respuesta))
+
+
+class CacheTokensTests(SimpleTestCase):
+
+    def setUp(self):
+        cache_tokens.backend.clear()
+        self.request = RequestFactory().get('/')
+        self.request.COOKIES.update({'empresa_ip': '10.0.0.1', 'empresa_puerto': '5555'})
+
+    def test_lru_y_expiracion(self):
+        backend = BackendMemoria(max_entradas=2)
+        backend.set("a", 1, 60)
+        backend.set("b", 2, 60)
+        backend.get("a")
+        backend.set("c", 3, 60)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), 1)
+        backend.set("d", 4, -1)
+        self.assertIsNone(backend.get("d"))
+
+    def test_verificar_token_usa_cache_hasta_invalidar(self):
+        respuesta_vfp = {"estado": True, "usuario": "admin", "nombre": "Admin", "mensaje": "", "token": "t"}
+        with umock.patch.object(services, "enviar_consulta_tcp", return_value=respuesta_vfp) as consulta:
+            services.comando_verificarToken("t", self.request)
+            resultado = services.comando_verificarToken("t", self.request)
+            self.assertEqual(consulta.call_count, 1)
+            self.assertEqual(resultado["usuario"], "admin")
+
+            services.invalidar_token("t", self.request)
+            services.comando_verificarToken("t", self.request)
+            self.assertEqual(consulta.call_count, 2)
+
+    def test_estado_false_no_se_cachea(self):
+        with umock.patch.object(services, "enviar_consulta_tcp", return_value={"estado": False}) as consulta:
+            services.comando_verificarToken("t", self.request)
+            services.comando_verificarToken("t", self.request)
+            self.assertEqual(consulta.call_count, 2)
+
+
+class CachePendientesTests(SimpleTestCase):
+
+    RESPUESTA = {"estado": True, "deposito": "DEP1", "mensaje": "", "pendientes": [{"idSolicitud": "SOL1"}]}
+
+    def setUp(self):
+        self.cache = CachePendientes(backend=BackendMemoria(100), ttl_fresco=60, ttl_maximo=120)
+        self.cargar = umock.Mock(return_value=dict(self.RESPUESTA))
+
+    def test_hit_y_miss(self):
+        self.cache.obtener("t", "h", 1, "u", self.cargar)
+        self.cache.obtener("t", "h", 1, "u", self.cargar)
+        self.assertEqual(self.cargar.call_count, 1)
+        self.assertEqual(self.cache.estadisticas["misses"], 1)
+        self.assertEqual(self.cache.estadisticas["hits"], 1)
+
+    def test_stale_sirve_cache_y_refresca(self):
+        self.cache.ttl_fresco = 0
+        self.cache.obtener("t", "h", 1, "u", self.cargar)
+        respuesta = self.cache.obtener("t", "h", 1, "u", self.cargar)
+        self.assertEqual(respuesta["pendientes"], self.RESPUESTA["pendientes"])
+        self.assertEqual(self.cache.estadisticas["stale"], 1)
+        for _ in range(100):
+            if self.cache.estadisticas["refrescos"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.cargar.call_count, 2)
+
+    def test_refresco_iniciado_antes_de_invalidar_no_se_guarda(self):
+        self.cache.ttl_fresco = 0
+        self.cache.obtener("t", "h", 1, "u", self.cargar)
+        seguir = threading.Event()
+        vieja = dict(self.RESPUESTA, pendientes=[{"idSolicitud": "SOL1"}, {"idSolicitud": "SOL2"}])
+
+        def cargar_lento(base):
+            seguir.wait(2)
+            return vieja
+
+        self.cache.obtener("t", "h", 1, "u", cargar_lento)  # Stale: arranca el refresco
+        self.cache.invalidar("t", "h", 1, "u")  # Se registró un control mientras VFP respondía
+        seguir.set()
+        for _ in range(200):
+            if not self.cache._refrescando:
+                break
+            time.sleep(0.01)
+        self.assertFalse(self.cache._refrescando)
+        self.assertEqual(self.cache.estadisticas["refrescos"], 0)
+        self.assertTrue(self.cache.backend.get(self.cache._clave("t", "h", 1, "u"))["invalidada"])
+
+    def test_invalidar_afecta_todo_el_deposito(self):
+        self.cache.obtener("t1", "h", 1, "u1", self.cargar)
+        self.cache.obtener("t2", "h", 1, "u2", self.cargar)
+        self.cache.invalidar("t1", "h", 1, "u1")
+        self.cache.obtener("t2", "h", 1, "u2", self.cargar)
+        self.assertEqual(self.cargar.call_count, 3)
+
+    def test_no_cachea_errores(self):
+        cargar = umock.Mock(return_value={"estado": False, "mensaje": "Token inválido"})
+        self.cache.obtener("t", "h", 1, "u", cargar)
+        self.cache.obtener("t", "h", 1, "u", cargar)
+        self.assertEqual(cargar.call_count, 2)
+
+
+class IdempotenciaTests(TestCase):
+    """El almacén vive en la base: dos instancias (como dos workers) ven las mismas reservas"""
+
+    def setUp(self):
+        self.worker_a = AlmacenIdempotencia()
+        self.worker_b = AlmacenIdempotencia()
+
+    def test_reserva_compartida_entre_instancias(self):
+        self.assertTrue(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+        self.assertFalse(self.worker_b.reservar("admin", "SOL001", "clave-1"))
+        self.assertTrue(self.worker_b.reservar("admin", "SOL002", "clave-1"))
+
+        self.worker_a.finalizar("admin", "SOL001", "clave-1", {"estado": True, "mensaje": ""})
+        self.assertEqual(self.worker_b.consultar("admin", "SOL001", "clave-1"),
+                         {"estado": COMPLETADO, "respuesta": {"estado": True, "mensaje": ""}})
+
+    def test_incierto_se_puede_volver_a_reservar(self):
+        self.assertTrue(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+        self.worker_a.finalizar("admin", "SOL001", "clave-1", None)
+        self.assertEqual(self.worker_b.consultar("admin", "SOL001", "clave-1")["estado"], INCIERTO)
+        self.assertTrue(self.worker_b.reservar("admin", "SOL001", "clave-1"))
+        self.assertFalse(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+
+    def test_rechazo_y_liberar_no_dejan_nada(self):
+        self.assertTrue(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+        self.worker_a.finalizar("admin", "SOL001", "clave-1", {"estado": False, "mensaje": "Rechazado"})
+        self.assertTrue(self.worker_b.reservar("admin", "SOL001", "clave-1"))
+        self.worker_b.liberar("admin", "SOL001", "clave-1")
+        self.assertFalse(RegistroIdempotente.objects.exists())
+
+    def test_reserva_vencida_se_toma(self):
+        self.assertTrue(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+        # El worker A murió enviando: su reserva vence después de ttl_en_curso
+        RegistroIdempotente.objects.update(en_curso_desde=timezone.now() - timezone.timedelta(seconds=120))
+        self.assertTrue(self.worker_b.reservar("admin", "SOL001", "clave-1"))
+        self.assertFalse(self.worker_a.reservar("admin", "SOL001", "clave-1"))
+
+    def test_resultado_vencido(self):
+        self.worker_a.finalizar("admin", "SOL001", "clave-1", {"estado": True, "mensaje": ""})
+        RegistroIdempotente.objects.update(actualizado=timezone.now() - timezone.timedelta(days=2))
+        self.assertIsNone(self.worker_b.consultar("admin", "SOL001", "clave-1"))
+        self.worker_b.finalizar("admin", "SOL002", "clave-2", {"estado": True, "mensaje": ""})
+        self.assertEqual(list(RegistroIdempotente.objects.values_list("id_solicitud", flat=True)), ["SOL002"])
+
+
+class RegistroLoteTests(TestCase):
+    """comando_stockControladoLote con y sin la capacidad 'lote' del servidor"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        pool.cerrar_todo()
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = umock.patch.object(mock, "PENDIENTES_MOCK", [
+            ["SOL001", "PROD001", "Tornillo", "20241201"],
+            ["SOL002", "PROD002", "Tuerca", "20241202"],
+        ])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request_con(self, **capacidades):
+        config = {"ip": "127.0.0.1", "puerto": self.puerto, "framing": "longitud", **capacidades}
+        request = RequestFactory().post('/registrar-lote/')
+        request.COOKIES['connection_config'] = quote(json.dumps(config))
+        return request
+
+    def registrar(self, request):
+        items = [{"idSolicitud": "SOL001", "cantidad": 3}, {"idSolicitud": "SOLXXX", "cantidad": 1},
+                 {"idSolicitud": "SOL002", "cantidad": 5}]
+        return services.comando_stockControladoLote("test_token", request, "admin", items)
+
+    def test_comando_lote(self):
+        respuesta = self.registrar(self.request_con(lote=True))
+        self.assertEqual(respuesta["registrados"], 2)
+        self.assertEqual([r["estado"] for r in respuesta["resultados"]], [True, False, True])
+        self.assertEqual(mock.PENDIENTES_MOCK, [])
+
+    def test_secuencia_sobre_una_conexion(self):
+        creadas = pool.estadisticas["creadas"]
+        respuesta = self.registrar(self.request_con(keepalive=True))
+        self.assertEqual([r["estado"] for r in respuesta["resultados"]], [True, False, True])
+        self.assertEqual(pool.estadisticas["creadas"] - creadas, 1)
+
+    def test_reintento_con_la_misma_clave(self):
+        request = self.request_con()
+        with umock.patch.object(services, "enviar_consulta_tcp", wraps=services.enviar_consulta_tcp) as envio:
+            primero = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+            reintento = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        self.assertTrue(primero["estado"])
+        self.assertEqual(reintento, primero)
+        self.assertEqual(envio.call_count, 1)
+
+        # Otro usuario con la misma clave, o sin clave: se envía (y VFP ya no tiene SOL001)
+        self.assertFalse(services.comando_stockControlado("test_token", request, "otro", "SOL001", 3, "clave-1")["estado"])
+        self.assertFalse(services.comando_stockControlado("test_token", request, "admin", "SOL001", 3)["estado"])
+
+    def test_lote_no_reenvia_lo_ya_registrado(self):
+        request = self.request_con(lote=True)
+        services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        items = [{"idSolicitud": "SOL001", "cantidad": 3, "idempotencia": "clave-1"},
+                 {"idSolicitud": "SOL002", "cantidad": 5, "idempotencia": "clave-2"}]
+        respuesta = services.comando_stockControladoLote("test_token", request, "admin", items)
+        self.assertEqual([r["estado"] for r in respuesta["resultados"]], [True, True])
+
+        # Todo el lote repetido: se responde sin hablar con VFP
+        with umock.patch.object(services, "enviar_consulta_tcp") as envio:
+            respuesta = services.comando_stockControladoLote("test_token", request, "admin", items)
+        envio.assert_not_called()
+        self.assertEqual(respuesta["registrados"], 2)
+
+    def registros_enviados(self, envio):
+        return [c for c in envio.call_args_list if c.args[0]["Comando"] == "RegistrarStockControlado"]
+
+    def test_en_curso_no_se_reenvia(self):
+        request = self.request_con()
+        self.assertTrue(almacen_idempotencia.reservar("admin", "SOL001", "clave-1"))
+        with umock.patch.object(services, "enviar_consulta_tcp") as envio:
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        envio.assert_not_called()
+        self.assertTrue(respuesta["reintentar"])
+        self.assertEqual(views._respuesta_registro(respuesta).status_code, 503)
+
+    def test_sin_respuesta_se_verifica_antes_de_reenviar(self):
+        request = self.request_con()
+        real = services.enviar_consulta_tcp
+
+        def aplicado_sin_respuesta(mensaje, **kwargs):
+            real(mensaje, **kwargs)
+            return None
+
+        # VFP lo aplicó pero la respuesta se perdió: queda incierto y se pide reintentar
+        with umock.patch.object(services, "enviar_consulta_tcp", side_effect=aplicado_sin_respuesta):
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        self.assertTrue(respuesta["reintentar"])
+        self.assertEqual(almacen_idempotencia.consultar("admin", "SOL001", "clave-1")["estado"], INCIERTO)
+
+        # El reintento ve que SOL001 ya no está pendiente: registrado sin reenviar
+        with umock.patch.object(services, "enviar_consulta_tcp", wraps=real) as envio:
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        self.assertTrue(respuesta["estado"])
+        self.assertEqual(self.registros_enviados(envio), [])
+
+        # Sin respuesta y sin aplicar: el reintento lo encuentra pendiente y lo envía
+        with umock.patch.object(services, "enviar_consulta_tcp", return_value=None):
+            respuesta = services.comando_stockControladoLote(
+                "test_token", self.request_con(lote=True), "admin",
+                [{"idSolicitud": "SOL002", "cantidad": 5, "idempotencia": "clave-2"}])
+        self.assertTrue(respuesta["resultados"][0]["reintentar"])
+        with umock.patch.object(services, "enviar_consulta_tcp", wraps=real) as envio:
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL002", 5, "clave-2")
+        self.assertTrue(respuesta["estado"])
+        self.assertEqual(len(self.registros_enviados(envio)), 1)
+        self.assertEqual(mock.PENDIENTES_MOCK, [])
+
+    def test_fallas_de_transporte_se_reintentan(self):
+        request = self.request_con()
+        perdida = mock.Perfil(prob_perdida=1.0, comandos={"registrarstockcontrolado"})
+        with umock.patch.object(mock, "PERFIL", perdida), umock.patch.object(tcp_client, "TCP_TIMEOUT", 0.3):
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        self.assertTrue(respuesta["reintentar"])
+        self.assertEqual(views._respuesta_registro(respuesta).status_code, 503)
+
+        # VFP lo aplicó y la respuesta se perdió: el reintento lo confirma sin reenviar
+        with umock.patch.object(services, "enviar_consulta_tcp", wraps=services.enviar_consulta_tcp) as envio:
+            respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-1")
+        self.assertTrue(respuesta["estado"])
+        self.assertEqual(self.registros_enviados(envio), [])
+
+        # Conexión cortada sin procesar: se pide reintentar y el token no se invalida
+        corte = mock.Perfil(prob_corte=1.0, comandos={"registrarstockcontrolado"})
+        with umock.patch.object(mock, "PERFIL", corte), \
+                umock.patch.object(services, "invalidar_token") as invalidar:
+            respuesta = services.comando_stockControladoLote(
+                "test_token", request, "admin", [{"idSolicitud": "SOL002", "cantidad": 5, "idempotencia": "clave-2"}])
+        self.assertTrue(respuesta["resultados"][0]["reintentar"])
+        invalidar.assert_not_called()
+        self.assertEqual(len(mock.PENDIENTES_MOCK), 1)
+
+    def test_sin_clave_la_falla_de_red_no_invalida_el_token(self):
+        cortada = [tcp_client._sin_respuesta("Connection reset by peer")]
+        with umock.patch.object(services, "enviar_consultas_tcp", return_value=cortada), \
+                umock.patch.object(services, "invalidar_token") as invalidar:
+            respuesta = services.comando_stockControladoLote(
+                "test_token", self.request_con(), "admin", [{"idSolicitud": "SOL001", "cantidad": 3}])
+        self.assertTrue(respuesta["resultados"][0]["reintentar"])
+        invalidar.assert_not_called()
+
+    def test_rechazo_de_items_no_cierra_la_sesion(self):
+        for capacidades in ({}, {"lote": True}):
+            def registrar_lote(token, idSolicitud):
+                cuerpo = {"token": token, "items": [{"idSolicitud": idSolicitud, "cantidad": 1}]}
+                request = RequestFactory().post('/registrar-lote/', json.dumps(cuerpo), content_type="application/json")
+                request.COOKIES.update(self.request_con(**capacidades).COOKIES, user_usuario="admin")
+                return views.stockControladoLote_view(request)
+
+            # SOL999 no está pendiente (p.ej. otro operador ya lo registró): el token sigue siendo válido
+            respuesta = registrar_lote("test_token", "SOL999")
+            self.assertEqual(respuesta.status_code, 409, capacidades)
+            datos = json.loads(respuesta.content)
+            self.assertFalse(datos["resultados"][0]["estado"])
+            self.assertFalse(datos["token_invalido"])
+
+            # VFP rechaza el token: 401 para que el navegador vuelva al login
+            respuesta = registrar_lote("token_vencido", "SOL001")
+            self.assertEqual(respuesta.status_code, 401, capacidades)
+            self.assertEqual(len(mock.PENDIENTES_MOCK), 2)
+
+    def test_cantidad_invalida_no_reserva(self):
+        request = RequestFactory().post('/registrar/', json.dumps({"token": "test_token", "idSolicitud": "SOL001",
+                                                                   "cantidad": "tres", "idempotencia": "clave-1"}),
+                                        content_type="application/json")
+        request.COOKIES.update(self.request_con().COOKIES, user_usuario="admin")
+        self.assertEqual(views.stockControlado_view(request).status_code, 400)
+        self.assertTrue(almacen_idempotencia.reservar("admin", "SOL001", "clave-1"))
+
+    def test_clave_en_header(self):
+        request = RequestFactory().post('/registrar/', json.dumps({"token": "t", "idSolicitud": "SOL001", "cantidad": 1}),
+                                        content_type="application/json", HTTP_X_IDEMPOTENCY_KEY="clave-h")
+        request.COOKIES['user_usuario'] = "admin"
+        self.assertEqual(views._parsear_registro(request)[-1], "clave-h")
+
+
+class RegistroDiferidoTests(TestCase):
+    """Modo REGISTRO_DIFERIDO: se acepta en la base y diferido.vaciar lo envía a VFP"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        pool.cerrar_todo()
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        for patcher in (umock.patch.object(mock, "PENDIENTES_MOCK", [["SOL001", "PROD001", "Tornillo", "20241201"]]),
+                        umock.patch.object(views, "REGISTRO_DIFERIDO", True),
+                        umock.patch.object(diferido, "despertar")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def registrar(self, clave="clave-1", cookies=None):
+        config = {"ip": "127.0.0.1", "puerto": self.puerto, "framing": "longitud"}
+        request = RequestFactory().post('/registrar/', json.dumps({"token": "test_token", "idSolicitud": "SOL001",
+                                                                   "cantidad": 3, "idempotencia": clave}),
+                                        content_type="application/json")
+        request.COOKIES.update(cookies if cookies is not None else {'connection_config': quote(json.dumps(config))})
+        request.COOKIES['user_usuario'] = "admin"
+        return views.stockControlado_view(request)
+
+    def estado(self, clave="clave-1"):
+        request = RequestFactory().get('/registrar/estado/', {"claves": clave})
+        request.COOKIES['user_usuario'] = "admin"
+        return json.loads(views.estadoRegistros_view(request).content)["registros"].get(clave)
+
+    def test_acepta_y_vacia(self):
+        with umock.patch.object(services, "enviar_consulta_tcp") as envio:
+            respuesta = self.registrar()
+            self.registrar()  # Reintento del navegador: no se duplica
+        envio.assert_not_called()
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual(RegistroDiferido.objects.count(), 1)
+        self.assertEqual(self.estado()["estado"], RegistroDiferido.PENDIENTE)
+
+        self.assertEqual(diferido.vaciar(), 1)
+        self.assertEqual(self.estado()["estado"], RegistroDiferido.REGISTRADO)
+        self.assertEqual(RegistroDiferido.objects.get().token, "")
+        self.assertEqual(mock.PENDIENTES_MOCK, [])
+        self.assertEqual(diferido.vaciar(), 0)
+
+    def test_sin_respuesta_se_reintenta_con_espera(self):
+        self.registrar()
+        with umock.patch.object(services, "enviar_consultas_tcp", return_value=[None]):
+            diferido.vaciar()
+        registro = RegistroDiferido.objects.get()
+        self.assertEqual((registro.estado, registro.intentos), (RegistroDiferido.PENDIENTE, 1))
+        self.assertGreater(registro.proximo_intento, timezone.now())
+        self.assertEqual(diferido.vaciar(), 0)
+
+        RegistroDiferido.objects.update(proximo_intento=timezone.now())
+        diferido.vaciar()
+        self.assertEqual(self.estado()["estado"], RegistroDiferido.REGISTRADO)
+
+    def test_guarda_el_servidor_de_las_cookies_individuales(self):
+        respuesta = self.registrar(cookies={"empresa_ip": "127.0.0.1", "empresa_puerto": str(self.puerto)})
+        self.assertEqual(respuesta.status_code, 202)
+        with umock.patch.object(services, "invalidar_token") as invalidar:
+            diferido.vaciar()
+        self.assertEqual(self.estado()["estado"], RegistroDiferido.REGISTRADO)
+        invalidar.assert_not_called()
+
+    def test_sin_servidor_no_se_acepta(self):
+        respuesta = self.registrar(cookies={})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(RegistroDiferido.objects.exists())
+
+    def test_purga_los_terminados_viejos(self):
+        for clave in ("clave-1", "clave-2", "clave-3"):
+            self.registrar(clave)
+        viejo = timezone.now() - timezone.timedelta(days=2)
+        RegistroDiferido.objects.filter(idempotencia="clave-1").update(estado=RegistroDiferido.REGISTRADO,
+                                                                      actualizado=viejo)
+        RegistroDiferido.objects.filter(idempotencia="clave-2").update(estado=RegistroDiferido.RECHAZADO,
+                                                                      actualizado=viejo)
+        # Pendiente viejo (p.ej. esperando reintento): no se borra
+        despues = timezone.now() + timezone.timedelta(hours=1)
+        RegistroDiferido.objects.filter(idempotencia="clave-3").update(actualizado=viejo, proximo_intento=despues)
+        with umock.patch.object(diferido, "_ultima_purga", 0.0):
+            diferido.vaciar()
+            self.assertEqual(list(RegistroDiferido.objects.values_list("idempotencia", flat=True)), ["clave-3"])
+            # Throttle: dentro del intervalo no vuelve a consultar la base
+            RegistroDiferido.objects.update(estado=RegistroDiferido.REGISTRADO)
+            self.assertEqual(diferido.purgar(), 0)
+            self.assertEqual(diferido.purgar(forzar=True), 1)
+
+    def test_retoma_enviando_abandonado(self):
+        self.registrar()
+        viejo = timezone.now() - timezone.timedelta(hours=1)
+        RegistroDiferido.objects.update(estado=RegistroDiferido.ENVIANDO, reclamado="otro", actualizado=viejo)
+        self.assertEqual(diferido.vaciar(), 1)
+        self.assertEqual(self.estado()["estado"], RegistroDiferido.REGISTRADO)
+
+
+class PipelineTests(SimpleTestCase):
+    """verificarToken + controlPendientes en un solo intercambio con VFP"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background(latencia=0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        pool.cerrar_todo()
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        pool.cerrar_todo()
+        cache_tokens.backend.clear()
+        services.cache_pendientes.backend.clear()
+
+    def request_con(self, **capacidades):
+        config = {"ip": "127.0.0.1", "puerto": self.puerto, "framing": "longitud", **capacidades}
+        request = RequestFactory().get('/')
+        request.COOKIES['connection_config'] = quote(json.dumps(config))
+        return request
+
+    def test_verificar_y_pendientes_en_una_conexion(self):
+        creadas = pool.estadisticas["creadas"]
+        verificar, pendientes = services.comando_verificarYPendientes(
+            "test_token", self.request_con(keepalive=True), "admin")
+        self.assertTrue(verificar["estado"])
+        self.assertIn("nombre", verificar)
+        self.assertTrue(pendientes["estado"])
+        self.assertIn("pendientes", pendientes)
+        self.assertEqual(pool.estadisticas["creadas"] - creadas, 1)
+
+    def test_demultiplexa_por_id_mensaje(self):
+        mensajes = [dict(MENSAJE_TOKEN), {"Comando": "controlPendientes", "Token": "test_token",
+                                          "Vista": "CONTROLSTOCK", "Version": 1, "UsrActivo": "admin"}]
+        respuestas = enviar_consultas_tcp(mensajes, request=self.request_con(keepalive=True))
+        self.assertIn("nombre", respuestas[0])
+        self.assertIn("pendientes", respuestas[1])
+
+
+class DeltaPendientesTests(SimpleTestCase):
+    """controlPendientes con VersionPendientes: solo viajan las altas/bajas"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        pool.cerrar_todo()
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        for nombre, valor in (("PENDIENTES_MOCK", [["SOL001", "PROD001", "Tornillo", "20241201"],
+                                                   ["SOL002", "PROD002", "Tuerca", "20241202"]]),
+                              ("PENDIENTES_VERSION", 1),
+                              ("HISTORIAL_PENDIENTES", mock.deque(maxlen=1000))):
+            patcher = umock.patch.object(mock, nombre, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache_tokens.backend.clear()
+        services.cache_pendientes.backend.clear()
+        config = {"ip": "127.0.0.1", "puerto": self.puerto, "framing": "longitud", "delta": True}
+        self.request = RequestFactory().get('/pendientes/')
+        self.request.COOKIES['connection_config'] = quote(json.dumps(config))
+
+    def ids(self, respuesta):
+        return [p.idSolicitud for p in respuesta["pendientes"]]
+
+    def test_merge_del_delta(self):
+        inicial = services.comando_controlPendientes("test_token", self.request, "admin")
+        self.assertEqual(self.ids(inicial), ["SOL001", "SOL002"])
+
+        services.comando_stockControlado("test_token", self.request, "admin", "SOL001", 2)
+        mock.agregar_pendiente(["SOL003", "PROD003", "Arandela", "20241203"])
+
+        actual = services.comando_controlPendientes("test_token", self.request, "admin")
+        self.assertTrue(actual.get("Delta"))
+        self.assertEqual(self.ids(actual), ["SOL002", "SOL003"])
+        self.assertEqual(actual["delta_desde"], inicial["version"])
+
+        # El navegador con la versión inicial recibe solo el delta
+        datos = json.loads(views._respuesta_pendientes(actual, str(inicial["version"])).content)
+        self.assertTrue(datos["delta"])
+        self.assertEqual([p["idSolicitud"] for p in datos["agregados"]], ["SOL003"])
+
+        datos = json.loads(views._respuesta_pendientes(actual, str(inicial["version"]), "columnas").content)
+        self.assertEqual(datos["agregados"]["id"], ["SOL003"])
+        self.assertEqual(datos["eliminados"], ["SOL001"])
+
+        # Con una versión desconocida recibe la lista completa
+        datos = json.loads(views._respuesta_pendientes(actual, "999").content)
+        self.assertNotIn("delta", datos)
+        self.assertEqual(len(datos["pendientes"]), 2)
+
+    def test_version_fuera_del_historial_manda_todo(self):
+        mock.HISTORIAL_PENDIENTES.clear()
+        mock.agregar_pendiente(["SOL003", "PROD003", "Arandela", "20241203"])
+        mock.agregar_pendiente(["SOL004", "PROD004", "Cable", "20241204"])
+        mock.HISTORIAL_PENDIENTES.popleft()
+        self.assertIsNone(mock.delta_pendientes(1))
+        self.assertEqual(mock.delta_pendientes(2), ([["SOL004", "PROD004", "Cable", "20241204"]], []))
+
+
+class PaginaPendientesTests(SimpleTestCase):
+    """/pendientes/?offset=&limit=&q=: una página de la lista filtrada"""
+
+    def setUp(self):
+        self.respuesta = {
+            "estado": True, "mensaje": "", "deposito": "D1", "version": 7,
+            "pendientes": [Pendiente(f"SOL{i:03d}", f"PROD{i:03d}", "Tornillo" if i % 2 else "Tuerca", "01/12/2024")
+                           for i in range(10)],
+        }
+
+    def pagina(self, **parametros):
+        error, pagina = views._pagina_cliente(RequestFactory().get('/pendientes/', parametros))
+        self.assertIsNone(error)
+        return pagina
+
+    def test_parametros(self):
+        self.assertIsNone(self.pagina())
+        self.assertEqual(self.pagina(offset="5", limit="3", q=" tuer "),
+                         {"offset": 5, "limit": 3, "q": "tuer", "codigo": "", "descripcion": ""})
+        self.assertEqual(self.pagina(codigo="PROD1")["limit"], views.PENDIENTES_PAGINA_MAX)
+        self.assertEqual(self.pagina(limit="999999")["limit"], views.PENDIENTES_PAGINA_MAX)
+        for invalidos in ({"offset": "a"}, {"offset": "-1"}, {"limit": "0"}):
+            error, _ = views._pagina_cliente(RequestFactory().get('/pendientes/', invalidos))
+            self.assertEqual(error.status_code, 400)
+
+    def pedir(self, formato=None, **parametros):
+        pagina = {"offset": 0, "limit": 100, "q": "", "codigo": "", "descripcion": "", **parametros}
+        return json.loads(views._respuesta_pendientes(self.respuesta, None, formato, pagina).content)
+
+    def test_pagina_filtrada(self):
+        datos = self.pedir("columnas", offset=1, limit=2, q="TUERCA")
+        self.assertEqual(datos["total"], 5)
+        self.assertEqual(datos["pendientes"]["id"], ["SOL002", "SOL004"])
+        self.assertEqual((datos["offset"], datos["limit"], datos["q"]), (1, 2, "TUERCA"))
+        self.assertNotIn("delta", datos)
+
+        # Búsqueda por número de solicitud y página fuera de rango
+        datos = self.pedir(q="sol009")
+        self.assertEqual([p["idSolicitud"] for p in datos["pendientes"]], ["SOL009"])
+        datos = self.pedir(offset=50, limit=5)
+        self.assertEqual((datos["total"], datos["pendientes"]), (10, []))
+
+    def test_codigo_y_descripcion(self):
+        self.respuesta["pendientes"].append(Pendiente("SOL100", "TOR-8", "Tornillo M8 x 20mm", "02/12/2024"))
+        self.assertEqual(self.pedir(codigo="prod00")["total"], 10)
+        datos = self.pedir(codigo="PROD00", descripcion="rnil")
+        self.assertEqual([p["idSolicitud"] for p in datos["pendientes"]], ["SOL001", "SOL003", "SOL005", "SOL007", "SOL009"])
+        # Varias palabras: substring completo, no palabras sueltas
+        self.assertEqual(self.pedir(descripcion="m8 x 2")["total"], 1)
+        self.assertEqual(self.pedir(descripcion="x m8")["total"], 0)
+        self.assertEqual(self.pedir(q="tor-8")["pendientes"][0]["idSolicitud"], "SOL100")
+        self.assertEqual(self.pedir(codigo="zzz")["total"], 0)
+
+    def test_indice_por_snapshot(self):
+        self.respuesta["snapshot"] = "abc"
+        indice = indice_de(self.respuesta)
+        self.assertIs(indice_de(dict(self.respuesta)), indice)
+        self.assertIsNot(indice_de(dict(self.respuesta, snapshot="def")), indice)
+
+    def test_inline_largo_viaja_en_columnas(self):
+        verificar = {"estado": True, "usuario": "admin", "nombre": "Admin"}
+        request = RequestFactory().get('/')
+        with umock.patch.object(views, "PENDIENTES_VIRTUAL_UMBRAL", 5):
+            respuesta = views._renderizar_controlStock(request, verificar, "Empresa", self.respuesta)
+        html = respuesta.content.decode()
+        self.assertNotIn('class="solicitud-row"', html)
+        self.assertIn('"pendientesInline": {"id": ["SOL000"', html)
+
+        respuesta = views._renderizar_controlStock(request, verificar, "Empresa", self.respuesta)
+        html = respuesta.content.decode()
+        self.assertEqual(html.count('class="solicitud-row"'), 10)
+        self.assertNotIn("onclick=\"abrirModalControlFromRow", html)
+
+    def test_buscar_codigo(self):
+        self.respuesta["pendientes"].append(Pendiente("SOL100", "PROD003", "Tornillo", "02/12/2024"))
+        indice = indice_de(self.respuesta)
+        self.assertEqual([p.idSolicitud for p in indice.por_codigo_exacto(" prod003\r\n")], ["SOL003", "SOL100"])
+        self.assertEqual(indice.por_codigo_exacto("PROD00"), [])
+
+        datos = json.loads(views._respuesta_codigo(self.respuesta, "PROD005", "columnas").content)
+        self.assertEqual((datos["total"], datos["pendientes"]["id"]), (1, ["SOL005"]))
+        error, _ = views._codigo_cliente(RequestFactory().get('/pendientes/codigo/', {"codigo": "  "}))
+        self.assertEqual(error.status_code, 400)
+        rechazo = views._respuesta_codigo({"estado": False, "mensaje": "Token vencido"}, "PROD005")
+        self.assertEqual(rechazo.status_code, 401)
+
+
+class MetricasTests(SimpleTestCase):
+    """Histogramas por proceso, suma entre workers y /metrics"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        registro = umock.patch.object(metricas, "registro", metricas.Registro())
+        self.registro = registro.start()
+        self.addCleanup(registro.stop)
+
+    def series(self, nombre):
+        histogramas, _ = metricas.combinar([self.registro.instantanea()])
+        return {dict(etiquetas)["comando"]: serie for (n, etiquetas), serie in histogramas.items() if n == nombre}
+
+    def test_histogramas_se_suman_entre_workers(self):
+        otro = metricas.Registro()
+        for valor in (0.003, 0.2, 50):
+            self.registro.observar("controlstock_vista_segundos", valor, vista="controlStock", status="2xx")
+        otro.observar("controlstock_vista_segundos", 0.004, vista="controlStock", status="2xx")
+        otro.incrementar("controlstock_vfp_errores_total", comando="verificarToken", motivo="timeout")
+
+        # Pasan por JSON como los archivos de METRICAS_DIR
+        instantaneas = [json.loads(json.dumps(r.instantanea())) for r in (self.registro, otro)]
+        texto = metricas.formato_prometheus(*metricas.combinar(instantaneas))
+        etiquetas = 'status="2xx",vista="controlStock"'
+        self.assertIn(f'controlstock_vista_segundos_bucket{{{etiquetas},le="0.005"}} 2', texto)
+        self.assertIn(f'controlstock_vista_segundos_bucket{{{etiquetas},le="30"}} 3', texto)
+        self.assertIn(f'controlstock_vista_segundos_bucket{{{etiquetas},le="+Inf"}} 4', texto)
+        self.assertIn(f'controlstock_vista_segundos_count{{{etiquetas}}} 4', texto)
+        self.assertIn('controlstock_vfp_errores_total{comando="verificarToken",motivo="timeout"} 1', texto)
+
+    def test_consulta_tcp_medida(self):
+        protocolo = {'framing': 'longitud', 'terminador': 0, 'keepalive': False}
+        respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                                        protocolo=protocolo)
+        self.assertIs(respuesta["estado"], True)
+        for nombre in ("controlstock_vfp_segundos", "controlstock_vfp_conexion_segundos",
+                       "controlstock_vfp_primer_byte_segundos", "controlstock_vfp_cola_segundos",
+                       "controlstock_vfp_decodificacion_segundos", "controlstock_vfp_enviados_bytes",
+                       "controlstock_vfp_recibidos_bytes"):
+            self.assertEqual(self.series(nombre)["verificarToken"][-1], 1, nombre)
+
+        # Sin respuesta: la consulta se mide igual y cuenta el error
+        with umock.patch.object(tcp_client, "recibir_respuesta", side_effect=socket.timeout):
+            enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1', puerto_custom=self.puerto, protocolo=protocolo)
+        self.assertEqual(self.series("controlstock_vfp_segundos")["verificarToken"][-1], 2)
+        self.assertIn((("comando", "verificarToken"), ("motivo", "timeout")),
+                      [etiquetas for (_, etiquetas) in self.registro._contadores])
+
+    def test_endpoint_suma_workers(self):
+        otro = metricas.Registro()
+        otro.observar("controlstock_vista_segundos", 0.01, vista="controlPendientes", status="2xx")
+        with tempfile.TemporaryDirectory() as directorio:
+            # Otro worker vivo (el proceso padre hace de worker)
+            with open(os.path.join(directorio, f"{os.getppid()}.json"), "w") as archivo:
+                json.dump(otro.instantanea(), archivo)
+            with umock.patch.object(metricas, "METRICAS_DIR", directorio), \
+                    umock.patch.object(views, "METRICAS_TOKEN", "secreto"):
+                respuesta = Client(HTTP_HOST="127.0.0.1").get("/metrics", HTTP_AUTHORIZATION="Bearer secreto")
+        self.assertEqual(respuesta.status_code, 200)
+        texto = respuesta.content.decode()
+        self.assertIn('controlstock_vista_segundos_count{status="2xx",vista="controlPendientes"} 1', texto)
+        self.assertIn('controlstock_cache_eventos_total{cache="tokens",evento="hits"}', texto)
+
+        # La vista quedó medida por el middleware; sin el header no responde
+        self.assertIn(("vista", "metricas"), self.registro.instantanea()["histogramas"][0][1])
+        with umock.patch.object(views, "METRICAS_TOKEN", "secreto"):
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get("/metrics").status_code, 401)
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get("/metrics", HTTP_AUTHORIZATION="Bearer otro").status_code,
+                             401)
+
+    def test_no_suma_workers_terminados(self):
+        otro = metricas.Registro()
+        otro.observar("controlstock_vista_segundos", 0.01, vista="controlPendientes", status="2xx")
+        terminado = subprocess.Popen([sys.executable, "-c", "pass"])
+        terminado.wait()
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo_terminado = os.path.join(directorio, f"{terminado.pid}.json")
+            with open(archivo_terminado, "w") as archivo:
+                json.dump(otro.instantanea(), archivo)
+            texto = metricas.exportar(directorio)
+            self.assertFalse(os.path.exists(archivo_terminado))
+        self.assertNotIn('vista="controlPendientes"', texto)
+
+    url_cache = "/cache/estadisticas/"
+
+    def test_estadisticas_de_cache_piden_token(self):
+        with umock.patch.object(views, "METRICAS_TOKEN", "secreto"):
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get(self.url_cache).status_code, 401)
+            respuesta = Client(HTTP_HOST="127.0.0.1").get(self.url_cache, HTTP_AUTHORIZATION="Bearer secreto")
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn("hit_rate", json.loads(respuesta.content))
+
+    def test_endpoint_sin_token_configurado_no_existe(self):
+        with umock.patch.object(views, "METRICAS_TOKEN", None):
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get("/metrics").status_code, 404)
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get(self.url_cache).status_code, 404)
+            self.assertEqual(Client(HTTP_HOST="127.0.0.1").get("/metrics", HTTP_AUTHORIZATION="Bearer ").status_code,
+                             404)
+
+
+class LogsTests(SimpleTestCase):
+    """Redacción, muestreo por comando y cola sin bloqueo (logs.py)"""
+
+    def setUp(self):
+        self.salida = io.StringIO()
+        self.handler = logs.crear_handler_cola(self.salida)
+        self.handler.addFilter(logs.FiltroMuestreo())
+        self.logger = logging.getLogger("app_controlStock.pruebas_logs")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.addCleanup(logs._handlers.remove, self.handler)
+
+    def lineas(self):
+        self.handler.listener.stop()
+        return [json.loads(linea) for linea in self.salida.getvalue().splitlines()]
+
+    def test_tokens_tachados(self):
+        self.logger.info("Mensaje %s", {"Token": "abc123", "x": 1})
+        self.logger.warning("authToken=abc123; Authorization: Bearer abc123")
+        lineas = self.lineas()
+        self.assertEqual([linea["nivel"] for linea in lineas], ["INFO", "WARNING"])
+        self.assertNotIn("abc123", self.salida.getvalue())
+        self.assertEqual(lineas[0]["mensaje"], "Mensaje {'Token': '***', 'x': 1}")
+
+    def test_muestreo_por_intercambio(self):
+        with umock.patch.object(logs, "LOG_MUESTREO", {"controlPendientes": 3}), \
+                umock.patch.dict(logs._contadores, clear=True):
+            for i in range(6):
+                contexto = logs.iniciar_comando("controlPendientes")
+                self.logger.info("intercambio %d", i)
+                self.logger.debug("nunca (nivel INFO)")
+                self.logger.warning("siempre %d", i)
+                logs.terminar_comando(contexto)
+        mensajes = [(linea["mensaje"], linea["comando"]) for linea in self.lineas()]
+        self.assertEqual([m for m, _ in mensajes if m.startswith("intercambio")], ["intercambio 0", "intercambio 3"])
+        self.assertEqual(len([m for m, _ in mensajes if m.startswith("siempre")]), 6)
+        self.assertEqual({c for _, c in mensajes}, {"controlPendientes"})
+
+    def test_cola_llena_descarta_sin_bloquear(self):
+        self.handler.listener.stop()
+        self.handler.queue = queue.Queue(2)
+        for i in range(5):
+            self.logger.info("registro %d", i)
+        self.assertEqual(self.handler.descartados, 3)
+
+
+class CircuitoTests(TestCase):
+    """Cortacircuitos por servidor VFP (circuito.py)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor, cls.puerto = mock.iniciar_en_background()
+        # Puerto sin nadie escuchando: la conexión se rechaza al instante
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            cls.puerto_caido = s.getsockname()[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.close()
+        super().tearDownClass()
+
+    def test_abre_prueba_y_cierra_con_backoff(self):
+        c = Cortacircuitos(EstadoMemoria(), fallas=2, abierto_min=0.1, abierto_max=0.15, sonda_timeout=5)
+        c.registrar("vfp", 1, "timeout")
+        self.assertTrue(c.permitir("vfp", 1))
+        c.registrar("vfp", 1, "conexion")
+        self.assertEqual(c.estado("vfp", 1), "abierto")
+        self.assertFalse(c.permitir("vfp", 1))
+        self.assertTrue(c.permitir("otro", 1))
+
+        # Semiabierto: pasa una sola prueba; si falla se abre por más tiempo (hasta abierto_max)
+        time.sleep(0.1)
+        self.assertTrue(c.permitir("vfp", 1))
+        self.assertFalse(c.permitir("vfp", 1))
+        c.registrar("vfp", 1, "timeout")
+        estado = c.almacen.leer("vfp:1")
+        self.assertEqual(estado["aperturas"], 2)
+        self.assertAlmostEqual(estado["abierto_hasta"] - time.time(), 0.15, delta=0.05)
+
+        # Pool agotado no dice nada del servidor; la respuesta a la prueba lo cierra
+        time.sleep(0.15)
+        self.assertTrue(c.permitir("vfp", 1))
+        c.registrar("vfp", 1, "pool_agotado")
+        self.assertFalse(c.permitir("vfp", 1))
+        c.registrar("vfp", 1, None)
+        self.assertEqual(c.estado("vfp", 1), "cerrado")
+        self.assertTrue(c.permitir("vfp", 1))
+        self.assertEqual(c.estadisticas, {"rechazadas": 3, "sondas": 2, "aperturas": 2, "cierres": 1})
+
+    def test_estado_compartido_entre_workers(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            workers = [Cortacircuitos(EstadoArchivo(directorio), fallas=2, abierto_min=0.1, sonda_timeout=5)
+                       for _ in range(2)]
+            # Las fallas de cada worker suman, y un acierto las olvida para todos
+            workers[0].registrar("vfp", 1, "timeout")
+            workers[1].registrar("vfp", 1, None)
+            workers[0].registrar("vfp", 1, "timeout")
+            self.assertEqual(workers[1].estado("vfp", 1), "cerrado")
+            workers[1].registrar("vfp", 1, "timeout")
+            self.assertFalse(workers[0].permitir("vfp", 1))
+
+            # Una única prueba entre todos los workers
+            time.sleep(0.1)
+            self.assertEqual([w.permitir("vfp", 1) for w in workers], [True, False])
+            workers[0].registrar("vfp", 1, None)
+            self.assertTrue(workers[1].permitir("vfp", 1))
+
+    def test_servidor_caido_falla_rapido(self):
+        protocolo = {'framing': 'longitud', 'terminador': 0, 'keepalive': False}
+        with umock.patch.object(tcp_client, "circuito", Cortacircuitos(EstadoMemoria(), fallas=2)):
+            for _ in range(2):
+                respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1',
+                                                puerto_custom=self.puerto_caido, protocolo=protocolo)
+                self.assertTrue(tcp_client.es_sin_respuesta(respuesta))
+                self.assertFalse(tcp_client.es_no_enviado(respuesta))
+
+            # Abierto: ni siquiera se intenta conectar
+            with umock.patch.object(tcp_client.socket, "socket") as conectar:
+                respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1',
+                                                puerto_custom=self.puerto_caido, protocolo=protocolo)
+            conectar.assert_not_called()
+            self.assertEqual(respuesta["estado"], False)
+            self.assertTrue(tcp_client.es_no_enviado(respuesta))
+
+            # Un registro no enviado se reintenta sin quedar incierto ni invalidar el token
+            config = {"ip": "127.0.0.1", "puerto": self.puerto_caido, "framing": "longitud"}
+            request = RequestFactory().post('/registrar/')
+            request.COOKIES['connection_config'] = quote(json.dumps(config))
+            with umock.patch.object(services, "invalidar_token") as invalidar:
+                respuesta = services.comando_stockControlado("test_token", request, "admin", "SOL001", 3, "clave-c")
+            self.assertTrue(respuesta["reintentar"])
+            self.assertIsNone(almacen_idempotencia.consultar("admin", "SOL001", "clave-c"))
+            self.assertTrue(almacen_idempotencia.reservar("admin", "SOL001", "clave-c"))
+            invalidar.assert_not_called()
+
+            # Los demás servidores no se ven afectados
+            respuesta = enviar_consulta_tcp(MENSAJE_TOKEN, ip_custom='127.0.0.1', puerto_custom=self.puerto,
+                                            protocolo=protocolo)
+            self.assertIs(respuesta["estado"], True)
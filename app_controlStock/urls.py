@@ -1,12 +1,30 @@
 from django.urls import path
 from . import views
+from .__init__ import VISTAS_ASYNC
 
 app_name = 'app_controlStock'
 
+if VISTAS_ASYNC:
+    # Bajo ASGI (uvicorn): las vistas que hablan con VFP no bloquean el worker
+    vista_controlStock = views.controlStock_view_async
+    vista_pendientes = views.controlPendientes_view_async
+    vista_buscar_codigo = views.buscarCodigo_view_async
+    vista_registrar = views.stockControlado_view_async
+else:
+    vista_controlStock = views.controlStock_view
+    vista_pendientes = views.controlPendientes_view
+    vista_buscar_codigo = views.buscarCodigo_view
+    vista_registrar = views.stockControlado_view
+
 urlpatterns = [
     path('setup-mock/', views.setup_mock, name='setup_mock'),  # ← PRIMERO
-    path('', views.controlStock_view, name='controlStock'),
-    path('pendientes/', views.controlPendientes_view, name='controlPendientes'),
-    path('registrar/', views.stockControlado_view, name='stockControlado'),
+    path('', vista_controlStock, name='controlStock'),
+    path('pendientes/', vista_pendientes, name='controlPendientes'),
+    path('pendientes/codigo/', vista_buscar_codigo, name='buscarCodigo'),
+    path('registrar/', vista_registrar, name='stockControlado'),
+    path('registrar-lote/', views.stockControladoLote_view, name='stockControladoLote'),
+    path('registrar/estado/', views.estadoRegistros_view, name='estadoRegistros'),
     path('logout/', views.logout_view, name='logout'),
+    path('cache/estadisticas/', views.estadisticasCache_view, name='estadisticasCache'),
+    path('metrics', views.metricas_view, name='metricas'),
 ]
\ No newline at end of file
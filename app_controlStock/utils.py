@@ -7,14 +7,69 @@ import json
 
 logger = logging.getLogger(__name__)
 
+FRAMINGS_VALIDOS = ("longitud", "terminador")
 
-def get_connection_config(request):
+
+def extraer_protocolo(datos_conexion):
+    """
+    Obtiene las capacidades de protocolo del servidor VFP desde connection_config
+
+    Args:
+        datos_conexion: Dict decodificado de la cookie connection_config (o None)
+
+    Returns:
+        dict: {'framing': None|'longitud'|'terminador', 'terminador': int,
+               'keepalive': bool, 'lote': bool, 'delta': bool}
+    """
+    from .__init__ import TCP_FRAMING, TCP_TERMINADOR, TCP_KEEPALIVE, TCP_COMANDO_LOTE, TCP_PENDIENTES_DELTA
+
+    protocolo = {'framing': TCP_FRAMING, 'terminador': TCP_TERMINADOR,
+                 'keepalive': TCP_KEEPALIVE, 'lote': TCP_COMANDO_LOTE, 'delta': TCP_PENDIENTES_DELTA}
+    if not datos_conexion:
+        return _validar_keepalive(protocolo)
+
+    framing = datos_conexion.get('framing')
+    if framing in FRAMINGS_VALIDOS:
+        protocolo['framing'] = framing
+    elif framing:
+        logger.warning("Framing desconocido en connection_config: %s", framing)
+
+    try:
+        terminador = int(datos_conexion.get('terminador', protocolo['terminador']))
+        if 0 <= terminador <= 255:
+            protocolo['terminador'] = terminador
+    except (ValueError, TypeError):
+        logger.warning("Terminador inválido en connection_config: %s", datos_conexion.get('terminador'))
+
+    for capacidad in ('keepalive', 'lote', 'delta'):
+        if capacidad in datos_conexion:
+            protocolo[capacidad] = datos_conexion.get(capacidad) in (True, 1, "1", "true", "T")
+
+    return _validar_keepalive(protocolo)
+
+
+def _validar_keepalive(protocolo):
+    # Sin framing no hay forma de saber dónde termina cada respuesta en una conexión reutilizada
+    if protocolo['keepalive'] and not protocolo['framing']:
+        logger.warning("keepalive requiere framing - se desactiva el pool para este servidor")
+        protocolo['keepalive'] = False
+    return protocolo
+
+
+def get_connection_config(request, con_protocolo=False):
+    """
+    Obtiene IP y puerto del servidor VFP desde las cookies.
+
+    Si con_protocolo=True devuelve además las capacidades de protocolo
+    negociadas para ese servidor (ver extraer_protocolo).
+    """
     from urllib.parse import unquote
 
     # Intentar obtener connection_config (JSON)
     connection_config = request.COOKIES.get('connection_config')
     ip = None
     puerto = None
+    datos_conexion = None
 
     if connection_config:
         try:
@@ -31,10 +86,10 @@ def get_connection_config(request):
             nombre = datos_conexion.get('nombre', '')
 
             if ip and puerto:
-                logger.debug(f"Configuración encontrada en connection_config (JSON): {ip}:{puerto}")
+                logger.debug("Configuración encontrada en connection_config (JSON): %s:%s", ip, puerto)
         except json.JSONDecodeError as e:
-            logger.error(f"Error al decodificar JSON de connection_config: {e}")
-            logger.error(f"Cookie value: {connection_config}")
+            logger.error("Error al decodificar JSON de connection_config: %s", e)
+            logger.error("Cookie value: %s", connection_config)
 
     # Si no hay connection_config o falló, intentar cookies individuales
     if not ip or not puerto:
@@ -44,23 +99,25 @@ def get_connection_config(request):
         if empresa_ip and empresa_puerto:
             ip = empresa_ip
             puerto = empresa_puerto
-            logger.debug(f"Configuración encontrada en cookies individuales: {ip}:{puerto}")
+            logger.debug("Configuración encontrada en cookies individuales: %s:%s", ip, puerto)
         else:
             logger.warning("No se encontró connection_config ni cookies individuales (empresa_ip, empresa_puerto)")
-            return None, None
+            return (None, None, None) if con_protocolo else (None, None)
 
     # Validar que ambos valores existan y no sean vacíos
     if not ip or not puerto:
-        logger.warning(f"IP o Puerto faltantes. IP: {ip}, Puerto: {puerto}")
-        return None, None
+        logger.warning("IP o Puerto faltantes. IP: %s, Puerto: %s", ip, puerto)
+        return (None, None, None) if con_protocolo else (None, None)
 
     # Convertir puerto a entero si es string
     try:
         puerto = int(puerto) if isinstance(puerto, str) else puerto
     except (ValueError, TypeError):
-        logger.error(f"Puerto inválido: {puerto}")
-        return None, None
+        logger.error("Puerto inválido: %s", puerto)
+        return (None, None, None) if con_protocolo else (None, None)
 
+    if con_protocolo:
+        return ip, puerto, extraer_protocolo(datos_conexion)
     return ip, puerto
 
 def obtener_datos_cookies(request):
@@ -80,10 +137,9 @@ def obtener_datos_cookies(request):
             # Decodificar URL encoding antes de parsear JSON
             config_decoded = unquote(config)
             datos_conexion = json.loads(config_decoded)
-            print(f"✅ Usando connection_config (JSON)")
+            logger.debug("✅ Usando connection_config (JSON)")
         except json.JSONDecodeError as e:
-            print(f"❌ Error parseando connection_config JSON: {e}")
-            print(f"   Config recibido: {config}")
+            logger.warning("❌ Error parseando connection_config JSON: %s (recibido: %r)", e, config)
 
     # Si no hay connection_config o falló el parsing, intentar cookies individuales
     if not datos_conexion:
@@ -100,12 +156,12 @@ def obtener_datos_cookies(request):
                     'nombre': unquote(empresa_nombre) if empresa_nombre else '',
                     'codigo': empresa_codigo if empresa_codigo else ''
                 }
-                print(f"✅ Usando cookies individuales (empresa_ip, empresa_puerto, etc.)")
+                logger.debug("✅ Usando cookies individuales (empresa_ip, empresa_puerto, etc.)")
             except (ValueError, TypeError) as e:
-                print(f"❌ Error convirtiendo datos de cookies individuales: {e}")
+                logger.warning("❌ Error convirtiendo datos de cookies individuales: %s", e)
                 return None, None, None
         else:
-            print(f"❌ No se encontró connection_config ni cookies individuales válidas")
+            logger.info("❌ No se encontró connection_config ni cookies individuales válidas")
             return None, None, None
 
     return token, datos_conexion, usuario
@@ -1,11 +1,25 @@
 from django.shortcuts import render, redirect
 import logging
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse
 #from compartidos.cookies_utils import sincronizar_conexion_a_sesion
 from .utils import obtener_datos_cookies, renderizar_error, renderizar_exito, borrar_cookies_sesion
-from .services import comando_verificarToken, comando_controlPendientes, comando_stockControlado
+from .services import (
+    comando_verificarToken, comando_controlPendientes, comando_stockControlado, invalidar_token,
+    comando_verificarToken_async, comando_controlPendientes_async, comando_stockControlado_async,
+    comando_stockControladoLote, comando_verificarYPendientes,
+)
+from .__init__ import (
+    REGISTRO_LOTE_MAX, REGISTRO_LOTE_TAMANIO, REGISTRO_LOTE_DEMORA_MS, PENDIENTES_INLINE,
+    PENDIENTES_VIRTUAL_UMBRAL, PENDIENTES_PAGINA, PENDIENTES_PAGINA_MAX, PENDIENTES_REFRESCO_MS,
+    REGISTRO_DIFERIDO, REGISTRO_DIFERIDO_CONSULTA_MS, METRICAS_TOKEN,
+)
+from . import diferido, metricas
+from .models import RegistroDiferido
+from .pendientes import FORMATO_COLUMNAS, a_columnas, a_dicts, indice_de
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
+import hmac
 import json
 
 
@@ -249,97 +263,227 @@ def setup_mock(request):
 
     return HttpResponse(html)
 
-def controlStock_view(request):
-    print("==== CONTROL STOCK VIEW INICIANDO ====")
-
+def _validar_cookies_controlStock(request):
+    """
+    Devuelve (respuesta_error, token, usuario_cookie, empresa_nombre). Si
+    respuesta_error no es None hay que devolverla directamente.
+    """
     # 1) Cookies
     token, datos_conexion, usuario_cookie = obtener_datos_cookies(request)
 
-    print(f"🔑 Token obtenido: {token}")
-    print(f"📦 Datos conexion: {datos_conexion}")
-    print(f"👤 Usuario cookie: {usuario_cookie}")
+    # Nunca el token: solo si llegó
+    logger.debug("🔑 Token: %s | 📦 Conexión: %s | 👤 Usuario: %s",
+                 "presente" if token else "ausente", datos_conexion, usuario_cookie)
 
     # Obtener nombre de empresa para mensajes de error
     empresa_nombre = datos_conexion.get('nombre', '') if datos_conexion else ''
 
     if not token or not datos_conexion:
-        print("❌ REDIRIGIENDO - No hay token o datos de conexión")
+        logger.info("❌ REDIRIGIENDO - No hay token o datos de conexión")
         return renderizar_error(
             request,
             "No se encontraron credenciales de autenticación",
             empresa_nombre,
             redirect_to='https://cormons.app/'
-        )
+        ), None, None, empresa_nombre
 
     if not usuario_cookie:
-        print("❌ REDIRIGIENDO - No hay usuario activo")
+        logger.info("❌ REDIRIGIENDO - No hay usuario activo")
         return renderizar_error(
             request,
             "No hay usuario activo. Por favor, inicie sesión nuevamente.",
             empresa_nombre,
             redirect_to='https://cormons.app/'
-        )
+        ), None, None, empresa_nombre
 
     empresa_nombre = datos_conexion.get('nombre', 'EmpresaDefault')
 
-    print(f"✅ Token y datos OK - verificando con VFP...")
-
-    # 2) Verificar token
-    verificarToken = comando_verificarToken(token, request)
-
-    print(f"📡 Respuesta verificarToken: {verificarToken}")
+    logger.debug("✅ Token y datos OK - verificando con VFP...")
+    return None, token, usuario_cookie, empresa_nombre
 
-    if not verificarToken["estado"]:
-        mensaje = verificarToken.get("mensaje", "Token inválido")
-        # Limpiar sesión
-        request.session.flush()
-        # Mostrar error - usuario debe presionar Aceptar para redirigir
-        return renderizar_error(request, mensaje, empresa_nombre, redirect_to='https://cormons.app/')
 
+def _renderizar_controlStock(request, verificarToken, empresa_nombre, respuesta_pendientes=None):
+    """
+    Renderiza la pantalla principal a partir de un verificarToken exitoso.
+    Si se pasan los pendientes (modo inline) se renderizan directamente;
+    si no, se muestra el spinner y se cargan con AJAX.
+    """
     usuario = verificarToken["usuario"]
     nombre = verificarToken["nombre"]
     mensaje_vfp = verificarToken.get("mensaje", "")  # Capturar mensaje de VFP si existe
 
     # NOTA: No guardamos en sesión - ya están en cookies (user_usuario, user_nombre)
     # Las cookies son la única fuente de verdad para la autenticación
-    print(f"✅ Usuario verificado: {usuario}")
+    logger.debug("✅ Usuario verificado: %s", usuario)
     if mensaje_vfp:
-        print(f"📢 VFP envió mensaje: {mensaje_vfp}")
-
-    # 3) Renderizar inmediatamente con spinner
-    # Los pendientes se cargarán con AJAX después
-    print("🚀 Renderizando template inmediatamente (pendientes se cargan con AJAX)")
+        logger.info("📢 VFP envió mensaje: %s", mensaje_vfp)
+
+    inline = bool(respuesta_pendientes and respuesta_pendientes.get("estado"))
+    pendientes = respuesta_pendientes.get("pendientes", []) if inline else []
+    # Listas largas: no se renderizan las filas en el template sino que viajan en
+    # columnas dentro de config_js y el navegador dibuja solo las visibles
+    virtual = len(pendientes) > PENDIENTES_VIRTUAL_UMBRAL
+    if inline:
+        logger.debug("🚀 Renderizando template con pendientes inline")
+        if respuesta_pendientes.get("mensaje"):
+            mensaje_vfp = "\n".join(m for m in (mensaje_vfp, respuesta_pendientes["mensaje"]) if m)
+    else:
+        # 3) Renderizar inmediatamente con spinner
+        # Los pendientes se cargarán con AJAX después
+        logger.debug("🚀 Renderizando template inmediatamente (pendientes se cargan con AJAX)")
 
     return render(request, "app_controlStock/controlStock.html", {
-        "pendientes": [],  # Vacío, se cargará con AJAX
+        "pendientes": [] if virtual else pendientes,  # Vacío: se cargará con AJAX
+        "pendientes_virtual": virtual,
         "empresa_nombre": empresa_nombre,
         "usuario": usuario,
         "nombre": nombre,
-        "deposito": "",  # Se cargará con AJAX
+        "deposito": respuesta_pendientes.get("deposito", "") if inline else "",  # Se cargará con AJAX
         "error": False,
-        "loading_pendientes": True,  # Flag para mostrar spinner y auto-cargar
+        "loading_pendientes": not inline,  # Flag para mostrar spinner y auto-cargar
         "mensaje_inicial": mensaje_vfp,  # Mensaje de VFP al verificar token
+        "config_js": {
+            "registroLote": {"tamanio": REGISTRO_LOTE_TAMANIO, "demoraMs": REGISTRO_LOTE_DEMORA_MS},
+            # Versión de los pendientes renderizados inline (para pedir solo el delta al actualizar)
+            "versionPendientes": respuesta_pendientes.get("version") if inline else None,
+            "tablaPendientes": {"umbralVirtual": PENDIENTES_VIRTUAL_UMBRAL, "pagina": PENDIENTES_PAGINA},
+            "pendientesInline": a_columnas(pendientes) if virtual else None,
+            # Los registros se envían en segundo plano: la lista completa se recarga cada tanto
+            "refrescoPendientesMs": PENDIENTES_REFRESCO_MS,
+            # Dueño de los registros guardados en la cola del navegador (IndexedDB)
+            "usuario": usuario,
+            # Registro diferido: el resultado de cada control se consulta en /registrar/estado/
+            "registroDiferido": {"consultaMs": REGISTRO_DIFERIDO_CONSULTA_MS} if REGISTRO_DIFERIDO else None,
+        },
     })
 
 
-def controlPendientes_view(request):
-    """
-    Endpoint JSON que verifica token y devuelve la lista de pendientes.
-    Método: GET
-    Cookies requeridas: 'authToken', 'connection_config' y 'user_usuario' (gestionadas por obtener_datos_cookies)
-    """
+def _pendientes_inline(request):
+    """Modo inline: PENDIENTES_INLINE o ?inline=1 (y ?inline=0 lo desactiva)"""
+    parametro = request.GET.get('inline')
+    if parametro is not None:
+        return parametro == '1'
+    return PENDIENTES_INLINE
+
+
+def controlStock_view(request):
+    logger.debug("==== CONTROL STOCK VIEW INICIANDO ====")
+
+    respuesta_error, token, usuario_cookie, empresa_nombre = _validar_cookies_controlStock(request)
+    if respuesta_error:
+        return respuesta_error
+
+    # 2) Verificar token (y en modo inline traer los pendientes en el mismo intercambio)
+    respuesta_pendientes = None
+    if _pendientes_inline(request):
+        verificarToken, respuesta_pendientes = comando_verificarYPendientes(token, request, usuario_cookie)
+    else:
+        verificarToken = comando_verificarToken(token, request)
+
+    logger.debug("📡 Respuesta verificarToken: %s", verificarToken)
+
+    if not verificarToken["estado"]:
+        mensaje = verificarToken.get("mensaje", "Token inválido")
+        # Limpiar sesión
+        request.session.flush()
+        # Mostrar error - usuario debe presionar Aceptar para redirigir
+        return renderizar_error(request, mensaje, empresa_nombre, redirect_to='https://cormons.app/')
+
+    return _renderizar_controlStock(request, verificarToken, empresa_nombre, respuesta_pendientes)
+
+
+async def controlStock_view_async(request):
+    """Versión async de controlStock_view (ASGI): no bloquea el worker esperando a VFP"""
+    logger.debug("==== CONTROL STOCK VIEW (ASYNC) INICIANDO ====")
+
+    respuesta_error, token, usuario_cookie, empresa_nombre = _validar_cookies_controlStock(request)
+    if respuesta_error:
+        return respuesta_error
+
+    verificarToken = await comando_verificarToken_async(token, request)
+
+    logger.debug("📡 Respuesta verificarToken: %s", verificarToken)
+
+    if not verificarToken["estado"]:
+        mensaje = verificarToken.get("mensaje", "Token inválido")
+        await request.session.aflush()
+        return renderizar_error(request, mensaje, empresa_nombre, redirect_to='https://cormons.app/')
+
+    return _renderizar_controlStock(request, verificarToken, empresa_nombre)
+
+
+def _validar_cookies_pendientes(request):
+    """Devuelve (respuesta_error, token, usuario)"""
     # Obtener token, datos de conexión y usuario desde cookies
     token, datos_conexion, usuario_cookie = obtener_datos_cookies(request)
     if not token or not usuario_cookie:
         return JsonResponse({
             "error": "No hay usuario activo",
             "redirect": "https://cormons.app/login/?logout=1"
-        }, status=401)
+        }, status=401), None, None
 
     # Usar el usuario de la cookie directamente (ya no usamos sesiones)
-    usuario = usuario_cookie
+    return None, token, usuario_cookie
 
-    respuesta_pendientes = comando_controlPendientes(token, request, usrActivo=usuario)
+
+def _version_cliente(request):
+    """?version=N: versión de la lista que ya tiene renderizada el navegador"""
+    return request.GET.get('version') or None
+
+
+def _formato_cliente(request):
+    """?formato=columnas: el navegador acepta la lista en columnas (ver pendientes.a_columnas)"""
+    return FORMATO_COLUMNAS if request.GET.get('formato') == FORMATO_COLUMNAS else None
+
+
+PARAMETROS_PAGINA = ('offset', 'limit', 'q', 'codigo', 'descripcion')
+
+
+def _pagina_cliente(request):
+    """
+    ?offset=&limit= y filtros ?q= (número, código o descripción), ?codigo= (prefijo)
+    y ?descripcion= (substring): el navegador pide una página de la lista filtrada.
+    Devuelve (respuesta_error, pagina); pagina es None si no se pidió paginar
+    o {"offset", "limit", "q", "codigo", "descripcion"}.
+    """
+    if not any(parametro in request.GET for parametro in PARAMETROS_PAGINA):
+        return None, None
+    try:
+        offset = int(request.GET.get('offset') or 0)
+        limit = int(request.GET.get('limit') or PENDIENTES_PAGINA_MAX)
+    except ValueError:
+        return JsonResponse({"error": "offset y limit deben ser números enteros"}, status=400), None
+    if offset < 0 or limit < 1:
+        return JsonResponse({"error": "offset debe ser >= 0 y limit >= 1"}, status=400), None
+    pagina = {"offset": offset, "limit": min(limit, PENDIENTES_PAGINA_MAX)}
+    for filtro in ('q', 'codigo', 'descripcion'):
+        pagina[filtro] = request.GET.get(filtro, '').strip()
+    return None, pagina
+
+
+def _serializar_pendientes(pendientes, formato):
+    return a_columnas(pendientes) if formato == FORMATO_COLUMNAS else a_dicts(pendientes)
+
+
+def _delta_para_cliente(respuesta_pendientes, version_cliente):
+    """
+    Si el navegador ya tiene la versión actual o la versión base del último delta
+    recibido de VFP, alcanza con mandarle las altas/bajas. None = mandar todo.
+    """
+    version = respuesta_pendientes.get("version")
+    if version_cliente is None or version is None:
+        return None
+    if str(version_cliente) == str(version):
+        return {"agregados": [], "eliminados": []}
+    desde = respuesta_pendientes.get("delta_desde")
+    if desde is not None and str(version_cliente) == str(desde):
+        return {"agregados": respuesta_pendientes.get("agregados", []),
+                "eliminados": respuesta_pendientes.get("eliminados", [])}
+    return None
+
+
+def _error_pendientes(respuesta_pendientes):
+    """JsonResponse de error si comando_controlPendientes falló, o None"""
     if not respuesta_pendientes:
         return JsonResponse({"error": "Error al obtener pendientes"}, status=500)
 
@@ -353,35 +497,162 @@ def controlPendientes_view(request):
             "error": mensaje_vfp,
             "redirect": "https://cormons.app/login/?logout=1"
         }, status=401)
+    return None
+
+
+def _respuesta_pendientes(respuesta_pendientes, version_cliente=None, formato=None, pagina=None):
+    """
+    Convierte el resultado de comando_controlPendientes en la respuesta JSON del endpoint.
+    Con formato "columnas" las listas de pendientes viajan como
+    {"id": [...], "codigo": [...], "descripcion": [...], "fecha": [...]}.
+    Con pagina (ver _pagina_cliente) se devuelve solo esa porción de la lista filtrada
+    y el total de coincidencias (sin delta: la versión describe la lista completa).
+    La búsqueda usa el índice del snapshot, que se arma una vez por lista recibida de VFP.
+    """
+    respuesta_error = _error_pendientes(respuesta_pendientes)
+    if respuesta_error:
+        return respuesta_error
 
     pendientes = respuesta_pendientes.get("pendientes", [])
     deposito = respuesta_pendientes.get("deposito", "")
     mensaje = respuesta_pendientes.get("mensaje", "")
 
-    print(f"📦 DEBUG: deposito extraído = {repr(deposito)}")
-    print(f"📦 DEBUG: respuesta_pendientes keys = {list(respuesta_pendientes.keys())}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📦 Depósito %r, claves de la respuesta: %s", deposito, list(respuesta_pendientes))
     if mensaje:
-        print(f"📢 DEBUG: VFP envió mensaje con estado true: {mensaje}")
+        logger.info("📢 VFP envió mensaje con estado true: %s", mensaje)
+
+    version = respuesta_pendientes.get("version")
+    if pagina is not None:
+        filtros = {filtro: pagina[filtro] for filtro in ('q', 'codigo', 'descripcion')}
+        encontrados, total = indice_de(respuesta_pendientes).pagina(pagina["offset"], pagina["limit"], **filtros)
+        return JsonResponse({
+            "formato": formato,
+            "pendientes": _serializar_pendientes(encontrados, formato),
+            "total": total,
+            **pagina,
+            "version": version,
+            "deposito": deposito,
+            "mensaje": mensaje
+        }, status=200)
+
+    delta = _delta_para_cliente(respuesta_pendientes, version_cliente)
+    if delta is not None:
+        logger.debug("📦 Delta para el navegador %s → %s: +%d -%d",
+                     version_cliente, version, len(delta['agregados']), len(delta['eliminados']))
+        return JsonResponse({
+            "delta": True,
+            "formato": formato,
+            "version": version,
+            "agregados": _serializar_pendientes(delta["agregados"], formato),
+            "eliminados": delta["eliminados"],
+            "deposito": deposito,
+            "mensaje": mensaje
+        }, status=200)
 
     return JsonResponse({
-        "pendientes": pendientes,
+        "formato": formato,
+        "pendientes": _serializar_pendientes(pendientes, formato),
+        "version": version,
         "deposito": deposito,
         "mensaje": mensaje
     }, status=200)
 
 
-@csrf_exempt
-@require_POST
-def stockControlado_view(request):
+def controlPendientes_view(request):
     """
-    Endpoint que recibe POST con idSolicitud y cantidad, llama comando_stockControlado y responde JSON.
-    Espera JSON: {token, idSolicitud, cantidad}
+    Endpoint JSON que verifica token y devuelve la lista de pendientes.
+    Método: GET
+    Cookies requeridas: 'authToken', 'connection_config' y 'user_usuario' (gestionadas por obtener_datos_cookies)
+    """
+    respuesta_error, token, usuario = _validar_cookies_pendientes(request)
+    if respuesta_error:
+        return respuesta_error
+    respuesta_error, pagina = _pagina_cliente(request)
+    if respuesta_error:
+        return respuesta_error
+
+    respuesta_pendientes = comando_controlPendientes(token, request, usrActivo=usuario)
+    return _respuesta_pendientes(respuesta_pendientes, _version_cliente(request), _formato_cliente(request), pagina)
+
+
+async def controlPendientes_view_async(request):
+    """Versión async de controlPendientes_view (ASGI)"""
+    respuesta_error, token, usuario = _validar_cookies_pendientes(request)
+    if respuesta_error:
+        return respuesta_error
+    respuesta_error, pagina = _pagina_cliente(request)
+    if respuesta_error:
+        return respuesta_error
+
+    respuesta_pendientes = await comando_controlPendientes_async(token, request, usrActivo=usuario)
+    return _respuesta_pendientes(respuesta_pendientes, _version_cliente(request), _formato_cliente(request), pagina)
+
+
+def _codigo_cliente(request):
+    """Devuelve (respuesta_error, codigo) de ?codigo= (lo que leyó el lector de códigos)"""
+    codigo = request.GET.get('codigo', '').strip()
+    if not codigo:
+        return JsonResponse({"error": "Falta el código a buscar"}, status=400), None
+    return None, codigo
+
+
+def _respuesta_codigo(respuesta_pendientes, codigo, formato=None):
+    """Pendientes con ese código exacto, resueltos con el índice hash del snapshot"""
+    respuesta_error = _error_pendientes(respuesta_pendientes)
+    if respuesta_error:
+        return respuesta_error
+
+    encontrados = indice_de(respuesta_pendientes).por_codigo_exacto(codigo)
+    logger.debug("🔎 Código %r: %d pendiente(s)", codigo, len(encontrados))
+    return JsonResponse({
+        "codigo": codigo,
+        "formato": formato,
+        "pendientes": _serializar_pendientes(encontrados, formato),
+        "total": len(encontrados),
+    }, status=200)
+
+
+def buscarCodigo_view(request):
+    """
+    Endpoint JSON para el lector de códigos de barras: ?codigo=XXX → pendientes con ese código.
+    Método: GET. Usa la misma lista (cacheada) que /pendientes/.
+    """
+    respuesta_error, token, usuario = _validar_cookies_pendientes(request)
+    if respuesta_error:
+        return respuesta_error
+    respuesta_error, codigo = _codigo_cliente(request)
+    if respuesta_error:
+        return respuesta_error
+
+    respuesta_pendientes = comando_controlPendientes(token, request, usrActivo=usuario)
+    return _respuesta_codigo(respuesta_pendientes, codigo, _formato_cliente(request))
+
+
+async def buscarCodigo_view_async(request):
+    """Versión async de buscarCodigo_view (ASGI)"""
+    respuesta_error, token, usuario = _validar_cookies_pendientes(request)
+    if respuesta_error:
+        return respuesta_error
+    respuesta_error, codigo = _codigo_cliente(request)
+    if respuesta_error:
+        return respuesta_error
+
+    respuesta_pendientes = await comando_controlPendientes_async(token, request, usrActivo=usuario)
+    return _respuesta_codigo(respuesta_pendientes, codigo, _formato_cliente(request))
+
+
+def _parsear_registro(request):
+    """
+    Valida el POST de registro.
+    La clave de idempotencia (opcional) viene en el JSON ("idempotencia") o en
+    el header X-Idempotency-Key.
+    Devuelve (respuesta_error, token, usuario, idSolicitud, cantidad, idempotencia)
     """
-    import json
     try:
         data = json.loads(request.body.decode('utf-8'))
     except Exception:
-        return JsonResponse({"estado": False, "mensaje": "JSON inválido"}, status=400)
+        return JsonResponse({"estado": False, "mensaje": "JSON inválido"}, status=400), None, None, None, None, None
 
     token = data.get('token')
 
@@ -393,7 +664,12 @@ def stockControlado_view(request):
     idSolicitud = data.get('idSolicitud')
     cantidad = data.get('cantidad')
     if not token or not idSolicitud or cantidad is None:
-        return JsonResponse({"estado": False, "mensaje": "Faltan datos obligatorios"}, status=400)
+        return JsonResponse({"estado": False, "mensaje": "Faltan datos obligatorios"}, status=400), None, None, None, None, None
+    # Antes de reservar la clave de idempotencia: un error acá no puede dejarla "en curso"
+    try:
+        cantidad = int(cantidad)
+    except (ValueError, TypeError):
+        return JsonResponse({"estado": False, "mensaje": f"Cantidad inválida para {idSolicitud}"}, status=400), None, None, None, None, None
 
     # Obtener usuario desde cookie directamente (ya no usamos sesión)
     usuario = request.COOKIES.get('user_usuario')
@@ -401,13 +677,21 @@ def stockControlado_view(request):
         return JsonResponse({
             "error": "No hay usuario activo",
             "redirect": "https://cormons.app/login/?logout=1"
-        }, status=401)
+        }, status=401), None, None, None, None, None
+
+    idempotencia = data.get('idempotencia') or request.headers.get('X-Idempotency-Key') or None
+    return None, token, usuario, idSolicitud, cantidad, idempotencia
 
-    respuesta = comando_stockControlado(token, request, usuario, idSolicitud, cantidad)
 
+def _respuesta_registro(respuesta):
     estado = respuesta.get('estado', False)
     mensaje = respuesta.get('mensaje', '')
 
+    # Sin confirmar (VFP no respondió o el mismo registro está en curso): el
+    # navegador lo reintenta con la misma clave de idempotencia
+    if respuesta.get('reintentar'):
+        return JsonResponse({"estado": False, "mensaje": mensaje, "reintentar": True}, status=503)
+
     # Verificar si VFP respondió con error (token inválido, versión incorrecta, etc.)
     if estado is False:
         # Retornar 401 para que el frontend redirija al login
@@ -420,9 +704,197 @@ def stockControlado_view(request):
     # Devolver el mensaje tal como viene de VFP (puede ser vacío)
     return JsonResponse({"estado": estado, "mensaje": mensaje})
 
+
+def _registro_diferido(token, request, usuario, items):
+    """
+    202: los controles quedaron guardados; el resultado de VFP se consulta en /registrar/estado/.
+    400 si no hay servidor configurado (no se podrían enviar nunca)
+    """
+    resultados = diferido.encolar(token, request, usuario, items)
+    if resultados is None:
+        return JsonResponse({"estado": False, "mensaje": "No hay cliente configurado"}, status=400)
+    return JsonResponse({"estado": True, "diferido": True, "mensaje": "", "registrados": 0,
+                         "resultados": resultados}, status=202)
+
+
+@csrf_exempt
+@require_POST
+def stockControlado_view(request):
+    """
+    Endpoint que recibe POST con idSolicitud y cantidad, llama comando_stockControlado y responde JSON.
+    Espera JSON: {token, idSolicitud, cantidad, idempotencia (opcional)}
+    """
+    respuesta_error, token, usuario, idSolicitud, cantidad, idempotencia = _parsear_registro(request)
+    if respuesta_error:
+        return respuesta_error
+
+    # Modo diferido (solo con clave de idempotencia): se guarda y se responde sin esperar a VFP
+    if REGISTRO_DIFERIDO and idempotencia:
+        item = {"idSolicitud": idSolicitud, "cantidad": cantidad, "idempotencia": idempotencia}
+        return _registro_diferido(token, request, usuario, [item])
+
+    respuesta = comando_stockControlado(token, request, usuario, idSolicitud, cantidad, idempotencia)
+    return _respuesta_registro(respuesta)
+
+
+@csrf_exempt
+@require_POST
+async def stockControlado_view_async(request):
+    """Versión async de stockControlado_view (ASGI)"""
+    respuesta_error, token, usuario, idSolicitud, cantidad, idempotencia = _parsear_registro(request)
+    if respuesta_error:
+        return respuesta_error
+
+    if REGISTRO_DIFERIDO and idempotencia:
+        item = {"idSolicitud": idSolicitud, "cantidad": cantidad, "idempotencia": idempotencia}
+        return await sync_to_async(_registro_diferido)(token, request, usuario, [item])
+
+    respuesta = await comando_stockControlado_async(token, request, usuario, idSolicitud, cantidad, idempotencia)
+    return _respuesta_registro(respuesta)
+
+@csrf_exempt
+@require_POST
+def stockControladoLote_view(request):
+    """
+    Endpoint que registra varios controles en un único request (y un único intercambio con VFP).
+    Espera JSON: {token, items: [{idSolicitud, cantidad, idempotencia (opcional)}, ...]}
+    Responde: {estado, mensaje, registrados, resultados: [{idSolicitud, estado, mensaje, reintentar?}, ...]}
+    (503 si no se registró ninguno pero alguno quedó sin confirmar, 409 si VFP rechazó todos
+    los items y 401 solo si rechazó el token)
+    """
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except Exception:
+        return JsonResponse({"estado": False, "mensaje": "JSON inválido"}, status=400)
+
+    token = data.get('token')
+    if token:
+        token = token.strip().strip('"').strip("'")
+
+    items = data.get('items')
+    if not token or not isinstance(items, list) or not items:
+        return JsonResponse({"estado": False, "mensaje": "Faltan datos obligatorios"}, status=400)
+    if len(items) > REGISTRO_LOTE_MAX:
+        return JsonResponse({"estado": False, "mensaje": f"Máximo {REGISTRO_LOTE_MAX} items por lote"}, status=400)
+
+    items_validos = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('idSolicitud') or item.get('cantidad') is None:
+            return JsonResponse({"estado": False, "mensaje": "Item inválido en el lote"}, status=400)
+        try:
+            cantidad = int(item['cantidad'])
+        except (ValueError, TypeError):
+            return JsonResponse({"estado": False, "mensaje": f"Cantidad inválida para {item['idSolicitud']}"}, status=400)
+        items_validos.append({"idSolicitud": item['idSolicitud'], "cantidad": cantidad,
+                              "idempotencia": item.get('idempotencia') or None})
+
+    usuario = request.COOKIES.get('user_usuario')
+    if not usuario:
+        return JsonResponse({
+            "error": "No hay usuario activo",
+            "redirect": "https://cormons.app/login/?logout=1"
+        }, status=401)
+
+    if REGISTRO_DIFERIDO and all(item["idempotencia"] for item in items_validos):
+        return _registro_diferido(token, request, usuario, items_validos)
+
+    respuesta = comando_stockControladoLote(token, request, usuario, items_validos)
+
+    if not respuesta["registrados"] and any(r.get("reintentar") for r in respuesta["resultados"]):
+        return JsonResponse(respuesta, status=503)
+
+    # Ninguno registrado por rechazos de cada item (p.ej. ya registrados por otro operador):
+    # la sesión sigue siendo válida, el navegador muestra el resultado de cada uno
+    if not respuesta["registrados"] and not respuesta["token_invalido"]:
+        return JsonResponse(respuesta, status=409)
+
+    # VFP rechazó el token: mismo criterio que /registrar/
+    if not respuesta["registrados"]:
+        return JsonResponse({
+            "error": respuesta["mensaje"] or "Error al registrar controles",
+            "redirect": "https://cormons.app/login/?logout=1",
+            "resultados": respuesta["resultados"],
+        }, status=401)
+
+    return JsonResponse(respuesta)
+
+
+def estadoRegistros_view(request):
+    """
+    Resultado de los registros diferidos del usuario (REGISTRO_DIFERIDO).
+    Método: GET ?claves=clave1,clave2,...
+    Responde: {estado, registros: {clave: {idSolicitud, estado: pendiente|enviando|registrado|rechazado, mensaje}}}
+    Las claves desconocidas no aparecen (el navegador las vuelve a enviar).
+    """
+    usuario = request.COOKIES.get('user_usuario')
+    if not usuario:
+        return JsonResponse({
+            "error": "No hay usuario activo",
+            "redirect": "https://cormons.app/login/?logout=1"
+        }, status=401)
+
+    claves = [c for c in request.GET.get('claves', '').split(',') if c]
+    if len(claves) > REGISTRO_LOTE_MAX:
+        return JsonResponse({"estado": False, "mensaje": f"Máximo {REGISTRO_LOTE_MAX} claves por consulta"}, status=400)
+
+    registros = diferido.estado_de(usuario, claves)
+    # Si este worker todavía no tiene vaciador (p.ej. recién reiniciado), arrancarlo
+    if any(r["estado"] in (RegistroDiferido.PENDIENTE, RegistroDiferido.ENVIANDO) for r in registros.values()):
+        diferido.despertar()
+    return JsonResponse({"estado": True, "registros": registros})
+
+
+def _rechazo_metricas(request):
+    """
+    Control de acceso de los endpoints de métricas: pide el header
+    "Authorization: Bearer <METRICAS_TOKEN>"; sin METRICAS_TOKEN configurado
+    el endpoint no existe (404), nunca queda público.
+    Devuelve la respuesta de rechazo, o None si el request está autorizado
+    """
+    if not METRICAS_TOKEN:
+        return HttpResponse(status=404)
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICAS_TOKEN}"):
+        return HttpResponse(status=401)
+    return None
+
+
+def estadisticasCache_view(request):
+    """
+    Contadores del cache de pendientes de este worker (para ajustar los TTL).
+    Método: GET. Mismo control de acceso que /metrics
+    """
+    from .cache import cache_pendientes
+
+    rechazo = _rechazo_metricas(request)
+    if rechazo is not None:
+        return rechazo
+
+    estadisticas = dict(cache_pendientes.estadisticas)
+    consultas = estadisticas["hits"] + estadisticas["stale"] + estadisticas["misses"]
+    estadisticas["hit_rate"] = round((estadisticas["hits"] + estadisticas["stale"]) / consultas, 4) if consultas else None
+    estadisticas["ttl_fresco"] = cache_pendientes.ttl_fresco
+    estadisticas["ttl_maximo"] = cache_pendientes.ttl_maximo
+    return JsonResponse(estadisticas)
+
+
+def metricas_view(request):
+    """
+    Métricas de todos los workers en el formato de texto de Prometheus.
+    Método: GET. Pide el header "Authorization: Bearer <METRICAS_TOKEN>" (ver _rechazo_metricas)
+    """
+    rechazo = _rechazo_metricas(request)
+    if rechazo is not None:
+        return rechazo
+    return HttpResponse(metricas.exportar(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 def logout_view(request):
     logger.debug("==== LOGOUT VIEW CONTROL STOCK ====")
 
+    # Olvidar la verificación cacheada del token antes de salir
+    token = request.COOKIES.get('authToken')
+    if token:
+        invalidar_token(token, request)
+
     # Crear respuesta de redirección primero
     response = redirect('https://cormons.app/login/?logout=1')
 
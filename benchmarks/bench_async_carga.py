@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Load test: requests concurrentes a /pendientes/ contra un mock VFP lento,
+vista sync (un worker sync atiende de a una) vs vista async (un solo event loop)
+
+Reporta el tiempo total y la concurrencia efectiva (requests en vuelo promedio).
+
+Uso: python benchmarks/bench_async_carga.py [--concurrentes 20] [--latencia 0.5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test import AsyncRequestFactory, RequestFactory  # noqa: E402
+
+from app_controlStock import mock  # noqa: E402
+from app_controlStock.views import controlPendientes_view, controlPendientes_view_async  # noqa: E402
+
+
+def cookies(puerto, i):
+    config = quote(json.dumps({"ip": "127.0.0.1", "puerto": puerto, "nombre": "Bench", "codigo": "B"}))
+    # Un usuario distinto por request para que el cache de pendientes no intervenga
+    return {"authToken": "test_token", "user_usuario": f"bench{i}", "connection_config": config}
+
+
+def correr_sync(puerto, cantidad):
+    factory = RequestFactory()
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(cantidad):
+        request = factory.get('/pendientes/')
+        request.COOKIES.update(cookies(puerto, i))
+        t0 = time.perf_counter()
+        respuesta = controlPendientes_view(request)
+        latencias.append(time.perf_counter() - t0)
+        assert respuesta.status_code == 200, respuesta.content
+    return time.perf_counter() - inicio, latencias
+
+
+async def correr_async(puerto, cantidad):
+    factory = AsyncRequestFactory()
+
+    async def una(i):
+        request = factory.get('/pendientes/')
+        request.COOKIES.update(cookies(puerto, 10_000 + i))
+        t0 = time.perf_counter()
+        respuesta = await controlPendientes_view_async(request)
+        assert respuesta.status_code == 200, respuesta.content
+        return time.perf_counter() - t0
+
+    inicio = time.perf_counter()
+    latencias = await asyncio.gather(*(una(i) for i in range(cantidad)))
+    return time.perf_counter() - inicio, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrentes", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=0.5)
+    args = parser.parse_args()
+
+    _, puerto = mock.iniciar_en_background(latencia=args.latencia)
+
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as nulo:
+        sys.stdout = nulo
+        try:
+            total_sync, lat_sync = correr_sync(puerto, args.concurrentes)
+            total_async, lat_async = asyncio.run(correr_async(puerto, args.concurrentes))
+        finally:
+            sys.stdout = stdout
+
+    for nombre, total, latencias in (("sync", total_sync, lat_sync), ("async", total_async, lat_async)):
+        en_vuelo = sum(latencias) / total
+        print(f"{nombre:>6}: {args.concurrentes} requests en {total:.2f}s  "
+              f"en vuelo promedio={en_vuelo:.1f}  req/s={args.concurrentes / total:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: encriptar/desencriptar por caracter vs variantes sobre bytes
+
+Uso: python benchmarks/bench_cifrado.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_controlStock.algoritmoEncriptacionCasero import (  # noqa: E402
+    encriptar, desencriptar, encriptar_bytes, desencriptar_bytes, texto_a_bytes
+)
+
+TAMANIOS = [1024, 16 * 1024, 128 * 1024, 1024 * 1024]
+
+
+def medir(funcion, repeticiones):
+    return min(timeit.repeat(funcion, number=1, repeat=repeticiones)) * 1000
+
+
+def main():
+    print(f"{'tamaño':>10} {'enc str ms':>11} {'enc bytes ms':>13} {'dec str ms':>11} {'dec bytes ms':>13}")
+    for tamanio in TAMANIOS:
+        texto = "".join(random.choice('{}[]",:0123456789abcdefghijklmnñopqrstuvwxyzÁÉÍÓÚ ') for _ in range(tamanio))
+        cifrado_str = encriptar(texto)
+        cifrado_bytes = cifrado_str.encode('latin-1')
+        repeticiones = 3 if tamanio >= 128 * 1024 else 10
+
+        enc_str = medir(lambda: encriptar(texto).encode('latin-1'), repeticiones)
+        enc_bytes = medir(lambda: encriptar_bytes(texto_a_bytes(texto)), repeticiones)
+        dec_str = medir(lambda: desencriptar(cifrado_bytes.decode('latin-1')), repeticiones)
+        dec_bytes = medir(lambda: desencriptar_bytes(cifrado_bytes).decode('latin-1'), repeticiones)
+
+        print(f"{tamanio:>10} {enc_str:>11.3f} {enc_bytes:>13.3f} {dec_str:>11.3f} {dec_bytes:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: decodificación de controlPendientes completa (desencriptar todo +
+json.loads + normalizar) vs por bloques (json_incremental + normalización por item).
+Mide tiempo y pico de memoria (tracemalloc) por respuesta.
+
+Uso: python benchmarks/bench_decodificacion.py
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app_controlStock import services, tcp_client  # noqa: E402
+from app_controlStock.algoritmoEncriptacionCasero import encriptar_bytes, texto_a_bytes  # noqa: E402
+
+CANTIDADES = [1000, 10000, 50000]
+
+
+def respuesta_cifrada(cantidad):
+    pendientes = [[f"SOL{i:06d}", f"PROD{i:06d}", f"Descripción del artículo {i}", "20241201"]
+                  for i in range(cantidad)]
+    texto = json.dumps({"Estado": "T", "Mensaje": "", "Deposito": "Central", "Pendientes": pendientes},
+                       ensure_ascii=False)
+    return encriptar_bytes(texto_a_bytes(texto))
+
+
+def completa(datos):
+    return services._procesar_controlPendientes(tcp_client._decodificar_json(datos), "t", None)
+
+
+def por_bloques(datos):
+    decodificado = tcp_client._decodificar_json_por_bloques(datos, services._ITEMS_PENDIENTES)
+    return services._procesar_controlPendientes(decodificado, "t", None, normalizado=True)
+
+
+def medir(funcion, datos):
+    # Tiempo y memoria en pasadas separadas: tracemalloc encarece cada asignación
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        inicio = time.perf_counter()
+        resultado = funcion(datos)
+        duracion = (time.perf_counter() - inicio) * 1000
+
+        tracemalloc.start()
+        funcion(datos)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return resultado, duracion, pico / 1024 / 1024
+
+
+def main():
+    print(f"{'items':>7} {'payload MB':>11} {'completa ms':>12} {'pico MB':>8} {'bloques ms':>11} {'pico MB':>8}")
+    for cantidad in CANTIDADES:
+        datos = respuesta_cifrada(cantidad)
+        r_completa, ms_completa, mb_completa = medir(completa, datos)
+        r_bloques, ms_bloques, mb_bloques = medir(por_bloques, datos)
+        assert r_completa["pendientes"] == r_bloques["pendientes"]
+        print(f"{cantidad:>7} {len(datos) / 1024 / 1024:>11.2f} {ms_completa:>12.1f} {mb_completa:>8.1f} "
+              f"{ms_bloques:>11.1f} {mb_bloques:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
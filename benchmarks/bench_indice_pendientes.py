@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: página/búsqueda sobre la lista de pendientes recorriéndola
+entera en cada request (filtro lineal) vs IndicePendientes (armado una vez
+por snapshot; cada página o búsqueda es una consulta al índice).
+
+Uso: python benchmarks/bench_indice_pendientes.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app_controlStock.pendientes import IndicePendientes, Pendiente  # noqa: E402
+
+PALABRAS = ["tornillo", "tuerca", "arandela", "cable", "bulón", "perno", "acero", "zincado",
+            "hexagonal", "m8", "m10", "x", "20mm", "40mm", "galvanizado", "cobre", "unipolar"]
+LIMIT = 50
+
+
+def generar(cantidad):
+    random.seed(1)
+    return [Pendiente(f"SOL{i:06d}", f"P{random.randrange(10**6):06d}",
+                      " ".join(random.choices(PALABRAS, k=4)), "01/12/2024") for i in range(cantidad)]
+
+
+def lineal(pendientes, q="", codigo="", descripcion=""):
+    """Filtro recorriendo toda la lista (como antes del índice)"""
+    q, codigo, descripcion = q.casefold(), codigo.casefold(), descripcion.casefold()
+    encontrados = [p for p in pendientes
+                   if (not codigo or str(p.codigo).casefold().startswith(codigo))
+                   and (not descripcion or descripcion in str(p.descripcion).casefold())
+                   and (not q or q in f"{p.idSolicitud}\x00{p.codigo}\x00{p.descripcion}".casefold())]
+    return encontrados[:LIMIT], len(encontrados)
+
+
+def medir(funcion):
+    return min(timeit.repeat(funcion, number=1, repeat=7)) * 1000
+
+
+CONSULTAS = [
+    ("página 1", {}),
+    ("codigo=P12", {"codigo": "P12"}),
+    ("descripcion=galv", {"descripcion": "galv"}),
+    ("descripcion=m8 x", {"descripcion": "m8 x"}),
+    ("q=sol0012", {"q": "sol0012"}),
+]
+
+
+def sin_memo(indice, filtros):
+    """Primera página de una búsqueda nueva (sin resultados memorizados)"""
+    indice._resultados.clear()
+    indice._fragmentos.clear()
+    return indice.pagina(0, LIMIT, **filtros)
+
+
+def main():
+    for cantidad in (1000, 10000, 50000):
+        pendientes = generar(cantidad)
+        ms_armado = medir(lambda: IndicePendientes(pendientes))
+        ms_palabras = medir(lambda: IndicePendientes(pendientes).por_descripcion("x"))
+        indice = IndicePendientes(pendientes)
+        print(f"\n{cantidad} pendientes (una vez por snapshot: índice {ms_armado:.1f} ms, "
+              f"+ palabras de la descripción {ms_palabras - ms_armado:.1f} ms con la primera búsqueda)")
+        print(f"{'consulta':>18} {'lineal ms':>10} {'índice ms':>10} {'1ra vez ms':>11} {'aceleración':>12}")
+        for nombre, filtros in CONSULTAS:
+            assert lineal(pendientes, **filtros) == indice.pagina(0, LIMIT, **filtros)
+            ms_lineal = medir(lambda: lineal(pendientes, **filtros))
+            # 1ra vez: índice recién armado (sin memo de la búsqueda); luego, páginas siguientes
+            ms_primera = medir(lambda: sin_memo(indice, filtros))
+            ms_indice = medir(lambda: indice.pagina(LIMIT, LIMIT, **filtros))
+            print(f"{nombre:>18} {ms_lineal:>10.3f} {ms_indice:>10.3f} {ms_primera:>11.3f} "
+                  f"{ms_lineal / ms_indice:>11.0f}x")
+
+
+if __name__ == "__main__":
+    main()
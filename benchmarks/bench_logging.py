@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Costo del logging por request: GET / + GET /pendientes/ (sin caches, así cada
+request pasa por verificarToken y controlPendientes contra el mock VFP) con el
+logger de la app en CRITICAL (piso), INFO, DEBUG y DEBUG sin muestreo.
+
+Los logs van a un archivo real (como el log de gunicorn) a través del
+QueueListener de logs.py; se reporta también cuánto se escribió.
+
+Uso: python benchmarks/bench_logging.py [--requests 300] [--pendientes 2000]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+from unittest import mock as umock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test import Client  # noqa: E402
+
+from app_controlStock import logs, mock  # noqa: E402
+from app_controlStock.cache import cache_tokens, cache_pendientes  # noqa: E402
+
+ESCENARIOS = (
+    ("CRITICAL", logging.CRITICAL, None),
+    ("INFO", logging.INFO, None),
+    ("DEBUG", logging.DEBUG, None),
+    ("DEBUG sin muestreo", logging.DEBUG, {}),
+)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def correr(cliente, cantidad):
+    latencias = []
+    for _ in range(cantidad):
+        t0 = time.perf_counter()
+        assert cliente.get('/').status_code == 200
+        assert cliente.get('/pendientes/').status_code == 200
+        latencias.append(time.perf_counter() - t0)
+    return latencias
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--pendientes", type=int, default=2000)
+    args = parser.parse_args()
+
+    _, puerto = mock.iniciar_en_background(pendientes=args.pendientes)
+    config = quote(json.dumps({"ip": "127.0.0.1", "puerto": puerto, "nombre": "Bench",
+                               "framing": "longitud", "keepalive": True}))
+    cliente = Client(HTTP_HOST="127.0.0.1")
+    cliente.cookies.load({"authToken": "test_token", "user_usuario": "admin", "connection_config": config})
+
+    logger = logging.getLogger("app_controlStock")
+    handler = next(h for h in logger.handlers if isinstance(h, logs.HandlerCola))
+    salida = handler.listener.handlers[0]
+    cache_tokens.ttl = 0
+    cache_pendientes.ttl_maximo = 0
+
+    print(f"{args.requests} × (GET / + GET /pendientes/), {args.pendientes} pendientes\n")
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre, nivel, muestreo in ESCENARIOS:
+            ruta = os.path.join(directorio, f"{nivel}-{muestreo is None}.log")
+            with open(ruta, "w") as archivo, \
+                    umock.patch.object(logs, "LOG_MUESTREO", logs.LOG_MUESTREO if muestreo is None else muestreo):
+                anterior = salida.setStream(archivo)
+                logger.setLevel(nivel)
+                correr(cliente, 20)  # Calentamiento
+                descartados = handler.descartados
+                latencias = correr(cliente, args.requests)
+                # Esperar a que el listener termine de escribir lo encolado
+                handler.listener.stop()
+                handler.listener.start()
+                salida.setStream(anterior)
+            total = sum(latencias)
+            print(f"  {nombre:>18}: req/s={args.requests / total:8.1f}  "
+                  f"p50 ms={percentil(latencias, 50) * 1000:6.2f}  p99 ms={percentil(latencias, 99) * 1000:6.2f}  "
+                  f"log={os.path.getsize(ruta) / 1024:8.1f} KB  descartados={handler.descartados - descartados}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: normalización de pendientes con cadenas de dict.get (código
+anterior, un dict por item) vs Esquema con plan cacheado por conjunto de claves
+(un Pendiente con __slots__ por item).
+formatear_fecha queda fuera de la medición (es igual en ambos caminos).
+
+Uso: python benchmarks/bench_normalizacion.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app_controlStock.services import ESQUEMA_PENDIENTE  # noqa: E402
+
+CANTIDAD = 10000
+
+# Variantes de claves que se ven en distintos servidores VFP
+VARIANTES = [
+    ("idSolicitud", "codigo", "descripcion", "fecha"),
+    ("IdSolicitud", "Codigo", "Descripcion", "Fecha"),
+    ("IDSOLICITUD", "CODIGO", "DESCRIPCION", "FECHA"),
+    ("ID", "CODIGO", "DESCRIPCION", "FECHA"),
+]
+
+
+def referencia(item):
+    """Normalización anterior a Esquema (sin formatear_fecha)"""
+    idSolicitud = item.get("idSolicitud", item.get("idsolicitud", item.get("IdSolicitud", item.get("IDSOLICITUD", item.get("ID", "")))))
+    codigo = item.get("codigo", item.get("Codigo", item.get("CODIGO", "")))
+    descripcion = item.get("descripcion", item.get("Descripcion", item.get("DESCRIPCION", "")))
+    fecha = item.get("fecha", item.get("Fecha", item.get("FECHA", "")))
+    return {"idSolicitud": idSolicitud, "codigo": codigo, "descripcion": descripcion, "fecha": fecha}
+
+
+def generar(claves):
+    return [dict(zip(claves, (f"SOL{i:06d}", f"PROD{i}", f"Artículo {i}", "20241201"))) for i in range(CANTIDAD)]
+
+
+def medir(funcion, items):
+    return min(timeit.repeat(lambda: [funcion(i) for i in items], number=1, repeat=7)) * 1000
+
+
+def main():
+    print(f"{'claves':>12} {'dict.get ms':>12} {'Esquema ms':>11} {'aceleración':>12}")
+    escenarios = [(variante[0], generar(variante)) for variante in VARIANTES]
+    mezclados = [item for _, items in escenarios for item in items]
+    random.shuffle(mezclados)
+    escenarios.append(("mezcladas", mezclados[:CANTIDAD]))
+
+    for nombre, items in escenarios:
+        assert [referencia(i) for i in items] == [ESQUEMA_PENDIENTE.normalizar(i).como_dict() for i in items]
+        ms_referencia = medir(referencia, items)
+        ms_esquema = medir(ESQUEMA_PENDIENTE.normalizar, items)
+        print(f"{nombre:>12} {ms_referencia:>12.2f} {ms_esquema:>11.2f} {ms_referencia / ms_esquema:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
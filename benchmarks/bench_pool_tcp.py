@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cliente TCP con y sin pool de conexiones contra el mock VFP
+
+Uso: python benchmarks/bench_pool_tcp.py [--requests 500]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app_controlStock import mock  # noqa: E402
+from app_controlStock.pool_tcp import pool  # noqa: E402
+from app_controlStock.tcp_client import enviar_consulta_tcp  # noqa: E402
+
+MENSAJE = {"Comando": "verificarToken", "Token": "test_token", "Vista": "CONTROLSTOCK", "Version": 1}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def medir(puerto, protocolo, cantidad):
+    creadas = pool.estadisticas["creadas"]
+    latencias = []
+    inicio = time.perf_counter()
+    for _ in range(cantidad):
+        t0 = time.perf_counter()
+        respuesta = enviar_consulta_tcp(MENSAJE, ip_custom='127.0.0.1', puerto_custom=puerto, protocolo=protocolo)
+        latencias.append(time.perf_counter() - t0)
+        assert respuesta.get("estado") is True, respuesta
+    total = time.perf_counter() - inicio
+    conexiones = cantidad if not protocolo['keepalive'] else pool.estadisticas["creadas"] - creadas
+    return {
+        "req/s": cantidad / total,
+        "conexiones": conexiones,
+        "conexiones/s": conexiones / total,
+        "p50 ms": percentil(latencias, 50) * 1000,
+        "p99 ms": percentil(latencias, 99) * 1000,
+        "media ms": statistics.mean(latencias) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    _, puerto = mock.iniciar_en_background()
+    escenarios = {
+        "sin pool": {'framing': 'longitud', 'terminador': 0, 'keepalive': False},
+        "con pool": {'framing': 'longitud', 'terminador': 0, 'keepalive': True},
+    }
+
+    # Silenciar los print() del cliente y del mock durante la medición
+    stdout = sys.stdout
+    resultados = {}
+    with open(os.devnull, 'w') as nulo:
+        sys.stdout = nulo
+        try:
+            for nombre, protocolo in escenarios.items():
+                resultados[nombre] = medir(puerto, protocolo, args.requests)
+        finally:
+            sys.stdout = stdout
+
+    for nombre, r in resultados.items():
+        print(f"{nombre:>10}: " + "  ".join(f"{k}={v:.2f}" for k, v in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: recepción por concatenación de bytes (recv 4096) vs BufferRecepcion (recv_into)
+
+Mide tiempo y pico de memoria asignada (tracemalloc) recibiendo respuestas
+de distintos tamaños por un socketpair, incluyendo desencriptado y json.loads.
+
+Uso: python benchmarks/bench_recepcion.py
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app_controlStock.algoritmoEncriptacionCasero import (  # noqa: E402
+    encriptar_bytes, desencriptar, desencriptar_bytes, texto_a_bytes
+)
+from app_controlStock.tcp_client import BufferRecepcion  # noqa: E402
+
+TAMANIOS = [16 * 1024, 128 * 1024, 512 * 1024, 1000 * 1024]
+
+
+def generar_payload(tamanio):
+    pendientes = []
+    i = 0
+    while len(json.dumps(pendientes)) < tamanio - 200:
+        pendientes.append([f"SOL{i:06d}", f"PROD{i:06d}", f"Producto de prueba {i}", "20241201"])
+        i += 1
+    texto = json.dumps({"estado": True, "pendientes": pendientes}, ensure_ascii=False)
+    return encriptar_bytes(texto_a_bytes(texto))
+
+
+def recibir_concatenando(s):
+    respuesta = b''
+    while True:
+        chunk = s.recv(4096)
+        if not chunk:
+            break
+        respuesta += chunk
+    return json.loads(desencriptar(respuesta.decode('latin-1')))
+
+
+def recibir_con_buffer(s):
+    buffer = BufferRecepcion(maximo=2 * 1024 * 1024)
+    while buffer.recibir(s):
+        pass
+    return json.loads(desencriptar_bytes(buffer.resultado()).decode('latin-1'))
+
+
+def medir(funcion, payload):
+    lector, escritor = socket.socketpair()
+    # Buffers de socket grandes para que la escritura no limite la lectura
+    escritor.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+
+    def enviar():
+        escritor.sendall(payload)
+        escritor.close()
+
+    thread = threading.Thread(target=enviar)
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    thread.start()
+    funcion(lector)
+    duracion = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    thread.join()
+    lector.close()
+    return duracion * 1000, pico / 1024
+
+
+def main():
+    print(f"{'tamaño':>10} {'concat ms':>10} {'concat pico KB':>15} {'buffer ms':>10} {'buffer pico KB':>15}")
+    for tamanio in TAMANIOS:
+        payload = generar_payload(tamanio)
+        concat_ms, concat_kb = medir(recibir_concatenando, payload)
+        buffer_ms, buffer_kb = medir(recibir_con_buffer, payload)
+        print(f"{len(payload):>10} {concat_ms:>10.2f} {concat_kb:>15.0f} {buffer_ms:>10.2f} {buffer_kb:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Suite de carga de punta a punta contra el mock VFP, con resultados en JSON
+para comparar entre commits.
+
+Escenarios:
+  pagina          GET / (controlStock_view) + GET /pendientes/
+  registro        POST /registrar/ (un control distinto por request)
+  tcp             enviar_consulta_tcp(verificarToken) sin Django
+  tcp_pendientes  enviar_consulta_tcp(controlPendientes) con la lista completa
+
+Cada escenario corre en un proceso nuevo (el pico de RSS es solo de ese
+escenario) contra un mock VFP en otro proceso, reiniciado por escenario.
+Modo "inproceso": django.test.Client desde threads. Modo "gunicorn": levanta
+gunicorn (gunicorn_config.py salvo bind/workers) y le pega por HTTP; el RSS es
+la suma de los picos del master y los workers (Linux, /proc).
+
+Uso:
+  python benchmarks/suite.py [--escenarios pagina,registro] [--requests 500]
+      [--concurrencia 8] [--pendientes 2000] [--perfil lan] [--modo inproceso|gunicorn]
+      [--salida resultados.json] [--comparar base.json] [--tolerancia 10]
+
+La base SQLite (reservas de idempotencia, registros diferidos) es una temporal
+migrada para cada ejecución, y las claves de idempotencia llevan un identificador
+de la ejecución: nada se responde desde resultados de una corrida anterior.
+
+Con --comparar imprime la diferencia contra otro resultado y termina con
+código 1 si algún escenario empeoró más que la tolerancia (req/s o p95).
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+# Lo fija el proceso principal; los hijos (escenarios, gunicorn) lo heredan
+EJECUCION = os.environ.setdefault('CONTROLSTOCK_BENCH_EJECUCION', uuid.uuid4().hex[:12])
+
+ESCENARIOS = ("pagina", "registro", "tcp", "tcp_pendientes")
+ESCENARIOS_HTTP = ("pagina", "registro")
+TOKEN = "test_token"
+USUARIO = "admin"
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def resumir(latencias, errores, duracion, rss_kb):
+    return {
+        "requests": len(latencias),
+        "errores": errores,
+        "duracion_s": round(duracion, 3),
+        "req_s": round(len(latencias) / duracion, 2) if duracion else None,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 3),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 3),
+        "media_ms": round(sum(latencias) / len(latencias) * 1000, 3),
+        "rss_pico_mb": round(rss_kb / 1024, 1) if rss_kb else None,
+    }
+
+
+def correr_concurrente(funcion, cantidad, concurrencia, calentamiento):
+    """Ejecuta funcion(i) 'cantidad' veces con 'concurrencia' threads. Devuelve (latencias, errores, duración)"""
+    for i in range(calentamiento):
+        funcion(cantidad + i)
+
+    def una(i):
+        inicio = time.perf_counter()
+        ok = funcion(i)
+        return time.perf_counter() - inicio, ok
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as executor:
+        resultados = list(executor.map(una, range(cantidad)))
+    duracion = time.perf_counter() - inicio
+    return [r[0] for r in resultados], sum(1 for r in resultados if not r[1]), duracion
+
+
+# ============ MOCK VFP (proceso aparte) ============
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def esperar_puerto(puerto, proceso, segundos=30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El proceso terminó al iniciar (código {proceso.returncode})")
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nada escucha en el puerto {puerto}")
+
+
+def iniciar_mock(args, pendientes):
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(RAIZ, "app_controlStock", "mock.py"), "--port", str(puerto),
+         "--perfil", args.perfil, "--pendientes", str(pendientes), "--silencioso"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    esperar_puerto(puerto, proceso)
+    return proceso, puerto
+
+
+def detener(proceso):
+    proceso.terminate()
+    try:
+        proceso.wait(10)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+
+
+def cookies(puerto_mock):
+    config = {"ip": "127.0.0.1", "puerto": puerto_mock, "nombre": "Bench", "framing": "longitud", "keepalive": True}
+    return {"authToken": TOKEN, "user_usuario": USUARIO, "connection_config": quote(json.dumps(config))}
+
+
+def preparar_base(directorio):
+    """Crea y migra una base SQLite temporal; los procesos hijos la usan por CONTROLSTOCK_DB_PATH"""
+    os.environ['CONTROLSTOCK_DB_PATH'] = os.path.join(directorio, "bench.sqlite3")
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+# ============ ESCENARIOS (en el proceso hijo) ============
+
+def _cliente_django(puerto_mock):
+    from django.test import Client
+    cliente = Client(HTTP_HOST="127.0.0.1")
+    for nombre, valor in cookies(puerto_mock).items():
+        cliente.cookies[nombre] = valor
+    return cliente
+
+
+def _pedidos_http(escenario, ejecutar):
+    """Función por request para los escenarios HTTP; ejecutar(metodo, ruta, cuerpo) → status"""
+    if escenario == "pagina":
+        def pedido(i):
+            return ejecutar("GET", "/", None) == 200 and ejecutar("GET", "/pendientes/", None) == 200
+    else:
+        def pedido(i):
+            cuerpo = {"token": TOKEN, "idSolicitud": f"SOL{i + 1:07d}", "cantidad": 1, "idempotencia": f"bench-{EJECUCION}-{i}"}
+            return ejecutar("POST", "/registrar/", json.dumps(cuerpo)) in (200, 202)
+    return pedido
+
+
+def escenario_inproceso(escenario, parametros, puerto_mock):
+    import threading
+    import django
+    django.setup()
+
+    if escenario in ESCENARIOS_HTTP:
+        locales = threading.local()
+
+        def ejecutar(metodo, ruta, cuerpo):
+            cliente = getattr(locales, "cliente", None)
+            if cliente is None:
+                cliente = locales.cliente = _cliente_django(puerto_mock)
+            if metodo == "GET":
+                return cliente.get(ruta).status_code
+            return cliente.post(ruta, cuerpo, content_type="application/json").status_code
+        funcion = _pedidos_http(escenario, ejecutar)
+    else:
+        from app_controlStock import services
+        from app_controlStock.tcp_client import enviar_consulta_tcp
+        protocolo = {'framing': 'longitud', 'terminador': 0, 'keepalive': True, 'lote': False, 'delta': False}
+        if escenario == "tcp":
+            mensaje, procesar = services._mensaje_verificarToken(TOKEN), None
+        else:
+            mensaje, procesar = services._mensaje_controlPendientes(TOKEN, USUARIO), services._ITEMS_PENDIENTES
+
+        def funcion(i):
+            respuesta = enviar_consulta_tcp(mensaje, ip_custom="127.0.0.1", puerto_custom=puerto_mock,
+                                            protocolo=protocolo, procesar_items=procesar)
+            return respuesta.get("estado") is True
+
+    return correr_concurrente(funcion, parametros["requests"], parametros["concurrencia"], parametros["calentamiento"])
+
+
+def main_hijo(escenario, parametros, puerto_mock, salida):
+    import resource
+    # Los logs de la app (stderr) se escriben igual, pero no a la consola; un error sí se muestra
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        latencias, errores, duracion = escenario_inproceso(escenario, parametros, puerto_mock)
+    except BaseException:
+        traceback.print_exc(file=sys.__stderr__)
+        raise
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(salida, "w") as archivo:
+        json.dump(resumir(latencias, errores, duracion, rss_kb), archivo)
+
+
+def correr_en_hijo(escenario, parametros, puerto_mock):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as archivo:
+        salida = archivo.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--interno", escenario,
+                        "--parametros", json.dumps(parametros), "--puerto-mock", str(puerto_mock),
+                        "--salida-interna", salida], check=True)
+        with open(salida) as archivo:
+            return json.load(archivo)
+    finally:
+        os.unlink(salida)
+
+
+# ============ MODO GUNICORN ============
+
+def rss_pico_kb(pid):
+    """VmHWM del proceso y sus hijos (Linux); None si no se puede leer"""
+    total = 0
+    try:
+        pids = [pid] + [int(p) for p in open(f"/proc/{pid}/task/{pid}/children").read().split()]
+        for p in pids:
+            for linea in open(f"/proc/{p}/status"):
+                if linea.startswith("VmHWM:"):
+                    total += int(linea.split()[1])
+    except OSError:
+        return None
+    return total
+
+
+def escenario_gunicorn(escenario, parametros, puerto_mock, workers):
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "proyectoCormons_controlStock.wsgi:application",
+         "-c", os.path.join(RAIZ, "gunicorn_config.py"), "--bind", f"127.0.0.1:{puerto}",
+         "--workers", str(workers), "--error-logfile", "-", "--access-logfile", os.devnull],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        esperar_puerto(puerto, proceso)
+        cabecera_cookies = "; ".join(f"{k}={v}" for k, v in cookies(puerto_mock).items())
+
+        def ejecutar(metodo, ruta, cuerpo):
+            conexion = http.client.HTTPConnection("127.0.0.1", puerto, timeout=60)
+            try:
+                conexion.request(metodo, ruta, body=cuerpo,
+                                 headers={"Cookie": cabecera_cookies, "Content-Type": "application/json"})
+                respuesta = conexion.getresponse()
+                respuesta.read()
+                return respuesta.status
+            finally:
+                conexion.close()
+
+        latencias, errores, duracion = correr_concurrente(
+            _pedidos_http(escenario, ejecutar), parametros["requests"], parametros["concurrencia"],
+            parametros["calentamiento"])
+        return resumir(latencias, errores, duracion, rss_pico_kb(proceso.pid))
+    finally:
+        detener(proceso)
+
+
+# ============ RESULTADOS ============
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(resultados):
+    print(f"{'escenario':>15} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>8} {'RSS MB':>8}")
+    for nombre, r in resultados["escenarios"].items():
+        print(f"{nombre:>15} {r['req_s']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['errores']:>8} {str(r['rss_pico_mb']):>8}")
+
+
+def comparar(resultados, base, tolerancia):
+    """Imprime la diferencia contra 'base'; devuelve los escenarios que empeoraron más que tolerancia (%)"""
+    print(f"\nComparación contra {base.get('commit')} ({base.get('fecha')}):")
+    if base.get("parametros") != resultados["parametros"]:
+        print("⚠️  Los parámetros no coinciden: la comparación es orientativa")
+    regresiones = []
+    for nombre, actual in resultados["escenarios"].items():
+        anterior = base.get("escenarios", {}).get(nombre)
+        if not anterior:
+            continue
+        cambio_rps = (actual["req_s"] / anterior["req_s"] - 1) * 100
+        cambio_p95 = (actual["p95_ms"] / anterior["p95_ms"] - 1) * 100
+        empeoro = cambio_rps < -tolerancia or cambio_p95 > tolerancia
+        if empeoro:
+            regresiones.append(nombre)
+        print(f"{nombre:>15}  req/s {cambio_rps:+6.1f}%  p95 {cambio_p95:+6.1f}%{'  ⚠️  REGRESIÓN' if empeoro else ''}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--modo", choices=("inproceso", "gunicorn"), default="inproceso")
+    parser.add_argument("--workers", type=int, default=3, help="Workers de gunicorn")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--calentamiento", type=int, default=20)
+    parser.add_argument("--pendientes", type=int, default=2000, help="Tamaño de la lista en el mock")
+    parser.add_argument("--perfil", default="lan", help="Perfil de latencia/fallas del mock (ver mock.PERFILES)")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/)")
+    parser.add_argument("--comparar", help="Resultado anterior contra el cual comparar")
+    parser.add_argument("--tolerancia", type=float, default=10.0, help="Porcentaje de empeoramiento aceptado")
+    # Uso interno: un escenario en un proceso hijo
+    parser.add_argument("--interno", help=argparse.SUPPRESS)
+    parser.add_argument("--parametros", help=argparse.SUPPRESS)
+    parser.add_argument("--puerto-mock", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--salida-interna", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        main_hijo(args.interno, json.loads(args.parametros), args.puerto_mock, args.salida_interna)
+        return
+
+    escenarios = [e for e in args.escenarios.split(",") if e]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    parametros = {"requests": args.requests, "concurrencia": args.concurrencia, "calentamiento": args.calentamiento}
+    resultados = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": dict(parametros, modo=args.modo, workers=args.workers, pendientes=args.pendientes,
+                           perfil=args.perfil),
+        "escenarios": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="controlstock-bench-") as directorio:
+        preparar_base(directorio)
+        for escenario in escenarios:
+            # registro consume un pendiente por request: el mock tiene que tener suficientes
+            pendientes = (max(args.pendientes, args.requests + args.calentamiento) if escenario == "registro"
+                          else args.pendientes)
+            mock, puerto_mock = iniciar_mock(args, pendientes)
+            try:
+                if args.modo == "gunicorn" and escenario in ESCENARIOS_HTTP:
+                    resultados["escenarios"][escenario] = escenario_gunicorn(escenario, parametros, puerto_mock,
+                                                                             args.workers)
+                else:
+                    resultados["escenarios"][escenario] = correr_en_hijo(escenario, parametros, puerto_mock)
+            finally:
+                detener(mock)
+
+    imprimir(resultados)
+    salida = args.salida or os.path.join(
+        RAIZ, "benchmarks", "resultados", f"{datetime.now():%Y%m%d-%H%M%S}-{resultados['commit'] or 'sin-commit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w") as archivo:
+        json.dump(resultados, archivo, indent=2)
+    print(f"\n💾 Resultados en {salida}")
+
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            if comparar(resultados, json.load(archivo), args.tolerancia):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# Alternativa ASGI a gunicorn_config.py: workers uvicorn con las vistas async
+# Uso: gunicorn proyectoCormons_controlStock.asgi:application -c gunicorn_asgi_config.py
+import glob
+import os
+
+bind = "127.0.0.1:8003"
+workers = 3
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+keepalive = 5
+errorlog = "/home/cormons/logs/controlstock_error.log"
+accesslog = "/home/cormons/logs/controlstock_access.log"
+loglevel = "info"
+
+# Métricas y cortacircuitos: ver gunicorn_config.py
+os.environ.setdefault("CONTROLSTOCK_METRICAS_DIR", "/home/cormons/metricas/controlstock")
+os.environ.setdefault("CONTROLSTOCK_CIRCUITO_DIR", "/home/cormons/circuito/controlstock")
+
+
+def on_starting(server):
+    for variable in ("CONTROLSTOCK_METRICAS_DIR", "CONTROLSTOCK_CIRCUITO_DIR"):
+        directorio = os.environ[variable]
+        os.makedirs(directorio, exist_ok=True)
+        for archivo in glob.glob(os.path.join(directorio, "*.json")):
+            os.remove(archivo)
+
+
+def post_worker_init(worker):
+    # Registro diferido: ver gunicorn_config.py
+    from app_controlStock import REGISTRO_DIFERIDO
+    if REGISTRO_DIFERIDO:
+        from app_controlStock.diferido import despertar
+        despertar()
@@ -1,3 +1,6 @@
+import glob
+import os
+
 bind = "127.0.0.1:8003"
 workers = 3
 worker_class = "sync"
@@ -5,4 +8,34 @@ timeout = 120
 keepalive = 5
 errorlog = "/home/cormons/logs/controlstock_error.log"
 accesslog = "/home/cormons/logs/controlstock_access.log"
-loglevel = "info"
\ No newline at end of file
+loglevel = "info"
+
+# Métricas: cada worker escribe las suyas acá y /metrics las suma (ver app_controlStock/metricas.py)
+os.environ.setdefault("CONTROLSTOCK_METRICAS_DIR", "/home/cormons/metricas/controlstock")
+# Cortacircuitos: estado de cada servidor VFP compartido por los workers (ver app_controlStock/circuito.py)
+os.environ.setdefault("CONTROLSTOCK_CIRCUITO_DIR", "/home/cormons/circuito/controlstock")
+
+
+def on_starting(server):
+    # Al arrancar el master se empieza de cero: no sumar workers de una ejecución
+    # anterior ni heredar circuitos abiertos
+    for variable in ("CONTROLSTOCK_METRICAS_DIR", "CONTROLSTOCK_CIRCUITO_DIR"):
+        directorio = os.environ[variable]
+        os.makedirs(directorio, exist_ok=True)
+        for archivo in glob.glob(os.path.join(directorio, "*.json")):
+            os.remove(archivo)
+
+
+def post_worker_init(worker):
+    # Registro diferido: cada worker arranca su vaciador (toma también lo que
+    # dejó pendiente un worker anterior)
+    from app_controlStock import REGISTRO_DIFERIDO
+    if REGISTRO_DIFERIDO:
+        from app_controlStock.diferido import despertar
+        despertar()
+
+
+def child_exit(server, worker):
+    # Las métricas de un worker que terminó no se siguen sumando en /metrics
+    from app_controlStock.metricas import borrar
+    borrar(worker.pid, os.environ["CONTROLSTOCK_METRICAS_DIR"])
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyectoCormons_controlStock.settings')
+# Bajo ASGI usar las vistas async de controlStock (cliente VFP sobre asyncio)
+os.environ.setdefault('CONTROLSTOCK_VISTAS_ASYNC', '1')
 
 application = get_asgi_application()
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from app_controlStock import DB_PATH, LOG_NIVEL
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_controlStock.middleware.MetricasMiddleware',  # Primero: mide el request completo
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +53,22 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Logs de la app: JSON por línea, encolados sin bloquear el request y escritos
+# desde un thread (ver app_controlStock/logs.py)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'muestreo': {'()': 'app_controlStock.logs.FiltroMuestreo'},
+    },
+    'handlers': {
+        'cola': {'()': 'app_controlStock.logs.crear_handler_cola', 'filters': ['muestreo']},
+    },
+    'loggers': {
+        'app_controlStock': {'handlers': ['cola'], 'level': LOG_NIVEL, 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'proyectoCormons_controlStock.urls'
 
 TEMPLATES = [
@@ -76,7 +95,16 @@ WSGI_APPLICATION = 'proyectoCormons_controlStock.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': DB_PATH or BASE_DIR / 'db.sqlite3',
+        # Varios threads y workers escriben a la vez (reservas de idempotencia, registros
+        # diferidos): esperar el lock en vez de fallar, tomarlo al empezar cada transacción
+        # (sin upgrade de lectura a escritura, que no respeta el timeout) y WAL para que
+        # las lecturas no esperen a las escrituras
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 